@@ -0,0 +1,410 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.JarURLConnection;
+import java.net.URL;
+import java.net.URLConnection;
+import java.nio.ByteBuffer;
+import java.nio.charset.StandardCharsets;
+import java.security.CodeSigner;
+import java.security.CodeSource;
+import java.security.ProtectionDomain;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.jar.Attributes;
+import java.util.jar.Manifest;
+
+/**
+ * Resident Audiveris process used by audiveris_worker.py.
+ *
+ * Runs with the Audiveris classpath and keeps the JVM (and everything
+ * Audiveris has initialized) alive between scores. Requests are read from
+ * stdin, one tab-separated line each:
+ *
+ *   JOB  id  outputDir  input [input ...]   run "-batch -export" on the inputs
+ *   PING                                    health check
+ *   QUIT                                    exit
+ *
+ * and answered on stdout with "DONE id path...", "FAIL id message" or
+ * "PONG usedHeap maxHeap jobs". Audiveris' own console output is moved to
+ * stderr so it never mixes with the protocol.
+ *
+ * System.exit() calls made by Audiveris are trapped so they end a job, not the
+ * JVM: with a SecurityManager up to JDK 23 (launched with
+ * -Djava.security.manager=allow from JDK 18), and on JDK 24+, where the
+ * SecurityManager is gone, by loading the Audiveris classes through
+ * ExitTrappingLoader, which points their System.exit() calls at exit() here.
+ *
+ * Launched with the Java 11+ source launcher, so no build step is needed:
+ *   java -cp audiveris.jar:lib/* audiveris/worker/AudiverisWorker.java
+ */
+public class AudiverisWorker
+{
+    private static final String MAIN_CLASS = "org.audiveris.omr.Main";
+
+    private static volatile boolean exitAllowed = false;
+
+    /** Thrown instead of letting Audiveris terminate the resident JVM. */
+    private static class ExitTrapped
+            extends SecurityException
+    {
+        final int status;
+
+        ExitTrapped (int status)
+        {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    public static void main (String[] args)
+            throws Exception
+    {
+        PrintStream protocol = new PrintStream(System.out, true, "UTF-8");
+        System.setOut(System.err);
+        ClassLoader loader = AudiverisWorker.class.getClassLoader();
+        if (!trapExit()) {
+            loader = new ExitTrappingLoader(loader);
+            Thread.currentThread().setContextClassLoader(loader);
+        }
+
+        Method omrMain = Class.forName(MAIN_CLASS, true, loader).getMethod("main", String[].class);
+        BufferedReader in = new BufferedReader(
+                new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        Runtime runtime = Runtime.getRuntime();
+        int jobs = 0;
+        protocol.println("READY");
+
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] fields = line.split("\t");
+            switch (fields[0]) {
+            case "PING":
+                protocol.println("PONG\t" + (runtime.totalMemory() - runtime.freeMemory())
+                                         + "\t" + runtime.maxMemory() + "\t" + jobs);
+                break;
+
+            case "QUIT":
+                shutdown();
+                return;
+
+            case "JOB":
+                if (fields.length < 4) {
+                    protocol.println("FAIL\t" + (fields.length > 1 ? fields[1] : "") + "\tmalformed JOB");
+                    break;
+                }
+                jobs++;
+                protocol.println(runJob(omrMain, fields));
+                break;
+
+            default:
+                protocol.println("FAIL\t\tunknown command " + fields[0]);
+            }
+        }
+        shutdown();
+    }
+
+    private static void shutdown ()
+    {
+        // Audiveris may leave non-daemon threads behind
+        exitAllowed = true;
+        System.exit(0);
+    }
+
+    private static String runJob (Method omrMain, String[] fields)
+    {
+        String id = fields[1];
+        File outputDir = new File(fields[2]);
+        List<String> omrArgs = new ArrayList<>(
+                Arrays.asList("-batch", "-export", "-output", outputDir.getPath()));
+        omrArgs.addAll(Arrays.asList(fields).subList(3, fields.length));
+        long started = System.currentTimeMillis();
+
+        try {
+            omrMain.invoke(null, (Object) omrArgs.toArray(new String[0]));
+        } catch (InvocationTargetException ex) {
+            Throwable cause = ex.getCause();
+            if (!(cause instanceof ExitTrapped) || ((ExitTrapped) cause).status != 0) {
+                return "FAIL\t" + id + "\t" + String.valueOf(cause).replace('\t', ' ').replace('\n', ' ');
+            }
+        } catch (ReflectiveOperationException ex) {
+            return "FAIL\t" + id + "\t" + ex;
+        }
+
+        // Report everything Audiveris wrote during this job
+        StringBuilder reply = new StringBuilder("DONE\t").append(id);
+        collect(outputDir, started, reply);
+        return reply.toString();
+    }
+
+    private static void collect (File dir, long since, StringBuilder reply)
+    {
+        File[] files = dir.listFiles();
+        if (files == null) {
+            return;
+        }
+        for (File file : files) {
+            if (file.isDirectory()) {
+                collect(file, since, reply);
+            } else if (file.lastModified() >= since - 1000) {
+                reply.append('\t').append(file.getAbsolutePath());
+            }
+        }
+    }
+
+    /**
+     * Replaces System.exit() in classes loaded by ExitTrappingLoader.
+     */
+    public static void exit (int status)
+    {
+        if (exitAllowed) {
+            System.exit(status);
+        }
+        throw new ExitTrapped(status);
+    }
+
+    /**
+     * Installs a SecurityManager that traps System.exit(); false where the
+     * JVM no longer allows one.
+     */
+    @SuppressWarnings("removal")
+    private static boolean trapExit ()
+    {
+        try {
+            System.setSecurityManager(new SecurityManager()
+            {
+                @Override
+                public void checkExit (int status)
+                {
+                    if (!exitAllowed) {
+                        throw new ExitTrapped(status);
+                    }
+                }
+
+                @Override
+                public void checkPermission (java.security.Permission perm)
+                {
+                }
+            });
+            return true;
+        } catch (UnsupportedOperationException ex) {
+            // JDK 24+, or JDK 18+ without -Djava.security.manager=allow
+            System.err.println("AudiverisWorker: no SecurityManager, rewriting System.exit calls instead");
+            return false;
+        }
+    }
+
+    /**
+     * Loads the Audiveris classes itself (everything else is delegated) and
+     * points every call to System.exit(int) in them at AudiverisWorker.exit(int).
+     *
+     * The rewrite only touches the constant pool: a Class constant for
+     * AudiverisWorker is appended and the System.exit method reference is
+     * switched to it. Both methods are static (I)V, so the bytecode and its
+     * stack map frames stay valid.
+     */
+    private static class ExitTrappingLoader
+            extends ClassLoader
+    {
+        private static final String PREFIX = "org.audiveris.";
+
+        private static final String TARGET = "AudiverisWorker";
+
+        private final Map<String, ProtectionDomain> domains = new HashMap<>();
+
+        ExitTrappingLoader (ClassLoader parent)
+        {
+            super(parent);
+        }
+
+        @Override
+        protected Class<?> loadClass (String name,
+                                      boolean resolve)
+                throws ClassNotFoundException
+        {
+            if (!name.startsWith(PREFIX)) {
+                return super.loadClass(name, resolve);
+            }
+            synchronized (getClassLoadingLock(name)) {
+                Class<?> loaded = findLoadedClass(name);
+                if (loaded == null) {
+                    loaded = findClass(name);
+                }
+                if (resolve) {
+                    resolveClass(loaded);
+                }
+                return loaded;
+            }
+        }
+
+        @Override
+        protected Class<?> findClass (String name)
+                throws ClassNotFoundException
+        {
+            String path = name.replace('.', '/') + ".class";
+            URL url = getParent().getResource(path);
+            if (url == null) {
+                throw new ClassNotFoundException(name);
+            }
+            try {
+                URLConnection connection = url.openConnection();
+                byte[] bytes;
+                try (InputStream in = connection.getInputStream()) {
+                    bytes = redirectExit(in.readAllBytes());
+                }
+                definePackageOf(name, connection);
+                return defineClass(name, bytes, 0, bytes.length, domainOf(url, path, connection));
+            } catch (IOException ex) {
+                throw new ClassNotFoundException(name, ex);
+            }
+        }
+
+        /** Same package metadata as the JAR manifest gives the application class loader. */
+        private void definePackageOf (String name,
+                                      URLConnection connection)
+                throws IOException
+        {
+            String pkg = name.substring(0, name.lastIndexOf('.'));
+            if (getDefinedPackage(pkg) != null) {
+                return;
+            }
+            Manifest manifest = (connection instanceof JarURLConnection)
+                    ? ((JarURLConnection) connection).getManifest() : null;
+            if (manifest == null) {
+                definePackage(pkg, null, null, null, null, null, null, null);
+                return;
+            }
+            Attributes main = manifest.getMainAttributes();
+            definePackage(pkg,
+                          main.getValue(Attributes.Name.SPECIFICATION_TITLE),
+                          main.getValue(Attributes.Name.SPECIFICATION_VERSION),
+                          main.getValue(Attributes.Name.SPECIFICATION_VENDOR),
+                          main.getValue(Attributes.Name.IMPLEMENTATION_TITLE),
+                          main.getValue(Attributes.Name.IMPLEMENTATION_VERSION),
+                          main.getValue(Attributes.Name.IMPLEMENTATION_VENDOR),
+                          null);
+        }
+
+        /** Code source of the JAR (or directory) the class came from; Audiveris finds its files by it. */
+        private ProtectionDomain domainOf (URL url,
+                                           String path,
+                                           URLConnection connection)
+                throws IOException
+        {
+            String spec = url.toString();
+            URL location = (connection instanceof JarURLConnection)
+                    ? ((JarURLConnection) connection).getJarFileURL()
+                    : new URL(spec.substring(0, spec.length() - path.length()));
+            ProtectionDomain domain = domains.get(location.toString());
+            if (domain == null) {
+                CodeSource source = new CodeSource(location, (CodeSigner[]) null);
+                domain = new ProtectionDomain(source, null, this, null);
+                domains.put(location.toString(), domain);
+            }
+            return domain;
+        }
+
+        /** The class file with System.exit(I)V references redirected, or unchanged if it has none. */
+        static byte[] redirectExit (byte[] bytes)
+        {
+            ByteBuffer buffer = ByteBuffer.wrap(bytes);
+            int count = buffer.getShort(8) & 0xFFFF;
+            int[] offsets = new int[count]; // of each constant's tag; 0 for unused slots
+            int position = 10;
+            for (int i = 1; i < count; i++) {
+                offsets[i] = position;
+                switch (bytes[position]) {
+                case 1: // Utf8
+                    position += 3 + (buffer.getShort(position + 1) & 0xFFFF);
+                    break;
+                case 5: // Long
+                case 6: // Double
+                    position += 9;
+                    i++;
+                    break;
+                case 7: // Class
+                case 8: // String
+                case 16: // MethodType
+                case 19: // Module
+                case 20: // Package
+                    position += 3;
+                    break;
+                case 15: // MethodHandle
+                    position += 4;
+                    break;
+                case 3: // Integer
+                case 4: // Float
+                case 9: // Fieldref
+                case 10: // Methodref
+                case 11: // InterfaceMethodref
+                case 12: // NameAndType
+                case 17: // Dynamic
+                case 18: // InvokeDynamic
+                    position += 5;
+                    break;
+                default:
+                    return bytes; // not a class file this understands
+                }
+            }
+
+            List<Integer> exits = new ArrayList<>();
+            for (int i = 1; i < count; i++) {
+                if (offsets[i] == 0 || bytes[offsets[i]] != 10) {
+                    continue;
+                }
+                int owner = operand(buffer, offsets, i, 0);
+                int nameAndType = operand(buffer, offsets, i, 1);
+                if ("java/lang/System".equals(utf8(buffer, offsets, operand(buffer, offsets, owner, 0)))
+                        && "exit".equals(utf8(buffer, offsets, operand(buffer, offsets, nameAndType, 0)))
+                        && "(I)V".equals(utf8(buffer, offsets, operand(buffer, offsets, nameAndType, 1)))) {
+                    exits.add(offsets[i]);
+                }
+            }
+            if (exits.isEmpty() || count + 2 > 0xFFFF) {
+                return bytes;
+            }
+
+            // Append Utf8 "AudiverisWorker" (index count) and Class #count (index count + 1)
+            byte[] name = TARGET.getBytes(StandardCharsets.UTF_8);
+            ByteBuffer patched = ByteBuffer.allocate(bytes.length + 3 + name.length + 3);
+            patched.put(bytes, 0, position);
+            patched.putShort(8, (short) (count + 2));
+            for (int offset : exits) {
+                patched.putShort(offset + 1, (short) (count + 1));
+            }
+            patched.put((byte) 1).putShort((short) name.length).put(name);
+            patched.put((byte) 7).putShort((short) count);
+            patched.put(bytes, position, bytes.length - position);
+            return patched.array();
+        }
+
+        /** The field-th u2 operand of constant #index. */
+        private static int operand (ByteBuffer buffer,
+                                    int[] offsets,
+                                    int index,
+                                    int field)
+        {
+            return buffer.getShort(offsets[index] + 1 + 2 * field) & 0xFFFF;
+        }
+
+        private static String utf8 (ByteBuffer buffer,
+                                    int[] offsets,
+                                    int index)
+        {
+            int offset = offsets[index];
+            if (offset == 0 || buffer.get(offset) != 1) {
+                return null;
+            }
+            int length = buffer.getShort(offset + 1) & 0xFFFF;
+            return new String(buffer.array(), offset + 3, length, StandardCharsets.UTF_8);
+        }
+    }
+}
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Index of Audiveris books
+
+Audiveris writes a `.omr` project book next to every export. The book holds the
+full recognition result, so exporting a page subset again, or deriving another
+MIDI variant from the exported MusicXML, never needs the image recognized
+again. BookIndex keeps one directory per recognized input, keyed by a hash of
+the input image and the options that affect recognition:
+
+    <root>/<key[:2]>/<key>/book.json      metadata (input, name, version, created)
+    <root>/<key[:2]>/<key>/<name>.omr     the Audiveris book
+    <root>/<key[:2]>/<key>/<name>.mxl     the full-score MusicXML export
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+METADATA_NAME = "book.json"
+
+
+class Book:
+    """One indexed recognition result."""
+
+    def __init__(self, key, directory, metadata):
+        self.key = key
+        self.directory = directory
+        self.metadata = metadata
+
+    @property
+    def name(self):
+        """Stem used for the book and MusicXML files."""
+        return self.metadata["name"]
+
+    @property
+    def book_path(self):
+        """Path of the .omr book, or None if Audiveris did not write one."""
+        book = self.metadata.get("book")
+        return os.path.join(self.directory, book) if book else None
+
+    @property
+    def musicxml_path(self):
+        """Path of the stored full-score MusicXML export."""
+        return os.path.join(self.directory, self.metadata["musicxml"])
+
+
+class BookIndex:
+    """Directory-per-key store of Audiveris books and their MusicXML exports.
+
+    Entries are written to a staging directory and renamed into place, so
+    concurrent batch workers never see half-written books.
+    """
+
+    def __init__(self, root):
+        self.root = root  # created by the first put
+
+    def _entry_dir(self, key):
+        """Directory of the entry for key."""
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        """Return the Book for key, or None when it is missing or incomplete."""
+        directory = self._entry_dir(key)
+        try:
+            with open(os.path.join(directory, METADATA_NAME)) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        book = Book(key, directory, metadata)
+        if not os.path.exists(book.musicxml_path):
+            return None
+        return book
+
+    def put(self, key, input_path, name, musicxml_path, book_path=None, version=None):
+        """Copy a MusicXML export (and its .omr book, if any) into the index."""
+        directory = self._entry_dir(key)
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.root)
+        try:
+            metadata = {
+                "input": os.path.abspath(input_path),
+                "name": name,
+                "musicxml": name + os.path.splitext(musicxml_path)[1],
+                "book": None,
+                "version": version,
+                "created": time.time(),
+            }
+            shutil.copyfile(musicxml_path, os.path.join(staging, metadata["musicxml"]))
+            if book_path and os.path.exists(book_path):
+                metadata["book"] = name + ".omr"
+                shutil.copyfile(book_path, os.path.join(staging, metadata["book"]))
+            with open(os.path.join(staging, METADATA_NAME), "w") as f:
+                json.dump(metadata, f, indent=2)
+            if os.path.exists(directory):
+                # Recognized again (e.g. --no-reuse): the newer result replaces the old
+                shutil.rmtree(directory, ignore_errors=True)
+            try:
+                os.replace(staging, directory)
+            except OSError:
+                # Another process indexed the same input first; keep its entry
+                pass
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return self.get(key)
+
+    def entries(self):
+        """Yield every indexed Book."""
+        if not os.path.isdir(self.root):
+            return
+        for shard in sorted(os.listdir(self.root)):
+            shard_dir = os.path.join(self.root, shard)
+            if shard.startswith(".") or not os.path.isdir(shard_dir):
+                continue
+            for key in sorted(os.listdir(shard_dir)):
+                book = self.get(key)
+                if book is not None:
+                    yield book
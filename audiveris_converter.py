@@ -12,6 +12,7 @@ Requirements:
 
 Usage:
     python audiveris_converter.py <input_image_path> [output_directory]
+    python audiveris_converter.py <images, directories or globs...> [-o output_directory]
 
 Example:
     python audiveris_converter.py backend/uploads/testimage.png
@@ -25,15 +26,47 @@ import argparse
 import urllib.request
 import zipfile
 import shutil
+import glob
+import json
+import math
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+from audiveris_books import BookIndex
+from audiveris_jvm import JvmTuning, classpath_for, jar_identity, load_toolchain, probe_java, save_toolchain
+from audiveris_worker import AudiverisWorkerPool, WorkerError, java_major_version
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pipeline modules shared with the web backend (MusicXML -> MIDI, ...)
+BACKEND_DIR = os.path.join(SCRIPT_DIR, "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+
+from cache import hash_file, make_key  # noqa: E402
+from metrics import REGISTRY, run_measured, span, traced  # noqa: E402
+from scheduler import detect_cores, plan  # noqa: E402
+
+# How recognized scores are exported: page subset, part subset, transposition,
+# tempo scaling, and whether MIDI is written at all
+DEFAULT_VARIANT = {"pages": None, "parts": None, "transpose": 0, "tempo_scale": 1.0, "midi": True}
+
 
 class AudiverisConverter:
     """Handles Audiveris installation and sheet music conversion."""
     
     AUDIVERIS_VERSION = "5.3"
     AUDIVERIS_URL = f"https://github.com/Audiveris/audiveris/releases/download/{AUDIVERIS_VERSION}/audiveris-{AUDIVERIS_VERSION}.zip"
-    AUDIVERIS_DIR = "audiveris"
+    # Next to this script, not in the working directory the server happens to start from;
+    # MOBILSHEETS_AUDIVERIS_STATE_DIR moves the book index, toolchain probe, CDS archive and logs
+    AUDIVERIS_DIR = os.environ.get("MOBILSHEETS_AUDIVERIS_STATE_DIR", os.path.join(SCRIPT_DIR, "audiveris"))
+    TOOLCHAIN_CACHE = os.path.join(AUDIVERIS_DIR, "toolchain.json")
+    CDS_ARCHIVE = os.path.join(AUDIVERIS_DIR, "audiveris.jsa")
+    MANIFEST_NAME = "manifest.json"
+    MAX_GROUP_SIZE = 8
+    INPUT_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".pdf")
     POSSIBLE_JAR_PATHS = [
         # Bundled JAR files (preferred)
         f"audiveris/audiveris-{AUDIVERIS_VERSION}.jar",
@@ -46,31 +79,55 @@ class AudiverisConverter:
         "/opt/audiveris/audiveris.jar"
     ]
     
-    def __init__(self):
+    def __init__(self, workers=0, max_jobs_per_worker=50, max_worker_memory_mb=None,
+                 preprocess_steps=None, variant=None, reuse_books=True, books_dir=None, cds=True,
+                 jvm_threads=None):
         self.audiveris_path = None
+        self.java_version = None
+        self.classpath = None
+        self.cds = cds
+        self.jvm_threads = jvm_threads
+        self.jvm = None
+        self.workers = workers
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_worker_memory_mb = max_worker_memory_mb
+        self.worker_pool = None
+        self.preprocess_steps = preprocess_steps
+        self.preprocess_config = None
+        if preprocess_steps:
+            try:
+                from preprocess import PreprocessConfig
+                self.preprocess_config = PreprocessConfig(steps=preprocess_steps)
+            except ImportError:
+                print("Note: Install opencv-python and numpy to preprocess images:")
+                print("  pip install opencv-python numpy")
+        self.variant = dict(DEFAULT_VARIANT, **(variant or {}))
+        self.reuse_books = reuse_books
+        self.books_dir = books_dir or os.path.join(self.AUDIVERIS_DIR, "books")
+        self.book_index = BookIndex(self.books_dir)
         
     def check_java(self):
         """Check if Java is installed and get version."""
-        try:
-            result = subprocess.run(["java", "-version"], 
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                version_info = result.stderr.split('\n')[0]
-                print(f"✓ Java found: {version_info}")
-                return True
-            else:
-                print("✗ Java not found")
-                return False
-        except FileNotFoundError:
+        version_info = probe_java()
+        if version_info is None:
             print("✗ Java not found")
             return False
+        self.java_version = version_info
+        print(f"✓ Java found: {version_info}")
+        return True
     
     def find_audiveris_jar(self):
         """Find Audiveris JAR file in common locations."""
+        # Relative locations are tried from the working directory, then next to this script
+        candidates = []
         for jar_path in self.POSSIBLE_JAR_PATHS:
+            candidates.append(jar_path)
+            if not os.path.isabs(jar_path):
+                candidates.append(os.path.join(SCRIPT_DIR, jar_path))
+        for jar_path in candidates:
             if os.path.exists(jar_path):
                 # Check if it's our placeholder file
-                if jar_path.startswith("audiveris/") and os.path.getsize(jar_path) < 1000:
+                if "audiveris/" in jar_path and os.path.getsize(jar_path) < 1000:
                     # This is likely our placeholder file
                     with open(jar_path, 'r') as f:
                         content = f.read()
@@ -109,6 +166,14 @@ class AudiverisConverter:
     
     def convert_image_to_midi(self, input_path, output_dir=None):
         """Convert sheet music image to MIDI using Audiveris."""
+        with traced() as trace:
+            midi_file = self._convert_image_to_midi(input_path, output_dir)
+        if trace.spans:
+            print("⏱ " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in trace.totals().items()))
+        return midi_file
+    
+    def _convert_image_to_midi(self, input_path, output_dir):
+        """Single-image conversion behind convert_image_to_midi."""
         
         # Validate input file
         if not os.path.exists(input_path):
@@ -128,107 +193,410 @@ class AudiverisConverter:
         print(f"Output directory: {output_dir}")
         
         try:
-            # Check if we have the full lib directory or just the JAR
-            audiveris_dir = os.path.dirname(self.audiveris_path)
-            lib_dir = os.path.join(audiveris_dir, "lib")
-            
-            if os.path.exists(lib_dir):
-                # Use classpath with all JARs from lib directory
-                classpath = f"{self.audiveris_path}:{lib_dir}/*"
-                cmd = [
-                    "java",
-                    "-cp", classpath,
-                    "org.audiveris.omr.Main",
-                    "-batch",  # Run in batch mode
-                    "-export",  # Export results
-                    "-output", output_dir,  # Output directory
-                    input_path  # Input image
-                ]
-            else:
-                # Fallback to single JAR (if it has a manifest)
-                cmd = [
-                    "java",
-                    "-jar", self.audiveris_path,
-                    "-batch",  # Run in batch mode
-                    "-export",  # Export results
-                    "-output", output_dir,  # Output directory
-                    input_path  # Input image
-                ]
-            
-            print(f"Running command: {' '.join(cmd)}")
-            
-            # Run Audiveris
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout
-            )
-            
-            if result.returncode == 0:
-                print("✓ Audiveris processing completed successfully")
-                
-                # Look for generated files
-                midi_files = []
-                musicxml_files = []
-                for root, dirs, files in os.walk(output_dir):
-                    for file in files:
-                        if file.lower().endswith(('.mid', '.midi')):
-                            midi_files.append(os.path.join(root, file))
-                        elif file.lower().endswith(('.mxl', '.musicxml', '.xml')):
-                            musicxml_files.append(os.path.join(root, file))
-                
-                if midi_files:
-                    print(f"✓ Generated MIDI files:")
-                    for midi_file in midi_files:
-                        print(f"  - {midi_file}")
-                    return midi_files[0]  # Return the first MIDI file found
-                elif musicxml_files:
-                    print(f"✓ Generated MusicXML files:")
-                    for xml_file in musicxml_files:
-                        print(f"  - {xml_file}")
-                    print("\nNote: Audiveris generates MusicXML format, which is more comprehensive than MIDI.")
-                    print("MusicXML files can be opened with music notation software like MuseScore.")
-                    
-                    # Try to convert MusicXML to MIDI if possible
-                    return self._convert_musicxml_to_midi(musicxml_files[0], output_dir)
-                else:
-                    print("⚠ No music files found in output directory")
-                    # List all files in output directory for debugging
-                    print("Files in output directory:")
-                    for root, dirs, files in os.walk(output_dir):
-                        for file in files:
-                            print(f"  - {os.path.join(root, file)}")
-                    return None
-                    
-            else:
-                print(f"✗ Audiveris failed with return code {result.returncode}")
-                print(f"STDOUT: {result.stdout}")
-                print(f"STDERR: {result.stderr}")
-                return None
-                
+            musicxml_path = self._musicxml_for(input_path, Path(input_path).stem, output_dir)
         except subprocess.TimeoutExpired:
             print("✗ Audiveris processing timed out (5 minutes)")
             return None
         except Exception as e:
             print(f"✗ Error running Audiveris: {e}")
             return None
+        
+        print(f"✓ MusicXML file: {musicxml_path}")
+        if not self.variant["midi"]:
+            return musicxml_path
+        return self._convert_musicxml_to_midi(musicxml_path, output_dir)
+    
+    def book_key(self, input_path):
+        """Index key of an input: its contents plus everything that changes recognition."""
+        options = {
+            "preprocess": list(self.preprocess_config.steps) if self.preprocess_config else [],
+            # Books from another Audiveris build (or a stand-in JAR) never match
+            "engine": jar_identity(self.audiveris_path) if self.audiveris_path else None,
+        }
+        return make_key(hash_file(input_path), "audiveris", self.AUDIVERIS_VERSION, options)
+    
+    def _musicxml_for(self, input_path, name, output_dir):
+        """Write <name>.mxl for an input to output_dir, recognizing it only if no book is indexed."""
+        key = self.book_key(input_path)
+        book = self.book_index.get(key) if self.reuse_books else None
+        if book is not None:
+            print(f"↺ Reusing Audiveris book for {input_path} (recognized earlier, skipping OMR)")
+        else:
+            work_dir = tempfile.mkdtemp(prefix=".recognize-", dir=output_dir)
+            try:
+                staged = self._stage_input(input_path, name, work_dir)
+                exported = self.recognize(staged, work_dir)
+                print("✓ Audiveris processing completed successfully")
+                book = self._index_book(key, input_path, name, exported)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        return self._export_variant(book, name, output_dir)
+    
+    def _index_book(self, key, input_path, name, exported):
+        """Store a fresh export and the .omr book Audiveris wrote next to it."""
+        book_path = os.path.join(os.path.dirname(exported), Path(exported).stem + ".omr")
+        book = self.book_index.put(key, input_path, name, exported, book_path, self.AUDIVERIS_VERSION)
+        if book.book_path:
+            print(f"✓ Audiveris book indexed: {book.book_path}")
+        return book
+    
+    def _export_variant(self, book, name, output_dir):
+        """Copy the book's MusicXML to output_dir, re-exporting a page subset from the .omr if asked."""
+        pages = self.variant["pages"]
+        if pages and book.book_path:
+            export_dir = tempfile.mkdtemp(prefix=".export-", dir=output_dir)
+            try:
+                exported = self._export_book(book, pages, export_dir)
+                target = os.path.join(output_dir, name + os.path.splitext(exported)[1])
+                shutil.move(exported, target)
+            finally:
+                shutil.rmtree(export_dir, ignore_errors=True)
+            return target
+        if pages:
+            print("⚠ No Audiveris book stored for this input; exporting all pages")
+        target = os.path.join(output_dir, name + os.path.splitext(book.musicxml_path)[1])
+        shutil.copyfile(book.musicxml_path, target)
+        return target
+    
+    def _export_book(self, book, pages, output_dir):
+        """Export selected sheets of a stored .omr book without recognizing anything again."""
+        print(f"Re-exporting sheets {' '.join(pages)} from {book.book_path}")
+        # A book export loads too few classes to be worth archiving
+        cmd, _ = self._audiveris_command(["-batch", "-export", "-sheets", *pages,
+                                          "-output", output_dir, book.book_path], dump=False)
+        with span("book_export", engine="audiveris"):
+            result, _ = run_measured(cmd, "audiveris_export", timeout=300)
+        if result.returncode != 0:
+            detail = (result.stderr or result.stdout or "").strip()[-500:]
+            raise RuntimeError(f"Audiveris export failed with return code {result.returncode}: {detail}")
+        for ext in (".mxl", ".musicxml", ".xml"):
+            candidate = os.path.join(output_dir, Path(book.book_path).stem + ext)
+            if os.path.exists(candidate):
+                return candidate
+        raise RuntimeError("Audiveris exported no MusicXML from the book")
+    
+    def recognize(self, input_path, output_dir, timeout=None, cancel=None):
+        """Run OMR on one image and return the path of the exported MusicXML.
+        
+        Raises on failure instead of printing. ``cancel`` is an optional
+        threading.Event that kills a one-shot Audiveris JVM when set.
+        """
+        input_path = os.path.abspath(input_path)
+        output_dir = os.path.abspath(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+        
+        if self.worker_pool is not None:
+            with span("omr", engine="audiveris"):
+                self.worker_pool.convert([input_path], output_dir, timeout=timeout or 300)
+        else:
+            result = self._run_audiveris([input_path], output_dir, timeout=timeout, cancel=cancel)
+            if result.returncode != 0:
+                detail = (result.stderr or result.stdout or "").strip()[-500:]
+                raise RuntimeError(f"Audiveris failed with return code {result.returncode}: {detail}")
+        
+        stem = Path(input_path).stem
+        for ext in (".mxl", ".musicxml", ".xml"):
+            candidate = os.path.join(output_dir, stem + ext)
+            if os.path.exists(candidate):
+                return candidate
+        raise RuntimeError("Audiveris exported no MusicXML")
+    
+    def convert_batch(self, input_paths, output_dir=None, jobs=None, group_size=None, force=False):
+        """Convert many images, several per Audiveris run, with runs spread over a pool.
+        
+        Results are recorded in <output_dir>/manifest.json. Inputs that the manifest
+        already lists as converted with the same variant (and that have not changed
+        since) are skipped.
+        """
+        if output_dir is None:
+            output_dir = "audiveris_output"
+        os.makedirs(output_dir, exist_ok=True)
+        output_dir = os.path.abspath(output_dir)
+        
+        manifest_path = os.path.join(output_dir, self.MANIFEST_NAME)
+        manifest = load_manifest(manifest_path)
+        names = output_names(input_paths)
+        # As it reads back from the manifest, so the comparison is exact
+        variant = json.loads(json.dumps(self.variant))
+        
+        pending = []
+        for input_path in input_paths:
+            stat = os.stat(input_path)
+            previous = manifest["entries"].get(input_path)
+            if not force and is_up_to_date(previous, stat, variant):
+                print(f"↷ Skipping {input_path} (already converted)")
+                continue
+            pending.append({
+                "input": input_path,
+                "name": names[input_path],
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "variant": variant,
+            })
+        
+        if not pending:
+            print("✓ Nothing to convert")
+            return manifest
+        
+        if self.worker_pool is not None:
+            # Resident JVMs live in this process, so drive them from threads
+            jobs = self.worker_pool.size
+            executor = ThreadPoolExecutor(max_workers=jobs)
+        else:
+            # Split the usable cores (affinity mask, cgroup quota) into JVMs x threads per JVM
+            jobs, threads = plan(detect_cores()["usable"], workers=jobs or 0, threads=self.jvm_threads or 0)
+            if self.jvm and not self.jvm.active_processors:
+                self.jvm.active_processors = threads
+            executor = ProcessPoolExecutor(max_workers=jobs)
+        
+        # Enough groups to keep every worker busy, but no more JVM launches than needed
+        group_size = group_size or max(1, min(self.MAX_GROUP_SIZE, math.ceil(len(pending) / jobs)))
+        groups = [pending[i:i + group_size] for i in range(0, len(pending), group_size)]
+        print(f"Converting {len(pending)} image(s) in {len(groups)} Audiveris run(s) on {min(jobs, len(groups))} worker(s)")
+        
+        with executor:
+            if self.worker_pool is not None:
+                futures = [executor.submit(self._convert_group, group, output_dir) for group in groups]
+            else:
+                futures = [
+                    executor.submit(_convert_group_in_subprocess, self.audiveris_path,
+                                    self.java_version, self.jvm, self.preprocess_steps, self.variant,
+                                    self.reuse_books, self.books_dir, group, output_dir)
+                    for group in groups
+                ]
+            for future in as_completed(futures):
+                for entry in future.result():
+                    manifest["entries"][entry["input"]] = entry
+                    mark = "✓" if entry["status"] == "ok" else "✗"
+                    print(f"{mark} {entry['input']} ({entry['seconds']:.1f}s)")
+                # Save after every group so an interrupted run can resume
+                save_manifest(manifest_path, manifest)
+        
+        return manifest
+    
+    def _convert_group(self, items, output_dir):
+        """Run one Audiveris invocation for a group of inputs and collect per-input results."""
+        group_dir = tempfile.mkdtemp(prefix=".group-", dir=output_dir)
+        staging_dir = os.path.join(group_dir, "inputs")
+        os.makedirs(staging_dir)
+        started = time.perf_counter()
+        try:
+            # Inputs with an indexed book skip recognition; the rest are staged under
+            # their output names, so Audiveris exports never collide
+            inputs = []
+            stage_errors = {}
+            keys = {}
+            books = {}
+            for item in items:
+                keys[item["input"]] = self.book_key(item["input"])
+                book = self.book_index.get(keys[item["input"]]) if self.reuse_books else None
+                if book is not None:
+                    books[item["input"]] = book
+                    continue
+                try:
+                    inputs.append(self._stage_input(item["input"], item["name"], staging_dir))
+                except Exception as e:
+                    stage_errors[item["input"]] = f"Preprocessing failed: {e}"
+            
+            if not inputs:
+                result = subprocess.CompletedProcess(inputs, 1, "", "")
+            elif self.worker_pool is not None:
+                try:
+                    with span("omr", engine="audiveris"):
+                        self.worker_pool.convert(inputs, group_dir, timeout=300 * len(inputs))
+                    result = subprocess.CompletedProcess(inputs, 0, "", "")
+                except WorkerError as e:
+                    result = subprocess.CompletedProcess(inputs, 1, "", str(e))
+            else:
+                try:
+                    result = self._run_audiveris(inputs, group_dir)
+                except subprocess.TimeoutExpired:
+                    result = subprocess.CompletedProcess(inputs, 1, "", "Audiveris timed out")
+            omr_seconds = time.perf_counter() - started
+            
+            entries = []
+            for item in items:
+                entry_started = time.perf_counter()
+                entry = dict(item, status="failed", musicxml=None, midi=None, error=None,
+                             group_size=len(items), reused=item["input"] in books)
+                stem = item["name"]
+                book = books.get(item["input"])
+                exported = None
+                for ext in (".mxl", ".musicxml", ".xml"):
+                    candidate = os.path.join(group_dir, stem + ext)
+                    if os.path.exists(candidate):
+                        exported = candidate
+                        break
+                
+                try:
+                    if item["input"] in stage_errors:
+                        entry["error"] = stage_errors[item["input"]]
+                    elif book is None and exported is None:
+                        entry["error"] = (result.stderr or "").strip()[-500:] or "Audiveris exported no MusicXML"
+                    else:
+                        if book is None:
+                            book = self._index_book(keys[item["input"]], item["input"], stem, exported)
+                        musicxml_path = self._export_variant(book, stem, output_dir)
+                        entry["musicxml"] = musicxml_path
+                        if self.variant["midi"]:
+                            converted = self._convert_musicxml_to_midi(musicxml_path, output_dir)
+                            if converted.lower().endswith((".mid", ".midi")):
+                                entry["midi"] = converted
+                        entry["status"] = "ok"
+                except Exception as e:
+                    entry["error"] = str(e)
+                
+                entry["seconds"] = omr_seconds / len(items) + time.perf_counter() - entry_started
+                entries.append(entry)
+            return entries
+        finally:
+            shutil.rmtree(group_dir, ignore_errors=True)
+    
+    def _stage_input(self, input_path, name, staging_dir):
+        """Place an input in staging_dir as <name>.<ext>, preprocessed when enabled."""
+        if self.preprocess_config is not None and not input_path.lower().endswith(".pdf"):
+            from preprocess import preprocess_image
+            staged = os.path.join(staging_dir, name + self.preprocess_config.output_format)
+            with span("preprocess", engine="audiveris"):
+                info = preprocess_image(input_path, staged, self.preprocess_config)
+            steps = ", ".join(f"{step} {seconds * 1000:.0f}ms" for step, seconds in info["timings"].items())
+            print(f"✓ Preprocessed {input_path}: {info['original_shape']} -> {info['shape']} ({steps})")
+            return staged
+        
+        staged = os.path.join(staging_dir, name + os.path.splitext(input_path)[1])
+        try:
+            os.symlink(input_path, staged)
+        except OSError:
+            shutil.copyfile(input_path, staged)
+        return staged
+    
+    def build_classpath(self):
+        """Return the Audiveris classpath, or None when only a standalone JAR is available."""
+        if self.classpath:
+            return self.classpath
+        return classpath_for(self.audiveris_path)
+    
+    def _audiveris_command(self, arguments, input_paths=(), dump=True):
+        """Command line that runs Audiveris in a fresh JVM with the given arguments.
+        
+        Returns (command, pending CDS archive or None) for JvmTuning.finish.
+        """
+        java_options, pending = self.jvm.options(input_paths, dump=dump) if self.jvm else ([], None)
+        classpath = self.build_classpath()
+        if classpath:
+            return ["java", *java_options, "-cp", classpath, "org.audiveris.omr.Main", *arguments], pending
+        # Fallback to single JAR (if it has a manifest)
+        return ["java", *java_options, "-jar", self.audiveris_path, *arguments], pending
+    
+    def _run_audiveris(self, input_paths, output_dir, timeout=None, cancel=None):
+        """Run Audiveris once in a fresh JVM on one or more input images."""
+        cmd, pending = self._audiveris_command([
+            "-batch",  # Run in batch mode
+            "-export",  # Export results
+            "-output", output_dir,  # Output directory
+            *input_paths  # Input images
+        ], input_paths)
+        
+        print(f"Running command: {' '.join(cmd)}")
+        
+        # Run Audiveris (5 minute timeout per image), measuring the JVM's CPU time and memory
+        try:
+            with span("omr", engine="audiveris"):
+                result, usage = run_measured(cmd, "audiveris", timeout=timeout or 300 * len(input_paths),
+                                             cancel=cancel)
+        except BaseException:
+            if self.jvm:
+                self.jvm.finish(pending, False)
+            raise
+        if self.jvm:
+            self.jvm.finish(pending, result.returncode == 0)
+        if "max_rss_bytes" in usage:
+            print(f"⏱ Audiveris JVM: {usage['wall']:.1f}s wall, {usage['user'] + usage['system']:.1f}s CPU, "
+                  f"peak RSS {usage['max_rss_bytes'] / (1024 * 1024):.0f} MB")
+        return result
+    
+    def start_workers(self):
+        """Start resident Audiveris JVMs that are reused across conversions."""
+        classpath = self.build_classpath()
+        if not classpath:
+            print("⚠ Resident workers need the audiveris/lib directory; using one JVM per image")
+            return False
+        
+        print(f"Starting {self.workers} resident Audiveris worker(s)...")
+        java_options = []
+        if self.jvm:
+            if not self.jvm.active_processors:
+                self.jvm.active_processors = plan(detect_cores()["usable"], workers=self.workers)[1]
+            # Keep the heap below the RSS limit that would recycle the worker
+            heap_mb = self.max_worker_memory_mb * 3 // 4 if self.max_worker_memory_mb else None
+            java_options, _ = self.jvm.options(long_lived=True, heap_mb=heap_mb, dump=False)
+        self.worker_pool = AudiverisWorkerPool(
+            classpath,
+            size=self.workers,
+            java_options=java_options,
+            java_major=java_major_version(self.java_version),
+            max_jobs_per_worker=self.max_jobs_per_worker,
+            max_rss_mb=self.max_worker_memory_mb,
+            log_dir=os.path.join(self.AUDIVERIS_DIR, "worker", "logs"),
+        )
+        try:
+            self.worker_pool.start()
+        except WorkerError as e:
+            print(f"⚠ Could not start Audiveris workers: {e}")
+            self.worker_pool.close()
+            self.worker_pool = None
+            return False
+        print("✓ Audiveris workers ready")
+        return True
+    
+    def close(self):
+        """Stop any resident Audiveris workers."""
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool = None
+    
+    def _has_midi_variant(self):
+        """Whether MIDI export asks for more than a straight conversion."""
+        return (self.variant["transpose"] != 0 or self.variant["tempo_scale"] != 1.0
+                or self.variant["parts"] is not None)
     
     def _convert_musicxml_to_midi(self, musicxml_path, output_dir):
-        """Convert MusicXML to MIDI using music21 if available."""
+        """Convert MusicXML to MIDI with the streaming converter, falling back to music21."""
+        # Generate MIDI file path
+        base_name = os.path.splitext(os.path.basename(musicxml_path))[0]
+        midi_path = os.path.join(output_dir, f"{base_name}.mid")
+        
+        try:
+            from musicxml_midi import UnsupportedScore, parse_musicxml, transform_score, write_midi
+            try:
+                with span("musicxml_parse", engine="audiveris"):
+                    score = parse_musicxml(musicxml_path)
+                if self._has_midi_variant():
+                    score = transform_score(score, transpose=self.variant["transpose"],
+                                            tempo_scale=self.variant["tempo_scale"],
+                                            parts=self.variant["parts"])
+                with span("midi_write", engine="audiveris"):
+                    midi_bytes = write_midi(score)
+                with open(midi_path, "wb") as f:
+                    f.write(midi_bytes)
+                print(f"✓ Converted to MIDI: {midi_path}")
+                return midi_path
+            except UnsupportedScore as e:
+                print(f"Note: {e}; falling back to music21")
+        except ImportError:
+            pass
+        
         try:
             # Try to import music21 for MusicXML to MIDI conversion
             try:
                 from music21 import converter, midi
                 print("Attempting to convert MusicXML to MIDI using music21...")
+                if self._has_midi_variant():
+                    print("⚠ --transpose, --tempo-scale and --parts are ignored by the music21 fallback")
                 
                 # Load the MusicXML file
                 score = converter.parse(musicxml_path)
                 
-                # Generate MIDI file path
-                base_name = os.path.splitext(os.path.basename(musicxml_path))[0]
-                midi_path = os.path.join(output_dir, f"{base_name}.mid")
-                
                 # Convert to MIDI
                 midi_file = midi.translate.streamToMidiFile(score)
                 midi_file.open(midi_path, 'wb')
@@ -249,10 +617,35 @@ class AudiverisConverter:
             print(f"✓ MusicXML file available: {musicxml_path}")
             return musicxml_path
     
-    def setup(self):
-        """Set up Audiveris environment."""
+    def setup(self, refresh=False):
+        """Set up Audiveris environment.
+        
+        The Java and JAR probe is cached in audiveris/toolchain.json and reused
+        until the java binary or the Audiveris JARs change (or refresh=True).
+        """
         print("Setting up Audiveris environment...")
         
+        toolchain = None if refresh else load_toolchain(self.TOOLCHAIN_CACHE)
+        if toolchain:
+            self.java_version = toolchain["java_version"]
+            print(f"✓ Java: {self.java_version} (cached probe)")
+            print(f"✓ Audiveris JAR: {toolchain['jar']} (cached probe)")
+        else:
+            toolchain = self._probe_toolchain()
+            if toolchain is None:
+                return False
+        
+        self.audiveris_path = toolchain["jar"]
+        self.classpath = toolchain["classpath"]
+        self.jvm = JvmTuning(java_major_version(self.java_version), self.CDS_ARCHIVE, cds=self.cds,
+                             active_processors=self.jvm_threads)
+        if self.workers:
+            self.start_workers()
+        print(f"✓ Audiveris setup complete!")
+        return True
+    
+    def _probe_toolchain(self):
+        """Check Java and locate the Audiveris JAR, then cache the result."""
         if not self.check_java():
             print("\n" + "="*50)
             print("JAVA INSTALLATION REQUIRED")
@@ -262,18 +655,107 @@ class AudiverisConverter:
             print("CentOS/RHEL: sudo yum install java-11-openjdk-devel")
             print("macOS: brew install openjdk@11")
             print("Windows: Download from https://adoptopenjdk.net/")
-            return False
+            return None
         
-        if not self.download_audiveris():
-            return False
-            
         jar_path = self.download_audiveris()
         if not jar_path:
-            return False
-            
-        self.audiveris_path = jar_path
-        print(f"✓ Audiveris setup complete!")
-        return True
+            return None
+        
+        # Classes archived from other JARs would be rejected anyway
+        if os.path.exists(self.CDS_ARCHIVE):
+            os.remove(self.CDS_ARCHIVE)
+        return save_toolchain(self.TOOLCHAIN_CACHE, self.java_version, jar_path)
+
+
+def _convert_group_in_subprocess(audiveris_path, java_version, jvm, preprocess_steps, variant, reuse_books,
+                                 books_dir, items, output_dir):
+    """Process pool entry point for AudiverisConverter.convert_batch."""
+    converter = AudiverisConverter(preprocess_steps=preprocess_steps, variant=variant,
+                                   reuse_books=reuse_books, books_dir=books_dir)
+    converter.audiveris_path = audiveris_path
+    converter.java_version = java_version
+    converter.jvm = jvm
+    return converter._convert_group(items, output_dir)
+
+
+def expand_inputs(patterns, recursive=False):
+    """Expand files, directories and glob patterns into a sorted list of image paths."""
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            walker = Path(pattern).rglob("*") if recursive else Path(pattern).iterdir()
+            found.extend(str(p) for p in walker
+                         if p.is_file() and p.suffix.lower() in AudiverisConverter.INPUT_EXTENSIONS)
+        elif glob.has_magic(pattern):
+            found.extend(p for p in glob.glob(pattern, recursive=True)
+                         if os.path.isfile(p) and p.lower().endswith(AudiverisConverter.INPUT_EXTENSIONS))
+        else:
+            found.append(pattern)
+    
+    unique = {}
+    for path in found:
+        unique.setdefault(os.path.abspath(path), None)
+    return sorted(unique)
+
+
+def output_names(input_paths):
+    """Map each input to an output base name, disambiguating inputs that share a file name."""
+    stems = {}
+    for path in input_paths:
+        stems.setdefault(Path(path).stem, []).append(path)
+    
+    names = {}
+    for stem, paths in stems.items():
+        if len(paths) == 1:
+            names[paths[0]] = stem
+            continue
+        common = os.path.commonpath(paths)
+        for path in paths:
+            relative = Path(os.path.relpath(path, common)).with_suffix("")
+            names[path] = "_".join(Path(common).parts[-1:] + relative.parts)
+    return names
+
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest.setdefault("entries", {})
+    return manifest
+
+
+def save_manifest(manifest_path, manifest):
+    manifest["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def write_metrics(path):
+    """Atomically write the collected metrics in the Prometheus text format."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".metrics-", dir=directory)
+    with os.fdopen(fd, "w") as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp_path, path)
+
+
+def is_up_to_date(entry, stat, variant):
+    """True when a manifest entry records a successful conversion of the unchanged input into variant."""
+    if not entry or entry.get("status") != "ok":
+        return False
+    if entry.get("size") != stat.st_size or entry.get("mtime") != stat.st_mtime:
+        return False
+    if entry.get("variant") != variant:
+        return False
+    outputs = [entry.get("musicxml")]
+    if variant["midi"]:
+        outputs.append(entry.get("midi"))
+    return all(path and os.path.exists(path) for path in outputs)
 
 
 def main():
@@ -287,6 +769,15 @@ Examples:
   python audiveris_converter.py backend/uploads/testimage.png outputs/
   python audiveris_converter.py score.jpg /tmp/midi_files/
 
+Batch mode (several files, directories or globs):
+  python audiveris_converter.py scans/ -o midi/
+  python audiveris_converter.py "library/**/*.png" -o midi/ --jobs 4
+  python audiveris_converter.py a.png b.png c.jpg -o midi/ --force
+
+Variants (served from the stored Audiveris book, without recognizing again):
+  python audiveris_converter.py score.png --transpose -2 --tempo-scale 0.75
+  python audiveris_converter.py score.pdf --pages 2-3 --parts 1
+
 Installation Requirements:
   1. Java 11+ (will be checked automatically)
   2. Audiveris (will be downloaded automatically)
@@ -294,15 +785,91 @@ Installation Requirements:
     )
     
     parser.add_argument("input_image", 
-                       nargs='?',
-                       help="Path to the sheet music image file")
-    parser.add_argument("output_dir", 
-                       nargs='?', 
+                       nargs='*',
+                       help="Sheet music image files, directories or glob patterns "
+                            "(a single image may be followed by its output directory)")
+    parser.add_argument("-o", "--output-dir",
                        default=None,
                        help="Output directory for MIDI files (default: audiveris_output)")
+    parser.add_argument("--jobs",
+                       type=int,
+                       default=None,
+                       help="Parallel Audiveris runs in batch mode (default: usable cores / threads per run)")
+    parser.add_argument("--threads",
+                       type=int,
+                       default=None,
+                       help="Processors each Audiveris JVM sizes its thread pools for "
+                            "(default: a quarter of the usable cores, at most 4)")
+    parser.add_argument("--group-size",
+                       type=int,
+                       default=None,
+                       help="Images per Audiveris run in batch mode (default: spread evenly, at most 8)")
+    parser.add_argument("--recursive",
+                       action="store_true",
+                       help="Also look for images in subdirectories of input directories")
+    parser.add_argument("--preprocess",
+                       nargs="?",
+                       const="downscale,deskew,crop,binarize",
+                       default=None,
+                       metavar="STEPS",
+                       help="Clean up images before recognition; optional comma-separated subset of "
+                            "downscale,deskew,crop,binarize (default: all)")
+    parser.add_argument("--force",
+                       action="store_true",
+                       help="Convert again even if the manifest lists the input as done")
     parser.add_argument("--setup-only", 
                        action="store_true",
                        help="Only setup Audiveris, don't convert")
+    parser.add_argument("--workers",
+                       type=int,
+                       default=0,
+                       help="Number of resident Audiveris JVMs to reuse across images (default: 0, one JVM per image)")
+    parser.add_argument("--max-jobs-per-worker",
+                       type=int,
+                       default=50,
+                       help="Restart a resident JVM after this many images (default: 50)")
+    parser.add_argument("--max-worker-memory",
+                       type=int,
+                       default=None,
+                       metavar="MB",
+                       help="Restart a resident JVM once its resident memory exceeds this many MB")
+    parser.add_argument("--format",
+                       choices=("midi", "musicxml"),
+                       default="midi",
+                       help="Write MIDI (default) or stop at the MusicXML export")
+    parser.add_argument("--pages",
+                       default=None,
+                       help="Only export these pages, e.g. 1,3-5 (re-exported from the stored Audiveris book)")
+    parser.add_argument("--parts",
+                       default=None,
+                       help="Only put these parts in the MIDI: 1-based numbers or part ids, e.g. 1,P3")
+    parser.add_argument("--transpose",
+                       type=int,
+                       default=0,
+                       metavar="SEMITONES",
+                       help="Transpose the MIDI by this many semitones")
+    parser.add_argument("--tempo-scale",
+                       type=float,
+                       default=1.0,
+                       metavar="FACTOR",
+                       help="Multiply every tempo in the MIDI by FACTOR, e.g. 0.75 for practice")
+    parser.add_argument("--no-reuse",
+                       action="store_true",
+                       help="Recognize again even if a stored Audiveris book exists for the input")
+    parser.add_argument("--books-dir",
+                       default=None,
+                       help="Where recognized Audiveris books are indexed (default: audiveris/books)")
+    parser.add_argument("--refresh-toolchain",
+                       action="store_true",
+                       help="Probe Java and the Audiveris JAR again instead of using audiveris/toolchain.json")
+    parser.add_argument("--no-cds",
+                       action="store_true",
+                       help="Do not create or use the class-data-sharing archive audiveris/audiveris.jsa")
+    parser.add_argument("--metrics",
+                       default=None,
+                       metavar="FILE",
+                       help="Write stage timings and Audiveris CPU/memory as Prometheus text to FILE "
+                            "(e.g. for node_exporter's textfile collector)")
     
     args = parser.parse_args()
     
@@ -310,11 +877,39 @@ Installation Requirements:
     if not args.setup_only and not args.input_image:
         parser.error("input_image is required unless --setup-only is specified")
     
+    # Keep supporting the original "<input_image> [output_dir]" form
+    positional = args.input_image
+    if (len(positional) == 2 and args.output_dir is None and os.path.isfile(positional[0])
+            and not glob.has_magic(positional[1])
+            and not positional[1].lower().endswith(AudiverisConverter.INPUT_EXTENSIONS)):
+        positional, args.output_dir = positional[:1], positional[1]
+    batch_mode = len(positional) > 1 or any(
+        os.path.isdir(p) or glob.has_magic(p) for p in positional)
+    
+    variant = {
+        "pages": [p.strip() for p in args.pages.split(",") if p.strip()] if args.pages else None,
+        "parts": [str(int(p) - 1) if p.strip().isdigit() else p.strip()
+                  for p in args.parts.split(",") if p.strip()] if args.parts else None,
+        "transpose": args.transpose,
+        "tempo_scale": args.tempo_scale,
+        "midi": args.format == "midi",
+    }
+    
     # Create converter instance
-    converter = AudiverisConverter()
+    converter = AudiverisConverter(
+        workers=args.workers,
+        max_jobs_per_worker=args.max_jobs_per_worker,
+        max_worker_memory_mb=args.max_worker_memory,
+        preprocess_steps=args.preprocess.split(",") if args.preprocess else None,
+        variant=variant,
+        reuse_books=not args.no_reuse,
+        books_dir=args.books_dir,
+        cds=not args.no_cds,
+        jvm_threads=args.threads,
+    )
     
     # Setup Audiveris
-    if not converter.setup():
+    if not converter.setup(refresh=args.refresh_toolchain):
         print("✗ Failed to setup Audiveris environment")
         sys.exit(1)
     
@@ -322,15 +917,37 @@ Installation Requirements:
         print("✓ Setup complete!")
         sys.exit(0)
     
-    # Convert the image
+    # Convert the image(s)
     try:
-        midi_file = converter.convert_image_to_midi(args.input_image, args.output_dir)
+        if batch_mode:
+            inputs = expand_inputs(positional, recursive=args.recursive)
+            missing = [p for p in inputs if not os.path.isfile(p)]
+            if missing:
+                raise FileNotFoundError(f"Input file not found: {missing[0]}")
+            if not inputs:
+                print("✗ FAILED: No images found")
+                sys.exit(1)
+            
+            manifest = converter.convert_batch(inputs, args.output_dir, jobs=args.jobs,
+                                               group_size=args.group_size, force=args.force)
+            failed = [p for p in inputs if manifest["entries"].get(p, {}).get("status") != "ok"]
+            output_dir = args.output_dir or "audiveris_output"
+            print(f"\nManifest: {os.path.join(output_dir, AudiverisConverter.MANIFEST_NAME)}")
+            if failed:
+                print(f"✗ FAILED: {len(failed)} of {len(inputs)} image(s) could not be converted")
+                sys.exit(1)
+            print(f"✓ SUCCESS: {len(inputs)} image(s) converted")
+            sys.exit(0)
+        
+        input_image = positional[0]
+        midi_file = converter.convert_image_to_midi(input_image, args.output_dir)
         
         if midi_file:
-            print(f"\n✓ SUCCESS: MIDI file created at {midi_file}")
+            kind = "MIDI" if variant["midi"] else "MusicXML"
+            print(f"\n✓ SUCCESS: {kind} file created at {midi_file}")
             sys.exit(0)
         else:
-            print(f"\n✗ FAILED: Could not create MIDI file from {args.input_image}")
+            print(f"\n✗ FAILED: Could not create MIDI file from {input_image}")
             sys.exit(1)
             
     except FileNotFoundError as e:
@@ -339,6 +956,10 @@ Installation Requirements:
     except Exception as e:
         print(f"✗ UNEXPECTED ERROR: {e}")
         sys.exit(1)
+    finally:
+        converter.close()
+        if args.metrics:
+            write_metrics(args.metrics)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+JVM start-up tuning for Audiveris
+
+A one-shot Audiveris run spends a large part of its time before the first page
+is even looked at: probing Java, locating the JAR, then loading and verifying
+thousands of classes. This module cuts that down in three ways:
+
+- The toolchain probe (Java version, JAR location, classpath) is cached in
+  audiveris/toolchain.json and only repeated when the java binary, the JAR or
+  audiveris/lib change.
+- Application class-data sharing (AppCDS): the first run on JDK 13-18 dumps
+  the loaded classes into audiveris/audiveris.jsa with
+  -XX:ArchiveClassesAtExit; later runs map it with -XX:SharedArchiveFile.
+  JDK 19+ does both itself with -XX:+AutoCreateSharedArchive.
+- Heap and JIT flags are chosen per launch: -Xmx from the pixel count of the
+  input images (read from the file headers), and C1-only compilation
+  (-XX:TieredStopAtLevel=1) for small pages, where a short run never earns
+  back the C2 compile time. With several JVMs side by side,
+  -XX:ActiveProcessorCount keeps each one's thread pools to its share of the cores.
+
+Extra flags in AUDIVERIS_JAVA_OPTIONS are appended last, so they win.
+"""
+
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+
+TOOLCHAIN_VERSION = 1
+
+# Heap estimate: fixed overhead plus what Audiveris keeps per pixel (gray and
+# binary copies, distance transform, runs tables)
+HEAP_BASE_MB = 512
+HEAP_BYTES_PER_PIXEL = 48
+MIN_HEAP_MB = 1024
+DEFAULT_HEAP_MB = 2048  # when no image size is known (PDFs, book exports)
+MAX_HEAP_FRACTION = 0.75
+# Pages up to this size finish before C2 compilation pays off
+QUICK_PIXELS = 6_000_000
+
+
+def _stat_key(path):
+    """(mtime, size) of a file, or None when it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _lib_fingerprint(lib_dir):
+    """Number of JARs in lib_dir and their latest modification time."""
+    if not os.path.isdir(lib_dir):
+        return None
+    jars = [os.path.join(lib_dir, name) for name in os.listdir(lib_dir) if name.endswith(".jar")]
+    return [len(jars), max((os.stat(jar).st_mtime_ns for jar in jars), default=0)]
+
+
+def _java_binary():
+    """Resolved path of the java on PATH, or None."""
+    java = shutil.which("java")
+    return os.path.realpath(java) if java else None
+
+
+def classpath_for(jar_path):
+    """Audiveris classpath for jar_path, or None when only a standalone JAR is available."""
+    lib_dir = os.path.join(os.path.dirname(jar_path), "lib")
+    if os.path.exists(lib_dir):
+        return f"{jar_path}{os.pathsep}{lib_dir}/*"
+    return None
+
+
+def fingerprint(java_path, jar_path):
+    """What a cached probe depends on; any change means probing again."""
+    return {
+        "java": java_path,
+        "java_stat": _stat_key(java_path) if java_path else None,
+        "jar": os.path.abspath(jar_path),
+        "jar_stat": _stat_key(jar_path),
+        "lib": _lib_fingerprint(os.path.join(os.path.dirname(jar_path), "lib")),
+    }
+
+
+def jar_identity(jar_path):
+    """Which Audiveris build a result came from: the JAR and its lib directory, by path and mtime."""
+    return {
+        "jar": os.path.abspath(jar_path),
+        "jar_stat": _stat_key(jar_path),
+        "lib": _lib_fingerprint(os.path.join(os.path.dirname(jar_path), "lib")),
+    }
+
+
+def load_toolchain(cache_path):
+    """Return the cached toolchain probe if it is still valid, else None."""
+    try:
+        with open(cache_path) as f:
+            toolchain = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if toolchain.get("version") != TOOLCHAIN_VERSION or not os.path.exists(toolchain.get("jar", "")):
+        return None
+    if fingerprint(_java_binary(), toolchain["jar"]) != toolchain.get("fingerprint"):
+        return None
+    return toolchain
+
+
+def save_toolchain(cache_path, java_version, jar_path):
+    """Record a fresh toolchain probe and return it."""
+    jar_path = os.path.abspath(jar_path)
+    toolchain = {
+        "version": TOOLCHAIN_VERSION,
+        "java_version": java_version,
+        "jar": jar_path,
+        "classpath": classpath_for(jar_path),
+        "fingerprint": fingerprint(_java_binary(), jar_path),
+    }
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(toolchain, f, indent=2)
+    os.replace(tmp_path, cache_path)
+    return toolchain
+
+
+def total_memory_mb():
+    """Physical memory in MB, or None where sysconf does not report it."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def heap_size_mb(pixels):
+    """-Xmx in MB for an image of this many pixels (None: size unknown)."""
+    if pixels is None:
+        needed = DEFAULT_HEAP_MB
+    else:
+        needed = max(MIN_HEAP_MB, HEAP_BASE_MB + pixels * HEAP_BYTES_PER_PIXEL // (1024 * 1024))
+    memory = total_memory_mb()
+    if memory:
+        needed = min(needed, max(MIN_HEAP_MB // 2, int(memory * MAX_HEAP_FRACTION)))
+    return int(needed)
+
+
+def largest_image_pixels(input_paths):
+    """Pixel count of the largest image, or None if any input's size is unknown.
+
+    Audiveris works through a batch one sheet at a time, so the largest image
+    decides the heap.
+    """
+    from imageinfo import image_pixels
+
+    largest = 0
+    for path in input_paths:
+        pixels = image_pixels(path)
+        if pixels is None:
+            return None
+        largest = max(largest, pixels)
+    return largest or None
+
+
+class JvmTuning:
+    """Builds the JVM flags for each Audiveris launch.
+
+    Plain attributes only, so it can be handed to batch worker processes.
+    """
+
+    def __init__(self, java_major, archive_path, cds=True, extra_options=None, active_processors=None):
+        self.java_major = java_major
+        self.archive_path = os.path.abspath(archive_path)
+        self.active_processors = active_processors
+        self.cds = cds and java_major is not None and java_major >= 13
+        if extra_options is None:
+            extra_options = shlex.split(os.environ.get("AUDIVERIS_JAVA_OPTIONS", ""))
+        self.extra_options = list(extra_options)
+
+    def cds_options(self, dump=True):
+        """Class-data-sharing flags; returns (options, archive being dumped or None).
+
+        With dump=False an existing archive is used but none is created, for
+        runs that load too few classes to make a useful one.
+        """
+        if not self.cds:
+            return [], None
+        if os.path.exists(self.archive_path) and (self.java_major < 19 or not dump):
+            return [f"-XX:SharedArchiveFile={self.archive_path}", "-Xshare:auto"], None
+        if not dump:
+            return [], None
+        if self.java_major >= 19:
+            # The JVM validates, creates and refreshes the archive by itself
+            return ["-XX:+AutoCreateSharedArchive", f"-XX:SharedArchiveFile={self.archive_path}"], None
+        # Parallel runs each dump their own archive; the first to finish is kept
+        pending = f"{self.archive_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        return [f"-XX:ArchiveClassesAtExit={pending}"], pending
+
+    def options(self, input_paths=(), long_lived=False, heap_mb=None, dump=True):
+        """JVM flags for one launch; returns (options, archive being dumped or None).
+
+        Pass the pending archive to ``finish`` once the JVM has exited.
+        """
+        options, pending = self.cds_options(dump)
+        pixels = largest_image_pixels(input_paths) if input_paths else None
+        options.append(f"-Xmx{heap_mb or heap_size_mb(pixels)}m")
+        options.append("-XX:-UsePerfData")
+        if self.active_processors:
+            # GC, JIT and Audiveris' own executors size themselves from this
+            options.append(f"-XX:ActiveProcessorCount={self.active_processors}")
+        if not long_lived and len(input_paths) == 1 and pixels is not None and pixels <= QUICK_PIXELS:
+            options.append("-XX:TieredStopAtLevel=1")
+        return options + self.extra_options, pending
+
+    def finish(self, pending, ok):
+        """Move a freshly dumped CDS archive into place after a successful run."""
+        if pending is None:
+            return
+        try:
+            if ok and os.path.getsize(pending) > 0 and not os.path.exists(self.archive_path):
+                os.replace(pending, self.archive_path)
+                print(f"✓ Created class-data-sharing archive {self.archive_path}")
+        except OSError:
+            pass
+        finally:
+            if os.path.exists(pending):
+                os.remove(pending)
+
+
+def probe_java():
+    """Return the first line of `java -version`, or None when Java is missing."""
+    try:
+        result = subprocess.run(["java", "-version"], capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stderr.split("\n")[0]
+
+
+if __name__ == "__main__":
+    # Print the flags a launch on the given images would use
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(script_dir, "backend"))
+    from audiveris_worker import java_major_version
+
+    tuning = JvmTuning(java_major_version(probe_java()), os.path.join(script_dir, "audiveris", "audiveris.jsa"))
+    print(" ".join(tuning.options(sys.argv[1:])[0]))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Resident Audiveris workers
+
+Keeps one or more Audiveris JVMs alive (see audiveris/worker/AudiverisWorker.java)
+so that JVM startup, classpath scanning and Audiveris initialization are paid
+once per worker instead of once per score. Workers are health-checked before
+use and recycled after a number of jobs or when their memory grows too large.
+"""
+
+import itertools
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+
+WORKER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "audiveris", "worker", "AudiverisWorker.java")
+
+
+class WorkerError(Exception):
+    """Raised when a resident Audiveris worker fails or stops responding."""
+
+
+def java_major_version(version_line):
+    """Return the major version from a `java -version` first line, e.g. 17 or 8."""
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', version_line or "")
+    if not match:
+        return None
+    major = int(match.group(1))
+    if major == 1 and match.group(2):
+        return int(match.group(2))
+    return major
+
+
+class AudiverisWorker:
+    """One resident Audiveris JVM speaking the line protocol of AudiverisWorker.java."""
+
+    def __init__(self, classpath, java_options=None, java_major=None,
+                 startup_timeout=120, log_path=None):
+        self.classpath = classpath
+        self.java_options = list(java_options or [])
+        self.java_major = java_major
+        self.startup_timeout = startup_timeout
+        self.log_path = log_path
+        self.jobs_done = 0
+        self.started_at = None
+        self.process = None
+        self._lines = None
+        self._log = None
+
+    def start(self):
+        cmd = ["java", *self.java_options]
+        if self.java_major and 12 <= self.java_major < 24:
+            # Lets the worker trap System.exit() calls made by Audiveris with a SecurityManager.
+            # JDK 24+ refuses to start with this flag; there the worker rewrites the calls instead.
+            cmd.append("-Djava.security.manager=allow")
+        cmd += ["-cp", self.classpath, WORKER_SOURCE]
+
+        self._log = open(self.log_path, "ab") if self.log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self._log,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+        )
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_stdout, daemon=True).start()
+        self.started_at = time.monotonic()
+        self._expect("READY", self.startup_timeout)
+
+    def _read_stdout(self):
+        for line in self.process.stdout:
+            self._lines.put(line.rstrip("\n"))
+        self._lines.put(None)
+
+    def _send(self, *fields):
+        if not self.alive():
+            raise WorkerError("worker process is not running")
+        try:
+            self.process.stdin.write("\t".join(fields) + "\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            raise WorkerError(f"cannot write to worker: {e}")
+
+    def _receive(self, timeout):
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            raise WorkerError(f"worker did not answer within {timeout}s")
+        if line is None:
+            raise WorkerError(f"worker exited with code {self.process.wait()}")
+        return line.split("\t")
+
+    def _expect(self, keyword, timeout):
+        fields = self._receive(timeout)
+        if fields[0] != keyword:
+            raise WorkerError(f"unexpected worker reply: {' '.join(fields)}")
+        return fields
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def ping(self, timeout=10):
+        """Health check; returns JVM heap usage as reported by the worker."""
+        self._send("PING")
+        fields = self._expect("PONG", timeout)
+        return {
+            "heap_used": int(fields[1]),
+            "heap_max": int(fields[2]),
+            "jobs": int(fields[3]),
+        }
+
+    def rss(self):
+        """Resident set size of the JVM in bytes (Linux only, else None)."""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, AttributeError):
+            pass
+        return None
+
+    def run(self, input_paths, output_dir, timeout=300):
+        """Run `-batch -export` on the inputs and return the files Audiveris wrote."""
+        job_id = str(self.jobs_done + 1)
+        self._send("JOB", job_id, os.path.abspath(output_dir),
+                   *[os.path.abspath(p) for p in input_paths])
+        fields = self._receive(timeout)
+        self.jobs_done += 1
+        if fields[0] == "FAIL":
+            raise WorkerError(f"Audiveris failed: {' '.join(fields[2:])}")
+        if fields[0] != "DONE" or fields[1] != job_id:
+            raise WorkerError(f"unexpected worker reply: {' '.join(fields)}")
+        return fields[2:]
+
+    def stop(self, timeout=10):
+        if self.alive():
+            try:
+                self._send("QUIT")
+                self.process.wait(timeout)
+            except (WorkerError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        if self._log not in (None, subprocess.DEVNULL):
+            self._log.close()
+            self._log = None
+
+
+class AudiverisWorkerPool:
+    """Fixed-size pool of resident Audiveris workers with health checks and recycling."""
+
+    def __init__(self, classpath, size=1, java_options=None, java_major=None,
+                 max_jobs_per_worker=50, max_rss_mb=None, health_check_interval=30,
+                 log_dir=None):
+        self.classpath = classpath
+        self.size = max(1, size)
+        self.java_options = java_options
+        self.java_major = java_major
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss = max_rss_mb * 1024 * 1024 if max_rss_mb else None
+        self.health_check_interval = health_check_interval
+        self.log_dir = log_dir
+        self.recycled = 0
+        self._idle = queue.Queue()
+        self._last_used = {}
+        self._closed = False
+        self._worker_ids = itertools.count(1)
+
+    def start(self):
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        log_path = None
+        if self.log_dir:
+            os.makedirs(self.log_dir, exist_ok=True)
+            log_path = os.path.join(self.log_dir, f"worker-{next(self._worker_ids)}.log")
+        worker = AudiverisWorker(self.classpath, self.java_options, self.java_major,
+                                 log_path=log_path)
+        try:
+            worker.start()
+        except Exception:
+            worker.stop()
+            raise
+        self._last_used[worker] = time.monotonic()
+        return worker
+
+    def _replace(self, worker):
+        worker.stop()
+        self._last_used.pop(worker, None)
+        self.recycled += 1
+        return self._spawn()
+
+    def _needs_recycle(self, worker):
+        if not worker.alive():
+            return True
+        if self.max_jobs_per_worker and worker.jobs_done >= self.max_jobs_per_worker:
+            return True
+        if self.max_rss:
+            rss = worker.rss()
+            if rss is not None and rss > self.max_rss:
+                return True
+        return False
+
+    def _checkout(self, timeout):
+        worker = self._idle.get(timeout=timeout)
+        idle_for = time.monotonic() - self._last_used.get(worker, 0)
+        if worker.alive() and idle_for > self.health_check_interval:
+            try:
+                worker.ping()
+            except WorkerError:
+                worker.stop()
+        if worker.alive():
+            return worker
+        try:
+            return self._replace(worker)
+        except Exception:
+            # Keep the slot; the next checkout retries the restart
+            self._idle.put(worker)
+            raise
+
+    def _release(self, worker, failed=False):
+        try:
+            # A timed-out or crashed JVM cannot be trusted with the next job
+            if failed or self._needs_recycle(worker):
+                worker = self._replace(worker)
+        except Exception as e:
+            # Never fail the job that just ran; the stopped worker goes back and the
+            # next checkout retries the restart
+            print(f"⚠ Could not restart an Audiveris worker: {e}")
+        finally:
+            self._last_used[worker] = time.monotonic()
+            self._idle.put(worker)
+
+    def convert(self, input_paths, output_dir, timeout=300, acquire_timeout=None):
+        """Run one Audiveris job on an idle worker and return the written files."""
+        if self._closed:
+            raise WorkerError("worker pool is closed")
+        try:
+            worker = self._checkout(acquire_timeout)
+        except queue.Empty:
+            raise WorkerError("no Audiveris worker became available")
+
+        failed = False
+        try:
+            return worker.run(input_paths, output_dir, timeout=timeout)
+        except WorkerError:
+            failed = True
+            raise
+        finally:
+            self._release(worker, failed)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
@@ -0,0 +1,289 @@
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from imageinfo import image_size, image_size_bytes
+from metrics import Counter, Histogram
+
+ADMISSION_ENABLED = os.environ.get('MOBILSHEETS_ADMISSION', '1') == '1'
+ADMISSION_QUEUE = int(os.environ.get('MOBILSHEETS_ADMISSION_QUEUE', 16))
+ADMISSION_MAX_WAIT = float(os.environ.get('MOBILSHEETS_ADMISSION_MAX_WAIT', 30))
+MEMORY_BUDGET_MB = int(os.environ.get('MOBILSHEETS_MEMORY_BUDGET_MB', 0))  # 0: from the host
+MEMORY_BUDGET_FRACTION = 0.7  # of physical/cgroup memory, leaving room for the server itself
+
+# oemer holds several float32 copies of the page plus the network activations
+MEMORY_BASE_BYTES = 256 * 1024 * 1024
+MEMORY_BYTES_PER_PIXEL = int(os.environ.get('MOBILSHEETS_MEMORY_BYTES_PER_PIXEL', 64))
+DEFAULT_PIXELS = 3000 * 4000  # phone photo, when the header cannot be read
+PDF_PAGE_INCHES = (8.27, 11.69)  # A4, at the rasterization DPI
+SECONDS_PER_MEGAPIXEL = 2.0  # initial guess for Retry-After, replaced by measurements
+EWMA_WEIGHT = 0.2
+
+# Priority classes, served in this order
+INTERACTIVE = 0  # one image
+DOCUMENT = 1  # PDF of a few pages
+BULK = 2  # large PDF
+BULK_PAGES = 8
+CLASS_NAMES = {INTERACTIVE: 'interactive', DOCUMENT: 'document', BULK: 'bulk'}
+
+ADMISSIONS = Counter('mobilsheets_admissions_total', 'Admission decisions', ('priority', 'outcome'))
+ADMISSION_WAIT_SECONDS = Histogram(
+    'mobilsheets_admission_wait_seconds', 'Time requests spent queued for admission', ('priority',))
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; ``retry_after`` is in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Cost:
+    """Estimated resources of one conversion."""
+
+    def __init__(self, pages, pixels, memory_bytes, cpus):
+        self.pages = pages
+        self.pixels = pixels
+        self.memory_bytes = memory_bytes
+        self.cpus = cpus
+        if pages == 1:
+            self.priority = INTERACTIVE
+        elif pages <= BULK_PAGES:
+            self.priority = DOCUMENT
+        else:
+            self.priority = BULK
+
+    @property
+    def megapixels(self):
+        return self.pixels / 1e6
+
+    def to_dict(self):
+        return {
+            'pages': self.pages,
+            'pixels': self.pixels,
+            'memory_bytes': self.memory_bytes,
+            'cpus': self.cpus,
+            'priority': CLASS_NAMES[self.priority],
+        }
+
+
+def estimate_cost(source, threads=1, page_workers=1, pdf_dpi=300, page_count=None, image_threads=None):
+    """Cost of converting an upload (bytes or a path), from the image header or the PDF page count.
+
+    ``page_count(source)`` counts PDF pages; PDF pages are recognized
+    ``page_workers`` at a time, each with ``threads`` threads. An image is
+    costed as one recognition with ``image_threads`` threads (default
+    ``threads``); cutting it into staff systems takes more cores through
+    ``AdmissionController.try_grow`` once the systems are known.
+    """
+    in_memory = isinstance(source, (bytes, bytearray))
+    if in_memory:
+        head = source[:5]
+    else:
+        with open(source, 'rb') as f:
+            head = f.read(5)
+    if head == b'%PDF-':
+        pages = page_count(source) if page_count else 1
+        page_pixels = int(PDF_PAGE_INCHES[0] * pdf_dpi) * int(PDF_PAGE_INCHES[1] * pdf_dpi)
+        parallel = max(1, min(pages, page_workers))
+    else:
+        size = image_size_bytes(source) if in_memory else image_size(source)
+        pages = 1
+        page_pixels = size[0] * size[1] if size else DEFAULT_PIXELS
+        parallel = 1
+        threads = image_threads or threads
+    memory = MEMORY_BASE_BYTES + parallel * page_pixels * MEMORY_BYTES_PER_PIXEL
+    return Cost(pages, pages * page_pixels, memory, parallel * threads)
+
+
+def default_memory_budget():
+    from scheduler import detect_memory
+
+    if MEMORY_BUDGET_MB:
+        return MEMORY_BUDGET_MB * 1024 * 1024
+    memory = detect_memory()
+    return int(memory * MEMORY_BUDGET_FRACTION) if memory else 4 * 1024 ** 3
+
+
+class _Waiter:
+    def __init__(self, cost):
+        self.cost = cost
+        self.enqueued = time.monotonic()
+        self.admitted = False
+
+
+class AdmissionController:
+    """Admits conversions while their estimated memory and CPU fit the budgets.
+
+    Requests that do not fit wait in a bounded priority queue (interactive
+    before document before bulk, then first come first served). A request is
+    turned away at once with ``Overloaded`` when the queue is full or when its
+    expected wait, from the measured seconds per megapixel, exceeds
+    ``max_wait``, so the server keeps finishing the work it has accepted
+    instead of slowing every request down together. A request larger than a
+    whole budget is admitted alone.
+    """
+
+    def __init__(self, memory_budget, cpu_budget, max_queue=ADMISSION_QUEUE, max_wait=ADMISSION_MAX_WAIT,
+                 enabled=ADMISSION_ENABLED):
+        self.memory_budget = memory_budget
+        self.cpu_budget = cpu_budget
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self.memory_in_use = 0
+        self.cpus_in_use = 0
+        self.running = 0
+        self.seconds_per_megapixel = SECONDS_PER_MEGAPIXEL
+        self._queue = []  # heap of (priority, sequence, waiter)
+        self._sequence = itertools.count()
+        self._queued_megapixels = 0.0
+        self._running_megapixels = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def _fits(self, cost):
+        if self.running == 0:
+            return True
+        return (self.memory_in_use + cost.memory_bytes <= self.memory_budget
+                and self.cpus_in_use + cost.cpus <= self.cpu_budget)
+
+    def _expected_wait(self, megapixels_ahead):
+        # Work ahead of the request drains at the measured rate, as many at a time as run now
+        work = (self._running_megapixels + megapixels_ahead) * self.seconds_per_megapixel
+        return work / max(1, self.running)
+
+    def _retry_after(self):
+        return max(1, min(120, math.ceil(self._expected_wait(self._queued_megapixels))))
+
+    def _reserve(self, cost):
+        self.memory_in_use += cost.memory_bytes
+        self.cpus_in_use += cost.cpus
+        self._running_megapixels += cost.megapixels
+        self.running += 1
+
+    def release(self, cost, seconds=None):
+        """Return the budget taken by ``acquire``; ``seconds`` is the run time of a successful run."""
+        if not self.enabled:
+            return
+        with self._condition:
+            self.memory_in_use -= cost.memory_bytes
+            self.cpus_in_use -= cost.cpus
+            self._running_megapixels -= cost.megapixels
+            self.running -= 1
+            if seconds is not None and cost.pixels:
+                sample = seconds / max(cost.megapixels, 0.01)
+                self.seconds_per_megapixel += EWMA_WEIGHT * (sample - self.seconds_per_megapixel)
+            self._admit_waiting()
+
+    def try_grow(self, cost, cpus):
+        """Add ``cpus`` cores to an admitted ``cost`` if they are free now; never waits.
+
+        Returns whether they were added; ``release`` then returns them with the
+        rest. Queued requests come first, so nothing is added while any wait.
+        """
+        if not self.enabled:
+            return True
+        with self._condition:
+            if self._queue or self.cpus_in_use + cpus > self.cpu_budget:
+                return False
+            self.cpus_in_use += cpus
+            cost.cpus += cpus
+            return True
+
+    def _admit_waiting(self):
+        # Strict priority order: the head waits for room rather than being overtaken
+        while self._queue:
+            _, _, waiter = self._queue[0]
+            if not self._fits(waiter.cost):
+                break
+            heapq.heappop(self._queue)
+            self._queued_megapixels -= waiter.cost.megapixels
+            self._reserve(waiter.cost)
+            waiter.admitted = True
+        self._condition.notify_all()
+
+    def _reject(self, cost, reason):
+        ADMISSIONS.inc(priority=CLASS_NAMES[cost.priority], outcome='rejected')
+        raise Overloaded(reason, self._retry_after())
+
+    def acquire(self, cost, max_wait=None):
+        """Take budget for ``cost``, queueing if needed; returns the seconds waited.
+
+        Raises Overloaded. Every successful call must be paired with ``release``.
+        """
+        if not self.enabled:
+            return 0.0
+        if max_wait is None:
+            max_wait = self.max_wait
+        priority = CLASS_NAMES[cost.priority]
+        with self._condition:
+            if not self._queue and self._fits(cost):
+                self._reserve(cost)
+                ADMISSIONS.inc(priority=priority, outcome='admitted')
+                return 0.0
+            if len(self._queue) >= self.max_queue:
+                self._reject(cost, f'Server busy: {len(self._queue)} requests already queued')
+            ahead = sum(w.cost.megapixels for p, _, w in self._queue if p <= cost.priority)
+            if self._expected_wait(ahead + cost.megapixels) > max_wait:
+                self._reject(cost, 'Server busy: expected wait exceeds the limit')
+
+            waiter = _Waiter(cost)
+            heapq.heappush(self._queue, (cost.priority, next(self._sequence), waiter))
+            self._queued_megapixels += cost.megapixels
+            deadline = waiter.enqueued + max_wait
+            while not waiter.admitted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                    heapq.heapify(self._queue)
+                    self._queued_megapixels -= cost.megapixels
+                    # Whoever was behind this request may fit now
+                    self._admit_waiting()
+                    ADMISSIONS.inc(priority=priority, outcome='timed_out')
+                    raise Overloaded('Server busy: timed out waiting for admission', self._retry_after())
+                self._condition.wait(remaining)
+            waited = time.monotonic() - waiter.enqueued
+        ADMISSIONS.inc(priority=priority, outcome='queued')
+        ADMISSION_WAIT_SECONDS.observe(waited, priority=priority)
+        return waited
+
+    @contextmanager
+    def admit(self, cost, max_wait=None):
+        """Hold budget for ``cost`` while the block runs; raises Overloaded."""
+        if not self.enabled:
+            yield 0.0
+            return
+        waited = self.acquire(cost, max_wait)
+        started = time.monotonic()
+        seconds = None
+        try:
+            yield waited
+            seconds = time.monotonic() - started
+        finally:
+            # Only successful runs feed the service-time estimate
+            self.release(cost, seconds)
+
+    def stats(self):
+        with self._condition:
+            queued = [waiter.cost.to_dict() for _, _, waiter in sorted(self._queue, key=lambda e: e[:2])]
+            return {
+                'enabled': self.enabled,
+                'running': self.running,
+                'queued': queued,
+                'max_queue': self.max_queue,
+                'max_wait': self.max_wait,
+                'memory_in_use': self.memory_in_use,
+                'memory_budget': self.memory_budget,
+                'cpus_in_use': self.cpus_in_use,
+                'cpu_budget': self.cpu_budget,
+                'seconds_per_megapixel': self.seconds_per_megapixel,
+            }
@@ -1,26 +1,480 @@
-from flask import Flask, send_file, jsonify, request
+from flask import Flask, Response, g, send_file, jsonify, request, stream_with_context
 from flask_cors import CORS
 from convert import convert_to_midi
+from cache import ResultCache, make_key
+from fingerprint import FingerprintIndex, page_fingerprint
+from jobs import JobQueue, QueueFull, DONE, FAILED
+from oemer_engine import create_engine
+from engines import EngineDispatcher, OemerOMR, create_audiveris_engine
+from workspace import job_workspace, cleanup_stale_workspaces
+from preprocess import PreprocessConfig, preprocess_image
+from pages import PAGE_WORKERS, PDF_DPI, PageRecognizer, count_pdf_pages, split_pdf, stitch_musicxml
+from ingest import UploadTooLarge, receive_upload
+from history import ARTIFACT_KINDS, HistoryStore
+from note_array import load_note_array
+from segment import SYSTEM_SEGMENTATION, split_systems
+from scheduler import load_schedule, onnx_benchmark
+from admission import AdmissionController, Overloaded, default_memory_budget, estimate_cost
+from metrics import CONTENT_TYPE, REGISTRY, REQUEST_SECONDS, Counter, Gauge, profiler, span
+from musicxml_midi import (UnsupportedScore, note_events, parse_musicxml, read_musicxml, tick_to_seconds,
+                           write_midi)
+import metrics
+from importlib import metadata
+import base64
+import io
+import json
 import os
-import subprocess
+import sqlite3
+import threading
+import time
 import traceback
 import onnxruntime as ort
 
 # Force ONNX Runtime to use CPU
 ort.set_default_logger_severity(3)  # Suppress verbose logs
 os.environ['CUDA_VISIBLE_DEVICES'] = ''  # Disable GPU for TensorFlow
+
+OEMER_PROVIDERS = ['CPUExecutionProvider']
+
+
+def _calibration_benchmark():
+    # Autotune measures the larger oemer model, once its checkpoint has been downloaded
+    try:
+        import oemer
+    except ImportError:
+        return None
+    model_path = os.path.join(oemer.MODULE_PATH, 'checkpoints', 'unet_big', 'model.onnx')
+    return onnx_benchmark(model_path, OEMER_PROVIDERS) if os.path.exists(model_path) else None
+
+
+# Concurrent jobs x threads per job, sized to the cores this process may use
+# (affinity and cgroup quota); MOBILSHEETS_AUTOTUNE=1 measures the split once per host
+schedule = load_schedule(benchmark=_calibration_benchmark())
+
 ort_session_options = ort.SessionOptions()
-ort_session_options.intra_op_num_threads = 1  # Optimize for CPU
+# oemer keeps its intermediate layers in module globals, so the in-process engine is
+# single-flight: it recognizes one image at a time, with every scheduled core
+ort_session_options.intra_op_num_threads = schedule.workers * schedule.threads
+ort_session_options.inter_op_num_threads = 1
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['Server-Timing', 'Retry-After'])
+app.logger.info('Schedule: %d worker(s) x %d thread(s) (%s)', schedule.workers, schedule.threads, schedule.source)
+
+MAX_POLL_WAIT = 30
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}  # no proxy buffering
+
+# Server-Timing is sent on every response when enabled, or per request with ?timing=1
+SERVER_TIMING = os.environ.get('MOBILSHEETS_SERVER_TIMING', '0') == '1'
+# The /debug/profiler endpoints are only served when enabled
+DEBUG_ENDPOINTS = os.environ.get('MOBILSHEETS_DEBUG_ENDPOINTS', '0') == '1'
+
+# Every conversion runs in its own temporary workspace
+cleanup_stale_workspaces()
+
+try:
+    OEMER_VERSION = metadata.version('oemer')
+except metadata.PackageNotFoundError:
+    OEMER_VERSION = 'unknown'
+
+result_cache = ResultCache()
+
+# Every conversion is indexed in SQLite with its artifacts in a content-addressed blob store;
+# the history outlives result-cache evictions
+history = HistoryStore()
+
+# Camera retakes of a page never match byte for byte; their perceptual fingerprints
+# find the earlier result instead (MOBILSHEETS_NEAR_DUPLICATES=0 turns this off)
+fingerprint_index = FingerprintIndex()
+
+# MOBILSHEETS_PREPROCESS selects the image cleanup steps run before OMR. None run by default
+# until their effect on recognition is measured; binarizing ahead of oemer's own thresholding
+# is the riskiest
+preprocess_config = PreprocessConfig.from_env()
+
+# Load the oemer models once per worker process instead of once per request
+oemer_engine = create_engine(ort_session_options, OEMER_PROVIDERS)
+# Admission costs an image at the cores its recognition actually takes: all of them for the
+# single-flight in-process engine, one job slot's threads for the CLI
+IMAGE_THREADS = ort_session_options.intra_op_num_threads if oemer_engine is not None else schedule.threads
+
+# Pages of PDF uploads are recognized concurrently on a process pool
+page_recognizer = PageRecognizer(OEMER_PROVIDERS, workers=PAGE_WORKERS or schedule.workers,
+                                 intra_op_threads=schedule.threads, cpu_sets=schedule.cpu_sets)
+
+# Images go to oemer or Audiveris (when Java and the JAR are present), whichever is expected
+# to answer first; MOBILSHEETS_ENGINE pins one of them
+omr_dispatcher = EngineDispatcher([
+    OemerOMR(oemer_engine, OEMER_PROVIDERS, OEMER_VERSION, schedule=schedule),
+    create_audiveris_engine(threads=schedule.threads),
+])
+
+# Dense single pages are cut into staff systems that the page pool recognizes in parallel.
+# The pool only runs oemer, so this needs oemer pinned; with 'auto' every image goes through
+# the dispatcher, keeping its routing, hedging and Audiveris fallback
+SEGMENT_SYSTEMS = SYSTEM_SEGMENTATION and page_recognizer.workers > 1 and omr_dispatcher.choice == 'oemer'
+
+# Conversions only start while their estimated memory and cores fit the budgets; the
+# rest queue by priority class or get a 503 with Retry-After
+admission = AdmissionController(default_memory_budget(), cpu_budget=schedule.workers * schedule.threads)
+
+def result_key(input_hash):
+    options = {'providers': OEMER_PROVIDERS, 'preprocess': preprocess_config.to_dict(), 'systems': SEGMENT_SYSTEMS}
+    return make_key(input_hash, 'omr', omr_dispatcher.identity, options)
+
+def read_artifacts(paths):
+    # Read now: a history blob can be deleted once the lookup has returned
+    try:
+        artifacts = {}
+        for kind, path in paths.items():
+            with open(path, 'rb') as f:
+                artifacts[kind] = f.read()
+        return artifacts
+    except OSError:
+        return None
+
+def cache_lookup(upload, near_duplicates=True):
+    """Return (cache_key, fingerprint, cached artifacts as {kind: bytes} or None) for a stored upload.
+
+    Images that miss the exact cache are fingerprinted, and with near_duplicates
+    the result of an earlier take of the same page is reused. The fingerprint
+    (None for PDFs) is indexed with the new result once it is stored.
+    """
+    with span('cache_lookup'):
+        cache_key = result_key(upload.sha256)
+        cached = result_cache.get(cache_key)
+        if cached and 'midi' in cached:
+            CACHE_LOOKUPS.inc(result='hit')
+            return cache_key, None, cached
+        stored = history.find(upload.sha256, result_key(None))
+        stored = read_artifacts(stored) if stored else None
+        if stored:
+            CACHE_LOOKUPS.inc(result='history_hit')
+            return cache_key, None, stored
+
+    fingerprint = None
+    if fingerprint_index.enabled and not upload.is_pdf:
+        with span('fingerprint'):
+            try:
+                fingerprint = page_fingerprint(upload.path)
+            except ValueError:
+                pass  # left for the engine to reject
+        match = fingerprint_index.nearest(fingerprint, result_key(None)) \
+            if fingerprint is not None and near_duplicates else None
+        if match:
+            key, distance = match
+            cached = result_cache.get(key)
+            if cached and 'midi' in cached:
+                app.logger.info('Reusing the result of a near-duplicate upload (%d bits apart)', distance)
+                CACHE_LOOKUPS.inc(result='near_hit')
+                return cache_key, None, cached
+            fingerprint_index.discard(key)  # evicted from the cache
+    CACHE_LOOKUPS.inc(result='miss')
+    return cache_key, fingerprint, None
+
+def remember(upload, artifacts, source, engine=None, pages=None, seconds=None):
+    """Add a conversion to the history; a failure there never fails the conversion."""
+    trace = metrics.current_trace()
+    try:
+        with span('history_store'):
+            history.record(upload.sha256, result_key(None), artifacts, source, client=upload.client,
+                           filename=upload.filename, input_size=upload.size, engine=engine, pages=pages,
+                           seconds=seconds, timings=dict(trace.totals()) if trace else None)
+    except (sqlite3.Error, OSError):
+        app.logger.exception('Could not record the conversion in the history')
+
+def upload_cost(upload):
+    return estimate_cost(upload.path, threads=schedule.threads, page_workers=page_recognizer.workers,
+                         pdf_dpi=PDF_DPI, page_count=count_pdf_pages, image_threads=IMAGE_THREADS)
+
+def run_conversion(upload, timeout=None, admission_wait=None, near_duplicates=True):
+    """Convert a stored upload and return the MIDI bytes.
+
+    Raises Overloaded when the conversion is not admitted within admission_wait
+    seconds (default: MOBILSHEETS_ADMISSION_MAX_WAIT).
+    """
+    # Serve repeat uploads of the same scan (or a retake of it) straight from the cache
+    cache_key, fingerprint, cached = cache_lookup(upload, near_duplicates)
+    if cached:
+        remember(upload, cached, 'cache')
+        return cached['midi']
+
+    cost = upload_cost(upload)
+    with admission.admit(cost, max_wait=admission_wait) as waited:
+        if waited:
+            app.logger.info('Admitted %s after %.1fs in the queue', cost.to_dict(), waited)
+        return convert_upload(upload, cache_key, timeout, fingerprint, cost)
+
+def convert_upload(upload, cache_key, timeout=None, fingerprint=None, cost=None):
+    """Run the full pipeline on an upload that missed the cache."""
+    for kind, midi, _ in convert_upload_pages(upload, cache_key, timeout, fingerprint, cost):
+        if kind == 'done':
+            return midi
+
+def system_cores(cost, systems):
+    """Take the extra cores for recognizing ``systems`` in parallel; False if they are not free."""
+    if cost is None:
+        return True
+    # An image admitted for the single-flight in-process engine may already hold enough
+    extra = min(systems, page_recognizer.workers) * schedule.threads - cost.cpus
+    return extra <= 0 or admission.try_grow(cost, extra)
+
+def convert_upload_pages(upload, cache_key, timeout=None, fingerprint=None, cost=None):
+    """Pipeline as a generator, for streaming.
+
+    ``cost`` is the admitted cost of the conversion; a segmented image only
+    fans out when the cores for its systems can be added to it.
+
+    Yields ('page', number, musicxml_path) as each page is recognized, in page
+    order, or ('system', number, musicxml_path) for the systems of a segmented
+    image, then ('done', midi, musicxml_path) for the whole score. Paths point
+    into the job workspace and are only valid until the next item is requested.
+    """
+    started = time.perf_counter()
+    with job_workspace() as workspace:
+        # The upload was spooled to disk as it arrived; engines only read it
+        image_path = upload.path
+        musicxml_path = workspace.path('output.musicxml')
+        engine, pages = 'oemer', 1
+        if image_path.endswith('.pdf'):
+            with span('pdf_split'):
+                page_paths = split_pdf(image_path, workspace.path('pages'))
+            pages = len(page_paths)
+            page_musicxml = []
+            with span('omr'):
+                for number, page_path in page_recognizer.recognize_iter(
+                        page_paths, workspace.root, preprocess_config, timeout=timeout):
+                    page_musicxml.append(page_path)
+                    yield 'page', number, page_path
+            with span('stitch'):
+                with open(musicxml_path, 'wb') as f:
+                    f.write(stitch_musicxml(page_musicxml))
+        else:
+            if preprocess_config.steps:
+                prepared_path = workspace.path('prepared' + preprocess_config.output_format)
+                with span('preprocess'):
+                    info = preprocess_image(image_path, prepared_path, preprocess_config)
+                app.logger.info('Preprocessed %s -> %s in %s', info['original_shape'], info['shape'], info['timings'])
+                image_path = prepared_path
+            system_paths = []
+            if SEGMENT_SYSTEMS:
+                with span('segment'):
+                    system_paths = split_systems(image_path, workspace.path('systems'))
+                if system_paths and not system_cores(cost, len(system_paths)):
+                    app.logger.info('No cores free for %d systems, recognizing the page whole', len(system_paths))
+                    system_paths = []
+            if system_paths:
+                system_musicxml = []
+                with span('omr'):
+                    for number, system_path in page_recognizer.recognize_iter(
+                            system_paths, workspace.path('systems'), timeout=timeout, label='system'):
+                        system_musicxml.append(system_path)
+                        yield 'system', number, system_path
+                app.logger.info('Recognized %d systems in parallel', len(system_paths))
+                with span('stitch'):
+                    with open(musicxml_path, 'wb') as f:
+                        f.write(stitch_musicxml(system_musicxml, systems=True))
+            else:
+                with span('omr'):
+                    musicxml_path, engine = omr_dispatcher.recognize(image_path, workspace, timeout=timeout)
+                app.logger.info('Recognized by %s', engine)
+                yield 'page', 1, musicxml_path
+
+        midi = convert_to_midi(musicxml_path, midi_path=None).getvalue()
+        with span('cache_store'):
+            result_cache.put(cache_key, {'musicxml': musicxml_path, 'midi': midi})
+            if fingerprint is not None and result_cache.enabled:
+                fingerprint_index.add(cache_key, fingerprint, result_key(None))
+        remember(upload, {'musicxml': musicxml_path, 'midi': midi}, 'recognized', engine=engine, pages=pages,
+                 seconds=time.perf_counter() - started)
+        yield 'done', midi, musicxml_path
+
+def sse(event, payload):
+    """One server-sent event with a JSON payload."""
+    return f'event: {event}\ndata: {json.dumps(payload, separators=(",", ":"))}\n\n'
+
+def score_payload(musicxml_source, midi=None):
+    """MusicXML text, base64 MIDI and WebAudio-friendly notes for a (partial) score (path or bytes)."""
+    musicxml = read_musicxml(musicxml_source)
+    payload = {'musicxml': musicxml.decode('utf-8', 'replace'), 'midi': None, 'notes': None, 'duration': None}
+    try:
+        score = parse_musicxml(musicxml)
+    except UnsupportedScore:
+        score = None
+    if score is not None:
+        payload['notes'] = note_events(score)
+        payload['duration'] = round(tick_to_seconds(score)(score.end_tick), 3)
+        if midi is None:
+            midi = write_midi(score)
+    if midi is not None:
+        payload['midi'] = base64.b64encode(midi).decode('ascii')
+    return payload
+
+def stream_conversion(upload, near_duplicates=True):
+    """text/event-stream response for one conversion.
+
+    Events: 'accepted' once admitted, one 'page' per recognized page (in page
+    order) or one 'system' per staff system of a segmented image, then 'done'
+    with the stitched score, or 'error'.
+    """
+    cache_key, fingerprint, cached = cache_lookup(upload, near_duplicates)
+    if cached:
+        remember(upload, cached, 'cache')
+        midi, musicxml = cached['midi'], cached.get('musicxml')
+
+        def replay():
+            payload = score_payload(musicxml, midi) if musicxml else \
+                {'midi': base64.b64encode(midi).decode('ascii')}
+            yield sse('done', dict(payload, cached=True))
+
+        return Response(replay(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+    cost = upload_cost(upload)
+    waited = admission.acquire(cost)  # Overloaded here still becomes a plain 503
+    started = time.monotonic()
+    state = {'released': False, 'seconds': None}
+    lock = threading.Lock()
 
-UPLOAD_FOLDER = 'Uploads'
-OUTPUT_FOLDER = 'output'
-MUSICXML_PATH = os.path.join(OUTPUT_FOLDER, 'output.musicxml')
+    def release():
+        # Runs from the generator or, if the client never reads the body, on close
+        with lock:
+            if state['released']:
+                return
+            state['released'] = True
+        admission.release(cost, state['seconds'])
 
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    def events():
+        try:
+            yield sse('accepted', dict(cost.to_dict(), queued_seconds=round(waited, 3)))
+            pages = convert_upload_pages(upload, cache_key, fingerprint=fingerprint, cost=cost)
+            for kind, value, musicxml_path in pages:
+                if kind in ('page', 'system'):
+                    yield sse(kind, dict(score_payload(musicxml_path), **{kind: value}))
+                else:
+                    state['seconds'] = time.monotonic() - started
+                    yield sse('done', dict(score_payload(musicxml_path, value), cached=False))
+        except Exception as e:
+            traceback.print_exc()
+            yield sse('error', {'error': str(e)})
+        finally:
+            release()
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream', headers=SSE_HEADERS)
+    response.call_on_close(release)
+    return response
+
+def run_job(job, timeout):
+    # Background jobs may wait for admission as long as they may run
+    upload = job.payload['upload']
+    try:
+        return run_conversion(upload, timeout=timeout, admission_wait=timeout,
+                              near_duplicates=job.payload.get('near_duplicates', True))
+    finally:
+        upload.discard()
+
+def send_midi(midi):
+    return send_file(io.BytesIO(midi), mimetype='audio/midi', as_attachment=True,
+                     download_name='output.mid')
+
+job_queue = JobQueue(run_job, workers=schedule.workers)
+
+CACHE_LOOKUPS = Counter('mobilsheets_cache_lookups_total', 'Result cache lookups', ('result',))
+Gauge('mobilsheets_job_queue_depth', 'Jobs waiting for a worker', function=lambda: job_queue.stats()['queue_depth'])
+Gauge('mobilsheets_cache_bytes', 'Bytes held by the result cache', function=lambda: result_cache.stats()['bytes'])
+Gauge('mobilsheets_cache_entries', 'Entries in the result cache', function=lambda: result_cache.stats()['entries'])
+Gauge('mobilsheets_admission_queue_depth', 'Conversions waiting for admission', function=lambda: admission.queue_depth)
+Gauge('mobilsheets_admission_memory_bytes', 'Estimated memory of admitted conversions',
+      function=lambda: admission.memory_in_use)
+Gauge('mobilsheets_admission_cpus', 'Cores reserved by admitted conversions', function=lambda: admission.cpus_in_use)
+
+if os.environ.get('MOBILSHEETS_PROFILE', '0') == '1':
+    profiler.start()
+
+@app.before_request
+def start_request_trace():
+    g.request_started = time.perf_counter()
+    g.trace = metrics.start_trace()
+
+@app.after_request
+def finish_request_trace(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                                method=request.method, status=response.status_code)
+    trace = g.pop('trace', None)
+    if trace is not None and (SERVER_TIMING or request.args.get('timing') == '1'):
+        response.headers['Server-Timing'] = trace.server_timing()
+    return response
+
+@app.teardown_request
+def clear_request_trace(error):
+    metrics.end_trace()
+
+def near_duplicates_allowed():
+    # ?near_duplicates=0 forces recognition even when a retake of the page was converted before
+    return request.args.get('near_duplicates', '1') != '0'
+
+def client_id():
+    # Optional; scopes the history to one device or user
+    return request.headers.get('X-Client-Id') or None
+
+def too_large(e):
+    return jsonify({'error': str(e), 'max_bytes': e.max_bytes}), 413
+
+def get_upload():
+    """Spool the multipart 'file' field to disk; returns (StoredUpload, error response)."""
+    if 'file' not in request.files:
+        return None, (jsonify({'error': 'No file uploaded'}), 400)
+    file = request.files['file']
+    if file.filename == '':
+        return None, (jsonify({'error': 'No file selected'}), 400)
+    try:
+        with span('upload_receive'):
+            upload = receive_upload(file.stream, file.filename)
+    except UploadTooLarge as e:
+        return None, too_large(e)
+    upload.client = client_id()
+    return upload, None
+
+def get_raw_upload():
+    """Spool the raw request body to disk in chunks, without multipart parsing."""
+    if request.content_length == 0:
+        return None, (jsonify({'error': 'Empty request body'}), 400)
+    filename = request.args.get('filename') or request.headers.get('X-Filename')
+    try:
+        with span('upload_receive'):
+            upload = receive_upload(request.stream, filename, content_length=request.content_length)
+    except UploadTooLarge as e:
+        return None, too_large(e)
+    if upload.size == 0:
+        upload.discard()
+        return None, (jsonify({'error': 'Empty request body'}), 400)
+    upload.client = client_id()
+    return upload, None
+
+def respond_conversion(upload):
+    """Convert a stored upload into the response; the upload is removed once it is sent."""
+    streaming = False
+    try:
+        # ?stream=1 (or Accept: text/event-stream) sends pages as they are recognized
+        if request.args.get('stream') == '1' or request.accept_mimetypes.best == 'text/event-stream':
+            response = stream_conversion(upload, near_duplicates_allowed())
+            response.call_on_close(upload.discard)
+            streaming = True
+            return response
+
+        midi = run_conversion(upload, near_duplicates=near_duplicates_allowed())
+        return send_midi(midi)
+
+    except Overloaded as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if not streaming:
+            upload.discard()
 
 @app.route('/')
 def home():
@@ -28,31 +482,174 @@ def home():
 
 @app.route('/convert', methods=['POST'])
 def convert():
+    upload, error = get_upload()
+    if error:
+        return error
+    return respond_conversion(upload)
+
+@app.route('/upload', methods=['POST'])
+def convert_raw():
+    # The body is the image or PDF itself, e.g. fetch(url, {body: blob}); ?filename= keeps its extension
+    upload, error = get_raw_upload()
+    if error:
+        return error
+    return respond_conversion(upload)
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    upload, error = get_upload()
+    if error:
+        return error
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file uploaded'}), 400
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
-        
-        # Save uploaded file
-        image_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        file.save(image_path)
-
-        # Run Oemer CLI with CPU provider
-        cmd = ['oemer', '--providers', 'CPUExecutionProvider', image_path, '-o', MUSICXML_PATH]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            return jsonify({'error': f'Oemer failed: {result.stderr}'}), 500
-        if not os.path.exists(MUSICXML_PATH):
-            return jsonify({'error': 'Oemer failed to generate MusicXML'}), 500
-
-        midi_path = convert_to_midi(MUSICXML_PATH)
-        return send_file(midi_path, as_attachment=True)
+        job = job_queue.submit({'upload': upload, 'near_duplicates': near_duplicates_allowed()})
+    except QueueFull as e:
+        upload.discard()
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    info = job.to_dict()
+    info['status_url'] = f'/jobs/{job.id}'
+    info['result_url'] = f'/jobs/{job.id}/result'
+    return jsonify(info), 202
 
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    # ?wait=N long-polls for up to N seconds until the job finishes
+    wait = min(request.args.get('wait', 0, type=float), MAX_POLL_WAIT)
+    job = job_queue.wait(job_id, wait)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status == FAILED:
+        return jsonify(job.to_dict()), 500
+    if job.status != DONE:
+        return jsonify(job.to_dict()), 409
+    return send_midi(job.result)
+
+@app.route('/jobs/stats')
+def jobs_stats():
+    return jsonify(job_queue.stats())
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(dict(result_cache.stats(), fingerprints=fingerprint_index.stats()))
+
+@app.route('/engines/stats')
+def engines_stats():
+    return jsonify(omr_dispatcher.stats())
+
+@app.route('/admission/stats')
+def admission_stats():
+    return jsonify(admission.stats())
+
+@app.route('/history')
+def history_list():
+    # Newest first; pass the returned next_cursor as ?cursor= for the following page
+    if not history.enabled:
+        return jsonify({'error': 'History is disabled'}), 404
+    limit = request.args.get('limit', 50, type=int)
+    items, next_cursor = history.list(client_id(), limit=limit, cursor=request.args.get('cursor', type=int))
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+@app.route('/history/stats')
+def history_stats():
+    return jsonify(history.stats())
+
+@app.route('/history/<int:conversion_id>', methods=['GET', 'DELETE'])
+def history_entry(conversion_id):
+    if not history.enabled:
+        return jsonify({'error': 'History is disabled'}), 404
+    if request.method == 'DELETE':
+        if not history.delete(conversion_id, client_id()):
+            return jsonify({'error': 'Unknown conversion'}), 404
+        return '', 204
+    info = history.info(conversion_id, client_id())
+    if info is None:
+        return jsonify({'error': 'Unknown conversion'}), 404
+    return jsonify(info)
+
+def parse_measure_range(value):
+    # "3-8", "3-" or "5"
+    first, _, last = value.partition('-')
+    first = int(first)
+    if not _:
+        return first, first
+    return first, int(last) if last else None
+
+@app.route('/history/<int:conversion_id>/notes')
+def history_notes(conversion_id):
+    """A past conversion as note events, optionally transposed, retimed, reduced to some
+    parts or cut to a measure range: ?transpose=-2&tempo=0.8&parts=P1,P2&measures=3-8.
+
+    The score is read into a NoteArray once and cached next to its MusicXML, so
+    each variant costs a few array operations. ?format=midi returns a MIDI file
+    instead of the JSON the web player uses.
+    """
+    if not history.enabled:
+        return jsonify({'error': 'History is disabled'}), 404
+    paths = history.derived_path(conversion_id, 'musicxml', 'notes.npz', client_id())
+    if paths is None:
+        return jsonify({'error': 'Unknown conversion or no MusicXML stored for it'}), 404
+    try:
+        with span('note_array'):
+            array = load_note_array(*paths)
+        if request.args.get('parts'):
+            array = array.select_parts(request.args['parts'].split(','))
+        if request.args.get('measures'):
+            array = array.slice_measures(*parse_measure_range(request.args['measures']))
+        array = array.transpose(request.args.get('transpose', 0, type=int))
+        array = array.scale_tempo(request.args.get('tempo', 1.0, type=float))
+        # Serialized inside the try, so parameters the writers reject are a 400 as well
+        if request.args.get('format') == 'midi':
+            return send_midi(array.to_midi())
+        return jsonify(array.to_json())
+    except UnsupportedScore as e:
+        return jsonify({'error': str(e)}), 422
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/history/<int:conversion_id>/<kind>')
+def history_artifact(conversion_id, kind):
+    # Served straight from the blob store, without converting again
+    if not history.enabled or kind not in ARTIFACT_KINDS:
+        return jsonify({'error': 'Not found'}), 404
+    path = history.artifact_path(conversion_id, kind, client_id())
+    if path is None:
+        return jsonify({'error': 'Unknown conversion or artifact'}), 404
+    if kind == 'midi':
+        return send_file(path, mimetype='audio/midi', as_attachment=True, download_name=f'{conversion_id}.mid')
+    return send_file(path, mimetype='application/vnd.recordare.musicxml+xml', as_attachment=True,
+                     download_name=f'{conversion_id}.musicxml')
+
+@app.route('/schedule')
+def schedule_info():
+    return jsonify(schedule.to_dict())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
+
+@app.route('/debug/profiler', methods=['GET', 'POST'])
+def sampling_profiler():
+    # POST ?action=start[&interval=0.005], ?action=stop or ?action=reset; GET returns folded stacks
+    if not DEBUG_ENDPOINTS:
+        return jsonify({'error': 'Set MOBILSHEETS_DEBUG_ENDPOINTS=1 to enable the profiler'}), 404
+    if request.method == 'GET':
+        return Response(profiler.folded(request.args.get('limit', type=int)), mimetype='text/plain')
+    action = request.args.get('action')
+    if action == 'start':
+        profiler.start(request.args.get('interval', type=float))
+    elif action == 'stop':
+        profiler.stop()
+    elif action == 'reset':
+        profiler.reset()
+    else:
+        return jsonify({'error': 'action must be start, stop or reset'}), 400
+    return jsonify(profiler.stats())
     
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=8080)
\ No newline at end of file
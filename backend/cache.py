@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_FOLDER = os.environ.get('MOBILSHEETS_CACHE_DIR', 'cache')
+CACHE_MAX_BYTES = int(os.environ.get('MOBILSHEETS_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+STAGING_PREFIX = '.staging-'
+STAGING_MAX_AGE = 3600  # older staging directories were left by a crashed process
+
+ARTIFACT_NAMES = {
+    'musicxml': 'output.musicxml',
+    'midi': 'output.mid',
+}
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(input_hash, engine, version, options=None):
+    # The key covers everything that can change the recognized score, so a
+    # new engine release or a different option set never serves stale output.
+    payload = json.dumps({
+        'input': input_hash,
+        'engine': engine,
+        'version': version,
+        'options': options or {},
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Content-addressed on-disk store of conversion artifacts with LRU eviction.
+
+    A ``max_bytes`` of 0 disables the cache: lookups always miss and nothing is stored.
+    """
+
+    def __init__(self, root=CACHE_FOLDER, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._load()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _load(self):
+        found = []
+        cutoff = time.time() - STAGING_MAX_AGE
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if shard.startswith(STAGING_PREFIX) and os.path.isdir(shard_dir) \
+                    and os.stat(shard_dir).st_mtime < cutoff:
+                # Another process may still be filling a recent one
+                shutil.rmtree(shard_dir, ignore_errors=True)
+                continue
+            if not os.path.isdir(shard_dir) or shard.startswith('.'):
+                continue
+            for key in os.listdir(shard_dir):
+                entry_dir = os.path.join(shard_dir, key)
+                if not os.path.isdir(entry_dir):
+                    continue
+                size = sum(e.stat().st_size for e in os.scandir(entry_dir) if e.is_file())
+                found.append((os.stat(entry_dir).st_mtime, key, size))
+        # Directory mtimes are bumped on every hit, so they restore LRU order.
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        """Return ``{kind: bytes}`` for a cached entry, or None.
+
+        The files are read under the lock, so a concurrent ``put`` cannot evict
+        the entry between the lookup and the read.
+        """
+        with self._lock:
+            if not self.enabled or key not in self._entries:
+                self.misses += 1
+                return None
+            entry_dir = self._entry_dir(key)
+            artifacts = {}
+            for kind, name in ARTIFACT_NAMES.items():
+                try:
+                    with open(os.path.join(entry_dir, name), 'rb') as f:
+                        artifacts[kind] = f.read()
+                except FileNotFoundError:
+                    pass
+            if not artifacts:
+                # Removed behind the cache's back
+                self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(entry_dir)
+        except OSError:
+            pass
+        return artifacts
+
+    def put(self, key, artifacts):
+        """Store artifacts given as ``{kind: path_or_bytes}``."""
+        if not self.enabled:
+            return
+        entry_dir = self._entry_dir(key)
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=self.root)
+        try:
+            size = 0
+            for kind, source in artifacts.items():
+                target = os.path.join(staging, ARTIFACT_NAMES[kind])
+                if isinstance(source, (bytes, bytearray)):
+                    with open(target, 'wb') as f:
+                        f.write(source)
+                else:
+                    shutil.copyfile(source, target)
+                size += os.path.getsize(target)
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return
+                os.replace(staging, entry_dir)
+                self._entries[key] = size
+                self._total_bytes += size
+                self._evict()
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > (1 if self.enabled else 0):
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -1,16 +1,61 @@
+import io
 import os
-from music21 import converter
+from metrics import span
+from musicxml_midi import UnsupportedScore, parse_musicxml, read_musicxml, write_midi
 
 OUTPUT_FOLDER = 'output'
 MIDI_PATH = os.path.join(OUTPUT_FOLDER, 'output.mid')
+MIDI_ENGINE = os.environ.get('MOBILSHEETS_MIDI_ENGINE', 'fast')  # fast or music21
 
-def convert_to_midi(musicxml_path):
+def _convert_with_music21(musicxml):
+    # music21 is only imported when a score needs it
+    from music21 import converter, midi
+
+    # Parse MusicXML file
+    with span('music21_parse'):
+        if isinstance(musicxml, (str, os.PathLike)):
+            score = converter.parse(musicxml)
+        else:
+            score = converter.parseData(read_musicxml(musicxml).decode('utf-8'), format='musicxml')
+    with span('music21_write'):
+        return midi.translate.streamToMidiFile(score).writestr()
+
+def convert_to_midi(musicxml, midi_path=MIDI_PATH):
+    """Convert MusicXML to MIDI.
+
+    ``musicxml`` is a path, bytes or a file-like object. The MIDI is written to
+    ``midi_path`` and that path is returned; with ``midi_path=None`` nothing
+    touches the disk and a ``BytesIO`` holding the MIDI is returned instead.
+
+    Scores go through the streaming converter in musicxml_midi first and fall
+    back to music21 for documents it does not support.
+    """
     try:
-        # Parse MusicXML file
-        score = converter.parse(musicxml_path)
+        if isinstance(musicxml, (bytes, bytearray, str, os.PathLike)):
+            source = musicxml
+        else:
+            # File objects are read once so the fallback can parse them again
+            source = musicxml.read()
+
+        data = None
+        if MIDI_ENGINE != 'music21':
+            try:
+                with span('musicxml_parse'):
+                    score = parse_musicxml(source)
+                with span('midi_write'):
+                    data = write_midi(score)
+            except UnsupportedScore:
+                data = None
+        if data is None:
+            data = _convert_with_music21(source)
+
         # Write to MIDI
-        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-        score.writeMidi(MIDI_PATH)
-        return MIDI_PATH
+        if midi_path is None:
+            return io.BytesIO(data)
+        with span('midi_save'):
+            os.makedirs(os.path.dirname(midi_path) or '.', exist_ok=True)
+            with open(midi_path, 'wb') as f:
+                f.write(data)
+        return midi_path
     except Exception as e:
         raise Exception(f'MIDI conversion failed: {str(e)}')
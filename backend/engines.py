@@ -0,0 +1,304 @@
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import Counter
+from oemer_engine import run_oemer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENGINE_CHOICE = os.environ.get('MOBILSHEETS_ENGINE', 'auto')  # auto, oemer or audiveris
+ENGINE_ORDER = [name.strip() for name in os.environ.get('MOBILSHEETS_ENGINE_ORDER', 'oemer,audiveris').split(',')]
+AUDIVERIS_MODE = os.environ.get('MOBILSHEETS_AUDIVERIS', 'auto')  # auto, on or off
+AUDIVERIS_WORKERS = int(os.environ.get('MOBILSHEETS_AUDIVERIS_WORKERS', 0))
+HEDGE_ENABLED = os.environ.get('MOBILSHEETS_HEDGE', '1') == '1'
+HEDGE_PERCENTILE = float(os.environ.get('MOBILSHEETS_HEDGE_PERCENTILE', 95))
+HEDGE_DELAY = float(os.environ.get('MOBILSHEETS_HEDGE_DELAY', 60))  # until enough samples exist
+MIN_SAMPLES = 20
+STATS_WINDOW = 200
+MAX_FAILURE_RATE = 0.5
+
+# Inputs are bucketed by file size, since latency grows with the image
+SIZE_CLASSES = ((512 * 1024, 'small'), (4 * 1024 * 1024, 'medium'), (math.inf, 'large'))
+
+ENGINE_RUNS = Counter('mobilsheets_engine_runs_total', 'OMR engine runs by outcome', ('engine', 'outcome'))
+HEDGES = Counter('mobilsheets_hedges_total', 'Hedged OMR requests by outcome', ('outcome',))
+
+
+def size_class(num_bytes):
+    for limit, name in SIZE_CLASSES:
+        if num_bytes < limit:
+            return name
+
+
+class OMREngine:
+    """Recognizes one image into a MusicXML file.
+
+    ``recognize`` writes below ``output_dir`` and returns the MusicXML path. It
+    should stop early when the ``cancel`` event is set, where the engine allows it;
+    engines that cannot stop set ``cancellable`` to False and are never hedged.
+    """
+
+    name = None
+    version = 'unknown'
+    cancellable = True
+
+    def recognize(self, image_path, output_dir, timeout=None, cancel=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class OemerOMR(OMREngine):
+    name = 'oemer'
+
+    def __init__(self, engine, providers, version='unknown', schedule=None):
+        self.engine = engine
+        self.providers = list(providers)
+        self.version = version
+        self.schedule = schedule
+
+    @property
+    def cancellable(self):
+        # The warm in-process engine cannot be interrupted; only the CLI honours cancel
+        return self.engine is None
+
+    def recognize(self, image_path, output_dir, timeout=None, cancel=None):
+        musicxml_path = os.path.join(output_dir, 'output.musicxml')
+        if self.schedule is None:
+            run_oemer(self.engine, image_path, musicxml_path, self.providers, timeout=timeout, cancel=cancel)
+            return musicxml_path
+        with self.schedule.slot() as cpus:
+            run_oemer(self.engine, image_path, musicxml_path, self.providers, timeout=timeout, cancel=cancel,
+                      affinity=cpus, threads=self.schedule.threads)
+        return musicxml_path
+
+
+class AudiverisOMR(OMREngine):
+    name = 'audiveris'
+
+    def __init__(self, converter):
+        self.converter = converter
+        self.version = converter.AUDIVERIS_VERSION
+
+    def recognize(self, image_path, output_dir, timeout=None, cancel=None):
+        return self.converter.recognize(image_path, output_dir, timeout=timeout, cancel=cancel)
+
+    def close(self):
+        self.converter.close()
+
+
+def create_audiveris_engine(mode=AUDIVERIS_MODE, workers=AUDIVERIS_WORKERS, threads=None):
+    """Return an AudiverisOMR when Java and the Audiveris JAR are available, else None.
+
+    ``threads`` caps the processors each Audiveris JVM sizes its thread pools for.
+    """
+    if mode == 'off':
+        return None
+    if REPO_DIR not in sys.path:
+        sys.path.append(REPO_DIR)
+    from audiveris_converter import AudiverisConverter
+
+    converter = AudiverisConverter(workers=workers, jvm_threads=threads)
+    if not converter.setup():
+        if mode == 'on':
+            raise RuntimeError('Audiveris was requested (MOBILSHEETS_AUDIVERIS=on) but is not available')
+        return None
+    return AudiverisOMR(converter)
+
+
+class EngineStats:
+    """Sliding window of (seconds, ok) outcomes for one engine and size class."""
+
+    def __init__(self, window=STATS_WINDOW):
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds, ok):
+        with self._lock:
+            self._outcomes.append((seconds, ok))
+
+    @property
+    def count(self):
+        return len(self._outcomes)
+
+    def failure_rate(self):
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def percentile(self, p):
+        with self._lock:
+            latencies = sorted(seconds for seconds, ok in self._outcomes if ok)
+        if not latencies:
+            return None
+        return latencies[max(0, math.ceil(p / 100 * len(latencies)) - 1)]
+
+    def to_dict(self):
+        return {
+            'samples': self.count,
+            'failure_rate': self.failure_rate(),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+        }
+
+
+class EngineDispatcher:
+    """Routes each image to an OMR engine and optionally hedges with a second one.
+
+    Engines are ranked per input size class by expected time to a successful
+    result (median latency divided by success rate); until an engine has
+    ``min_samples`` outcomes for a class, the configured order decides. With
+    hedging on, the runner-up starts once the first choice has been running
+    longer than its ``hedge_percentile`` latency; whichever finishes first
+    wins and the other is cancelled. Only engines that can be cancelled are
+    hedged, since a loser that keeps running would hold cores its conversion
+    has already given back. A failure falls back to the next engine.
+    """
+
+    def __init__(self, engines, choice=ENGINE_CHOICE, order=ENGINE_ORDER, hedge=HEDGE_ENABLED,
+                 hedge_percentile=HEDGE_PERCENTILE, hedge_delay=HEDGE_DELAY, min_samples=MIN_SAMPLES):
+        self.engines = {engine.name: engine for engine in engines if engine is not None}
+        if not self.engines:
+            raise ValueError('No OMR engine is available')
+        if choice != 'auto' and choice not in self.engines:
+            raise ValueError(f'OMR engine {choice!r} is not available (have: {", ".join(self.engines)})')
+        self.choice = choice
+        self.order = [name for name in order if name in self.engines] + \
+            [name for name in self.engines if name not in order]
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=8 * len(self.engines), thread_name_prefix='omr')
+
+    @property
+    def identity(self):
+        """Engine names and versions, for cache keys."""
+        return ';'.join(f'{name}={self.engines[name].version}' for name in sorted(self.engines))
+
+    def stats_for(self, engine_name, num_bytes):
+        key = (engine_name, size_class(num_bytes))
+        with self._stats_lock:
+            if key not in self._stats:
+                self._stats[key] = EngineStats()
+            return self._stats[key]
+
+    def rank(self, num_bytes):
+        """Engine names ordered best first for an input of num_bytes."""
+        if self.choice != 'auto':
+            return [self.choice]
+
+        def score(name):
+            stats = self.stats_for(name, num_bytes)
+            if stats.count < self.min_samples:
+                # Still being sampled: configured order, ahead of measured engines
+                return (0, self.order.index(name))
+            failure_rate = stats.failure_rate()
+            median = stats.percentile(50)
+            if failure_rate > MAX_FAILURE_RATE or median is None:
+                return (2, failure_rate)
+            return (1, median / (1 - failure_rate))
+
+        return sorted(self.engines, key=score)
+
+    def _hedge_after(self, name, num_bytes):
+        stats = self.stats_for(name, num_bytes)
+        if stats.count < self.min_samples:
+            return self.hedge_delay
+        return stats.percentile(self.hedge_percentile) or self.hedge_delay
+
+    def _run(self, name, image_path, output_dir, num_bytes, timeout, cancel):
+        started = time.perf_counter()
+        try:
+            musicxml_path = self.engines[name].recognize(image_path, output_dir, timeout=timeout, cancel=cancel)
+        except Exception:
+            if not cancel.is_set():
+                self.stats_for(name, num_bytes).add(time.perf_counter() - started, False)
+                ENGINE_RUNS.inc(engine=name, outcome='failed')
+            else:
+                ENGINE_RUNS.inc(engine=name, outcome='cancelled')
+            raise
+        self.stats_for(name, num_bytes).add(time.perf_counter() - started, True)
+        ENGINE_RUNS.inc(engine=name, outcome='ok')
+        return musicxml_path
+
+    def recognize(self, image_path, workspace, timeout=None):
+        """Recognize an image; returns (musicxml_path, engine_name)."""
+        num_bytes = os.path.getsize(image_path)
+        candidates = self.rank(num_bytes)
+        deadline = time.monotonic() + timeout if timeout else None
+
+        def remaining():
+            return max(0.1, deadline - time.monotonic()) if deadline else None
+
+        running = {}  # future -> (engine name, cancel event)
+
+        def start(name):
+            cancel = threading.Event()
+            output_dir = workspace.path(name)
+            os.makedirs(output_dir, exist_ok=True)
+            future = self._executor.submit(self._run, name, image_path, output_dir, num_bytes, remaining(), cancel)
+            running[future] = (name, cancel)
+
+        errors = []
+        start(candidates.pop(0))
+        try:
+            while running:
+                hedge_wait = None
+                if self.hedge and candidates and len(running) == 1:
+                    (first_name, _), = running.values()
+                    if self.engines[first_name].cancellable and self.engines[candidates[0]].cancellable:
+                        hedge_wait = self._hedge_after(first_name, num_bytes)
+                wait_for = min(x for x in (hedge_wait, remaining()) if x is not None) \
+                    if hedge_wait is not None or deadline else None
+                done, _ = wait(running, timeout=wait_for, return_when=FIRST_COMPLETED)
+                if not done:
+                    if deadline and time.monotonic() >= deadline:
+                        raise TimeoutError(f'OMR did not finish within {timeout:g}s')
+                    if candidates:
+                        HEDGES.inc(outcome='started')
+                        start(candidates.pop(0))
+                    continue
+                for future in done:
+                    name, _ = running.pop(future)
+                    try:
+                        musicxml_path = future.result()
+                    except Exception as e:
+                        errors.append(f'{name}: {e}')
+                        continue
+                    if running:
+                        HEDGES.inc(outcome=f'won_by_{name}')
+                    return musicxml_path, name
+                if not running and candidates:
+                    # Fall back to the next engine after a failure
+                    start(candidates.pop(0))
+        finally:
+            for _, cancel in running.values():
+                cancel.set()
+        raise Exception('OMR failed: ' + '; '.join(errors))
+
+    def stats(self):
+        with self._stats_lock:
+            keys = sorted(self._stats)
+        return {
+            'engines': {name: self.engines[name].version for name in self.engines},
+            'choice': self.choice,
+            'order': self.order,
+            'hedge': self.hedge,
+            'hedge_percentile': self.hedge_percentile,
+            'classes': {f'{name}/{size}': self._stats[(name, size)].to_dict() for name, size in keys},
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for engine in self.engines.values():
+            engine.close()
@@ -0,0 +1,252 @@
+import json
+import os
+import threading
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from cache import CACHE_FOLDER
+from imageinfo import image_size, image_size_bytes
+from preprocess import content_region, estimate_skew, ink_mask, page_region
+
+# Retakes of a page reuse an earlier result when their fingerprints differ in at most
+# NEAR_DUPLICATE_DISTANCE of FINGERPRINT_BITS bits
+NEAR_DUPLICATES = os.environ.get('MOBILSHEETS_NEAR_DUPLICATES', '1') == '1'
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get('MOBILSHEETS_NEAR_DUPLICATE_DISTANCE', 24))
+# A match is only reused when a second, independent hash of the page (gradient dHash) is
+# within CHECK_DISTANCE bits as well and the page proportions agree within ASPECT_TOLERANCE
+CHECK_DISTANCE = int(os.environ.get('MOBILSHEETS_NEAR_DUPLICATE_CHECK_DISTANCE', 32))
+ASPECT_TOLERANCE = 0.05
+FINGERPRINT_FILE = os.environ.get('MOBILSHEETS_FINGERPRINT_FILE', os.path.join(CACHE_FOLDER, 'fingerprints.jsonl'))
+
+# A page is normalized at WORK_SIZE, reduced to HASH_SIZE x HASH_SIZE and hashed from the
+# lowest DCT_SIZE x DCT_SIZE frequencies. Score pages all share the same coarse layout
+# (staves across the page), so the hash keeps 16x16 frequencies rather than pHash's usual 8x8.
+WORK_SIZE = 512
+HASH_SIZE = 64
+DCT_SIZE = 16
+FINGERPRINT_BITS = DCT_SIZE * DCT_SIZE
+CHECK_SIZE = 16  # the dHash compares neighbours on a CHECK_SIZE x CHECK_SIZE grid
+REDUCED_DECODE_SIZE = 2048  # larger images are decoded at a quarter scale
+
+
+# phash is indexed; dhash and aspect (height / width of the normalized page) confirm a match
+Fingerprint = namedtuple('Fingerprint', 'phash dhash aspect')
+
+
+def _decode(source):
+    in_memory = isinstance(source, (bytes, bytearray))
+    size = image_size_bytes(source) if in_memory else image_size(source)
+    # JPEG (and PNG) decoding at a reduced scale skips most of the work on phone photos
+    flags = cv2.IMREAD_REDUCED_GRAYSCALE_4 if size and max(size) >= REDUCED_DECODE_SIZE else cv2.IMREAD_GRAYSCALE
+    image = cv2.imdecode(np.frombuffer(source, np.uint8), flags) if in_memory else cv2.imread(str(source), flags)
+    if image is None:
+        raise ValueError('Unsupported or corrupt image')
+    return image
+
+
+def normalize_page(gray):
+    """Sheet of paper only, deskewed and cropped to the ink, at about WORK_SIZE pixels."""
+    scale = WORK_SIZE / max(gray.shape)
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    region = page_region(gray)
+    if region:
+        x, y, w, h = region
+        gray = gray[y:y + h, x:x + w]
+    mask = ink_mask(gray)
+    angle = estimate_skew(mask)
+    if abs(angle) >= 0.1:
+        height, width = gray.shape
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        gray = cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+        mask = ink_mask(gray)
+    box = content_region(mask, margin=0)
+    if box:
+        x, y, w, h = box
+        gray = gray[y:y + h, x:x + w]
+    return gray
+
+
+def _bits(values):
+    return int(''.join('1' if bit else '0' for bit in values), 2)
+
+
+def page_fingerprint(source):
+    """Fingerprint of the page in an image path or encoded bytes.
+
+    The indexed part is a perceptual hash (DCT pHash) of FINGERPRINT_BITS bits.
+    Lighting, scale, framing and small rotations of a retake barely change it.
+    """
+    gray = normalize_page(_decode(source))
+    # Equalizing removes the exposure differences between retakes
+    small = cv2.equalizeHist(cv2.resize(gray, (HASH_SIZE, HASH_SIZE), interpolation=cv2.INTER_AREA))
+    low = cv2.dct(small.astype(np.float32))[:DCT_SIZE, :DCT_SIZE].flatten()
+    # The DC term only measures overall brightness, so it does not set the median
+    phash = _bits(low > np.median(low[1:]))
+    grid = cv2.equalizeHist(cv2.resize(gray, (CHECK_SIZE + 1, CHECK_SIZE), interpolation=cv2.INTER_AREA))
+    grid = grid.astype(np.int16)
+    dhash = _bits((grid[:, 1:] > grid[:, :-1]).flatten())
+    return Fingerprint(phash, dhash, round(gray.shape[0] / gray.shape[1], 4))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class FingerprintIndex:
+    """Fingerprints of converted pages, searchable within a Hamming distance.
+
+    Uses multi-index hashing: each fingerprint is split into ``max_distance + 1``
+    chunks, and by the pigeonhole principle a fingerprint within ``max_distance``
+    bits matches at least one chunk exactly. A lookup therefore only compares
+    against the entries sharing a chunk instead of the whole index.
+
+    Entries are tied to a ``scope`` (engine and options), so a result is never
+    reused across engine versions. The index is an append-only JSON lines file,
+    compacted when loaded.
+    """
+
+    def __init__(self, path=FINGERPRINT_FILE, max_distance=NEAR_DUPLICATE_DISTANCE, bits=FINGERPRINT_BITS,
+                 enabled=NEAR_DUPLICATES, check_distance=CHECK_DISTANCE, aspect_tolerance=ASPECT_TOLERANCE):
+        self.path = path
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self.bits = bits
+        self.check_distance = check_distance
+        self.aspect_tolerance = aspect_tolerance
+        self.lookups = 0
+        self.matches = 0
+        self.rejected = 0  # within max_distance, but the second check disagreed
+        chunks = max(1, min(bits, max_distance + 1))
+        bounds = [bits * i // chunks for i in range(chunks + 1)]
+        self._chunks = list(zip(bounds[:-1], bounds[1:]))
+        self._tables = [{} for _ in self._chunks]
+        self._entries = {}  # result key -> (fingerprint, scope)
+        self._lock = threading.Lock()
+        self._load()
+
+    def _parts(self, fingerprint):
+        return [(fingerprint >> (self.bits - end)) & ((1 << (end - start)) - 1) for start, end in self._chunks]
+
+    def _insert(self, key, fingerprint, scope):
+        self._remove(key)
+        self._entries[key] = (fingerprint, scope)
+        for table, part in zip(self._tables, self._parts(fingerprint.phash)):
+            table.setdefault(part, set()).add(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for table, part in zip(self._tables, self._parts(entry[0].phash)):
+            keys = table.get(part)
+            keys.discard(key)
+            if not keys:
+                del table[part]
+
+    def _load(self):
+        lines = 0
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn write
+                    if 'remove' in record:
+                        self._remove(record['remove'])
+                    elif record.get('bits') == self.bits and 'check' in record:
+                        # Entries from before the second check cannot be confirmed and are dropped
+                        fingerprint = Fingerprint(int(record['fingerprint'], 16), int(record['check'], 16),
+                                                  record['aspect'])
+                        self._insert(record['key'], fingerprint, record['scope'])
+        except OSError:
+            return
+        if lines > 2 * len(self._entries):
+            try:
+                self._compact()
+            except OSError:
+                pass
+
+    def _compact(self):
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            for key, (fingerprint, scope) in self._entries.items():
+                f.write(self._record(key, fingerprint, scope) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def _record(self, key, fingerprint, scope):
+        return json.dumps({'key': key, 'fingerprint': f'{fingerprint.phash:0{self.bits // 4}x}',
+                           'check': f'{fingerprint.dhash:x}', 'aspect': fingerprint.aspect,
+                           'scope': scope, 'bits': self.bits})
+
+    def _append(self, line):
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+        except OSError:
+            pass  # the in-memory index still works
+
+    def add(self, key, fingerprint, scope):
+        """Record that the result stored under ``key`` came from a page with this fingerprint."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._insert(key, fingerprint, scope)
+            self._append(self._record(key, fingerprint, scope))
+
+    def discard(self, key):
+        """Forget ``key``, e.g. once its result has been evicted from the cache."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self._append(json.dumps({'remove': key}))
+
+    def confirms(self, fingerprint, other):
+        """Whether the dHash and page proportions agree too, so a pHash match is the same page."""
+        if abs(fingerprint.aspect / other.aspect - 1) > self.aspect_tolerance:
+            return False
+        return hamming(fingerprint.dhash, other.dhash) <= self.check_distance
+
+    def nearest(self, fingerprint, scope):
+        """Return ``(key, distance)`` of the closest confirmed entry within max_distance, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for table, part in zip(self._tables, self._parts(fingerprint.phash)):
+                candidates.update(table.get(part, ()))
+            best = None
+            for key in candidates:
+                other, other_scope = self._entries[key]
+                if other_scope != scope:
+                    continue
+                distance = hamming(fingerprint.phash, other.phash)
+                if distance > self.max_distance or (best is not None and distance >= best[1]):
+                    continue
+                if not self.confirms(fingerprint, other):
+                    self.rejected += 1
+                    continue
+                best = (key, distance)
+            if best is not None:
+                self.matches += 1
+            return best
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'lookups': self.lookups,
+                'matches': self.matches,
+                'rejected': self.rejected,
+                'bits': self.bits,
+                'max_distance': self.max_distance,
+                'check_distance': self.check_distance,
+            }
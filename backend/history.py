@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+HISTORY_FOLDER = os.environ.get('MOBILSHEETS_HISTORY_DIR', 'history')
+HISTORY_ENABLED = os.environ.get('MOBILSHEETS_HISTORY', '1') == '1'
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+ARTIFACT_KINDS = ('midi', 'musicxml')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    client TEXT,
+    filename TEXT,
+    input_sha256 TEXT NOT NULL,
+    input_size INTEGER,
+    scope TEXT NOT NULL,
+    engine TEXT,
+    source TEXT NOT NULL,
+    pages INTEGER,
+    seconds REAL,
+    timings TEXT,
+    midi_blob TEXT,
+    musicxml_blob TEXT
+);
+CREATE INDEX IF NOT EXISTS conversions_client ON conversions (client, id);
+CREATE INDEX IF NOT EXISTS conversions_input ON conversions (input_sha256, scope, id);
+CREATE INDEX IF NOT EXISTS conversions_midi_blob ON conversions (midi_blob);
+CREATE INDEX IF NOT EXISTS conversions_musicxml_blob ON conversions (musicxml_blob);
+"""
+
+COLUMNS = ('id', 'created', 'client', 'filename', 'input_sha256', 'input_size', 'scope', 'engine', 'source',
+           'pages', 'seconds', 'timings', 'midi_blob', 'musicxml_blob')
+
+
+class BlobStore:
+    """Content-addressed files: each artifact is stored once under its SHA-256."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, source):
+        """Store bytes or a file; returns its digest. Identical content is kept once."""
+        staging = tempfile.NamedTemporaryFile(dir=self.root, prefix='.staging-', delete=False)
+        digest = hashlib.sha256()
+        try:
+            with staging:
+                if isinstance(source, (bytes, bytearray)):
+                    digest.update(source)
+                    staging.write(source)
+                else:
+                    with open(source, 'rb') as f:
+                        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                            digest.update(chunk)
+                            staging.write(chunk)
+            target = self.path(digest.hexdigest())
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(staging.name, target)
+        finally:
+            if os.path.exists(staging.name):
+                os.remove(staging.name)
+        return digest.hexdigest()
+
+    def derived_path(self, digest, suffix):
+        """Where to cache something computed from a blob; removed along with it."""
+        return f'{self.path(digest)}.{suffix}'
+
+    def remove(self, digest):
+        shard = os.path.dirname(self.path(digest))
+        try:
+            names = [name for name in os.listdir(shard) if name == digest or name.startswith(digest + '.')]
+        except OSError:
+            return
+        for name in names:
+            try:
+                os.remove(os.path.join(shard, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        count = size = 0
+        for shard in os.scandir(self.root):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    count += '.' not in entry.name  # derived files do not count as blobs
+                    size += entry.stat().st_size
+        return {'blobs': count, 'bytes': size}
+
+
+class HistoryStore:
+    """SQLite index of past conversions, with their artifacts in a BlobStore.
+
+    The database runs in WAL mode, so listings never wait for a conversion
+    being recorded. Each thread keeps its own connection. Listings page with a
+    cursor (the last id seen) over indexed columns, so a page costs the same
+    however long the history gets.
+    """
+
+    def __init__(self, root=HISTORY_FOLDER, enabled=HISTORY_ENABLED):
+        self.root = root
+        self.enabled = enabled
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        if not enabled:
+            return
+        self.blobs = BlobStore(os.path.join(root, 'blobs'))
+        self.db_path = os.path.join(root, 'history.sqlite3')
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _to_dict(self, row):
+        item = {column: row[column] for column in COLUMNS if column not in ('scope', 'midi_blob', 'musicxml_blob')}
+        item['timings'] = json.loads(row['timings']) if row['timings'] else {}
+        item['artifacts'] = [kind for kind in ARTIFACT_KINDS if row[f'{kind}_blob']]
+        return item
+
+    def record(self, input_sha256, scope, artifacts, source, client=None, filename=None, input_size=None,
+               engine=None, pages=None, seconds=None, timings=None):
+        """Store ``artifacts`` ({kind: path_or_bytes}) and add a row; returns its id."""
+        if not self.enabled:
+            return None
+        with self._write_lock, self._connection() as connection:
+            # Under the lock, so a concurrent delete cannot remove a blob this row is about to use
+            blobs = {kind: self.blobs.put(artifacts[kind]) for kind in ARTIFACT_KINDS if artifacts.get(kind)}
+            cursor = connection.execute(
+                'INSERT INTO conversions (created, client, filename, input_sha256, input_size, scope, engine, '
+                'source, pages, seconds, timings, midi_blob, musicxml_blob) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (time.time(), client, filename, input_sha256, input_size, scope, engine, source, pages,
+                 seconds, json.dumps(timings or {}), blobs.get('midi'), blobs.get('musicxml')))
+            return cursor.lastrowid
+
+    def list(self, client, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """Newest first; returns (items, next cursor or None)."""
+        limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+        # IS rather than =, so anonymous callers (client None) see only anonymous rows
+        query = 'SELECT * FROM conversions WHERE client IS ?'
+        params = [client]
+        if cursor is not None:
+            query += ' AND id < ?'
+            params.append(cursor)
+        # One extra row tells whether another page follows
+        rows = self._connection().execute(query + ' ORDER BY id DESC LIMIT ?', params + [limit + 1]).fetchall()
+        next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+        return [self._to_dict(row) for row in rows[:limit]], next_cursor
+
+    def get(self, conversion_id, client):
+        """The row, if it belongs to ``client``; None is the scope of callers without an id."""
+        row = self._connection().execute('SELECT * FROM conversions WHERE id = ?', (conversion_id,)).fetchone()
+        if row is None or row['client'] != client:
+            return None
+        return row
+
+    def info(self, conversion_id, client):
+        row = self.get(conversion_id, client)
+        return self._to_dict(row) if row is not None else None
+
+    def artifact_path(self, conversion_id, kind, client):
+        """Path of a stored artifact, or None."""
+        row = self.get(conversion_id, client)
+        if row is None or not row[f'{kind}_blob']:
+            return None
+        path = self.blobs.path(row[f'{kind}_blob'])
+        return path if os.path.exists(path) else None
+
+    def derived_path(self, conversion_id, kind, suffix, client):
+        """(artifact path, cache path for data derived from it), or None."""
+        path = self.artifact_path(conversion_id, kind, client)
+        if path is None:
+            return None
+        return path, self.blobs.derived_path(os.path.basename(path), suffix)
+
+    def find(self, input_sha256, scope):
+        """Artifact paths of the latest conversion of this input under this scope, or None."""
+        if not self.enabled:
+            return None
+        row = self._connection().execute(
+            'SELECT * FROM conversions WHERE input_sha256 = ? AND scope = ? AND midi_blob IS NOT NULL '
+            'ORDER BY id DESC LIMIT 1', (input_sha256, scope)).fetchone()
+        if row is None:
+            return None
+        paths = {kind: self.blobs.path(row[f'{kind}_blob']) for kind in ARTIFACT_KINDS if row[f'{kind}_blob']}
+        if not all(os.path.exists(path) for path in paths.values()):
+            return None
+        return paths
+
+    def delete(self, conversion_id, client):
+        """Remove a conversion; blobs no other conversion refers to are removed too."""
+        with self._write_lock, self._connection() as connection:
+            row = self.get(conversion_id, client)
+            if row is None:
+                return False
+            connection.execute('DELETE FROM conversions WHERE id = ?', (conversion_id,))
+            for kind in ARTIFACT_KINDS:
+                digest = row[f'{kind}_blob']
+                if digest and connection.execute(
+                        'SELECT 1 FROM conversions WHERE midi_blob = ? OR musicxml_blob = ? LIMIT 1',
+                        (digest, digest)).fetchone() is None:
+                    self.blobs.remove(digest)
+        return True
+
+    def stats(self):
+        if not self.enabled:
+            return {'enabled': False}
+        count = self._connection().execute('SELECT COUNT(*) FROM conversions').fetchone()[0]
+        return dict(self.blobs.stats(), enabled=True, conversions=count)
@@ -0,0 +1,104 @@
+import io
+import struct
+
+# Image dimensions straight from the file header, without decoding any pixels
+
+
+def _png_size(header):
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+        return struct.unpack('>II', header[16:24])
+    return None
+
+
+def _gif_size(header):
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', header[6:10])
+    return None
+
+
+def _bmp_size(header):
+    if header[:2] == b'BM' and len(header) >= 26:
+        width, height = struct.unpack('<ii', header[18:26])
+        return width, abs(height)
+    return None
+
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        kind = marker[1]
+        if kind == 0xFF:
+            f.seek(-1, 1)  # padding byte
+            continue
+        if kind in (0xD8, 0x01) or 0xD0 <= kind <= 0xD7:
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        (size,) = struct.unpack('>H', length)
+        # SOF0-SOF15 carry the frame size, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= kind <= 0xCF and kind not in (0xC4, 0xC8, 0xCC):
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return width, height
+        f.seek(size - 2, 1)
+
+
+def _tiff_size(f, header):
+    endian = {b'II': '<', b'MM': '>'}.get(header[:2])
+    if endian is None or struct.unpack(endian + 'H', header[2:4])[0] != 42:
+        return None
+    (offset,) = struct.unpack(endian + 'I', header[4:8])
+    f.seek(offset)
+    (count,) = struct.unpack(endian + 'H', f.read(2))
+    width = height = None
+    for _ in range(count):
+        entry = f.read(12)
+        if len(entry) < 12:
+            break
+        tag, kind = struct.unpack(endian + 'HH', entry[:4])
+        value = struct.unpack(endian + ('H' if kind == 3 else 'I'), entry[8:10] if kind == 3 else entry[8:12])[0]
+        if tag == 256:
+            width = value
+        elif tag == 257:
+            height = value
+    if width and height:
+        return width, height
+    return None
+
+
+def _size(f):
+    header = f.read(32)
+    if header[:2] == b'\xff\xd8':
+        return _jpeg_size(f)
+    if header[:2] in (b'II', b'MM'):
+        return _tiff_size(f, header)
+    return _png_size(header) or _gif_size(header) or _bmp_size(header)
+
+
+def image_size(path):
+    """Return (width, height) of a PNG, JPEG, TIFF, BMP or GIF file, or None."""
+    try:
+        with open(path, 'rb') as f:
+            return _size(f)
+    except (OSError, struct.error):
+        return None
+
+
+def image_size_bytes(data):
+    """Like image_size, for an image held in memory."""
+    try:
+        return _size(io.BytesIO(data))
+    except struct.error:
+        return None
+
+
+def image_pixels(path):
+    """Number of pixels in an image, or None when the format is not recognized."""
+    size = image_size(path)
+    return size[0] * size[1] if size else None
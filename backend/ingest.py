@@ -0,0 +1,78 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from workspace import WORKSPACE_PREFIX, WORKSPACE_ROOT, Workspace
+
+MAX_UPLOAD_BYTES = int(os.environ.get('MOBILSHEETS_MAX_UPLOAD_MB', 50)) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 256 * 1024
+HEAD_BYTES = 64  # enough to sniff the format
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes):
+        super().__init__(f'Upload exceeds the limit of {max_bytes / (1024 * 1024):g} MB')
+        self.max_bytes = max_bytes
+
+
+class StoredUpload:
+    """An upload spooled to its own directory, with the SHA-256 of its content."""
+
+    def __init__(self, root, path, filename, sha256, size, head):
+        self.root = root
+        self.path = path
+        self.filename = filename
+        self.sha256 = sha256
+        self.size = size
+        self.head = head
+        self.client = None  # X-Client-Id of the uploader, for the history
+
+    @property
+    def is_pdf(self):
+        return self.head[:5] == b'%PDF-'
+
+    def discard(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def receive_upload(stream, filename=None, max_bytes=MAX_UPLOAD_BYTES, content_length=None,
+                   chunk_size=UPLOAD_CHUNK_BYTES, root=None):
+    """Copy ``stream`` to disk in chunks, hashing as it goes; returns a StoredUpload.
+
+    Raises UploadTooLarge as soon as the body is known to exceed ``max_bytes``,
+    from ``content_length`` before anything is read, otherwise once the limit
+    is crossed. The upload lives in a workspace-style directory, so a crashed
+    process leaves nothing that cleanup_stale_workspaces misses.
+    """
+    if content_length is not None and content_length > max_bytes:
+        raise UploadTooLarge(max_bytes)
+    root = root or WORKSPACE_ROOT
+    os.makedirs(root, exist_ok=True)
+    directory = tempfile.mkdtemp(prefix=WORKSPACE_PREFIX, dir=root)
+    path = Workspace(directory).input_path(filename)
+    digest = hashlib.sha256()
+    head = b''
+    size = 0
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                if len(head) < HEAD_BYTES:
+                    head += chunk[:HEAD_BYTES - len(head)]
+                digest.update(chunk)
+                f.write(chunk)
+        if head[:5] == b'%PDF-' and not path.endswith('.pdf'):
+            # Engines pick the reader from the extension
+            pdf_path = os.path.join(directory, 'input.pdf')
+            os.replace(path, pdf_path)
+            path = pdf_path
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    return StoredUpload(directory, path, filename, digest.hexdigest(), size, head)
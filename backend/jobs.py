@@ -0,0 +1,133 @@
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+JOB_QUEUE_DEPTH = int(os.environ.get('MOBILSHEETS_QUEUE_DEPTH', 32))
+JOB_TIMEOUT = float(os.environ.get('MOBILSHEETS_JOB_TIMEOUT', 300))
+JOB_HISTORY = int(os.environ.get('MOBILSHEETS_JOB_HISTORY', 1000))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, payload):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.finished_event = threading.Event()
+
+    def to_dict(self):
+        info = {
+            'job_id': self.id,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+        if self.error:
+            info['error'] = self.error
+        return info
+
+
+class JobQueue:
+    """Bounded queue of conversion jobs served by a fixed pool of worker threads.
+
+    ``handler(job, timeout)`` does the work and returns the job result; it is
+    expected to honour ``timeout`` (seconds) for any subprocess it starts.
+    ``workers`` is the scheduler's job count (MOBILSHEETS_WORKERS, else auto).
+    """
+
+    def __init__(self, handler, workers, max_queue=JOB_QUEUE_DEPTH,
+                 timeout=JOB_TIMEOUT, history=JOB_HISTORY):
+        self.handler = handler
+        self.timeout = timeout
+        self.history = history
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, payload):
+        job = Job(payload)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFull(f'Job queue is full ({self._queue.maxsize} pending)')
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout):
+        job = self.get(job_id)
+        if job is not None and timeout > 0:
+            job.finished_event.wait(timeout)
+        return job
+
+    def stats(self):
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return {
+            'workers': len(self._workers),
+            'queue_depth': self._queue.qsize(),
+            'max_queue': self._queue.maxsize,
+            'timeout': self.timeout,
+            'jobs': counts,
+        }
+
+    def _prune(self):
+        # Forget the oldest finished jobs once the history limit is reached
+        excess = len(self._jobs) - self.history
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].finished_event.is_set():
+                del self._jobs[job_id]
+                excess -= 1
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = RUNNING
+            job.started = time.time()
+            try:
+                job.result = self.handler(job, self.timeout)
+                job.status = DONE
+            except Exception as e:
+                traceback.print_exc()
+                job.error = str(e)
+                job.status = FAILED
+            finally:
+                job.finished = time.time()
+                job.payload = None
+                job.finished_event.set()
+                self._queue.task_done()
@@ -0,0 +1,392 @@
+import collections
+import contextvars
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(2 ** power * 1024 * 1024 for power in range(4, 15))  # 16 MB .. 16 GB
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in items]
+
+
+class Gauge(_Metric):
+    """A value that is set directly or read from ``function()`` at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), registry=None, function=None):
+        super().__init__(name, help, labelnames, registry)
+        self.function = function
+        self._values = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.function is not None:
+            return [f'{self.name} {_format_value(self.function())}']
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), registry=None, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._series[key] = (counts, total + value)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+
+    def unregister(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_SECONDS = Histogram(
+    'mobilsheets_stage_seconds', 'Wall-clock time spent in each conversion stage', ('engine', 'stage'))
+STAGE_ERRORS = Counter(
+    'mobilsheets_stage_errors_total', 'Conversion stages that raised', ('engine', 'stage'))
+CHILD_CPU_SECONDS = Histogram(
+    'mobilsheets_child_cpu_seconds', 'CPU time used by OMR subprocesses', ('command', 'mode'))
+CHILD_MAX_RSS_BYTES = Histogram(
+    'mobilsheets_child_max_rss_bytes', 'Peak resident memory of OMR subprocesses', ('command',),
+    buckets=BYTES_BUCKETS)
+REQUEST_SECONDS = Histogram(
+    'mobilsheets_request_seconds', 'HTTP request latency', ('endpoint', 'method', 'status'))
+
+
+# ---------------------------------------------------------------------------
+# Per-request traces, used for the Server-Timing header
+
+_current_trace = contextvars.ContextVar('mobilsheets_trace', default=None)
+
+
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []  # (name, seconds) in completion order
+
+    def add(self, name, seconds):
+        self.spans.append((name, seconds))
+
+    def totals(self):
+        totals = collections.OrderedDict()
+        for name, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def server_timing(self):
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.totals().items()]
+        entries.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(entries)
+
+
+def start_trace():
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def end_trace():
+    _current_trace.set(None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def traced():
+    """Collect the spans of the enclosed block into a fresh Trace."""
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def record(stage, seconds, engine='oemer'):
+    STAGE_SECONDS.observe(seconds, engine=engine, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage, engine='oemer'):
+    """Time a pipeline stage into STAGE_SECONDS and the current trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(engine=engine, stage=stage)
+        raise
+    finally:
+        record(stage, time.perf_counter() - started, engine)
+
+
+# ---------------------------------------------------------------------------
+# Subprocesses with resource usage
+
+class Cancelled(Exception):
+    pass
+
+
+def run_measured(cmd, name, timeout=None, cancel=None, text=True, affinity=None, **kwargs):
+    """``subprocess.run(cmd, capture_output=True)`` that also reports resource usage.
+
+    The child is reaped with ``os.wait4`` so its own CPU time and peak RSS are
+    known (not a sum over every child, as ``RUSAGE_CHILDREN`` would give).
+    Returns ``(CompletedProcess, usage)`` with usage holding ``user``,
+    ``system`` and ``wall`` seconds and ``max_rss_bytes``. The child is killed
+    when ``timeout`` expires (``subprocess.TimeoutExpired``) or when the
+    ``cancel`` event is set (``Cancelled``). ``affinity`` pins the child to a
+    set of CPU ids where the platform supports it.
+    """
+    if not hasattr(os, 'wait4'):
+        started = time.perf_counter()
+        result = subprocess.run(cmd, capture_output=True, text=text, timeout=timeout, **kwargs)
+        return result, {'wall': time.perf_counter() - started}
+
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        started = time.perf_counter()
+        process = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, **kwargs)
+        if affinity and hasattr(os, 'sched_setaffinity'):
+            try:
+                # Threads the child starts later inherit the mask
+                os.sched_setaffinity(process.pid, affinity)
+            except OSError:
+                pass
+        deadline = started + timeout if timeout else None
+        delay = 0.001
+        interrupted = None
+        while True:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if interrupted is None:
+                if cancel is not None and cancel.is_set():
+                    interrupted = Cancelled(f'{name} was cancelled')
+                elif deadline and time.perf_counter() > deadline:
+                    interrupted = subprocess.TimeoutExpired(cmd, timeout)
+                if interrupted is not None:
+                    process.kill()
+                    continue
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        wall = time.perf_counter() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        max_rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        usage = {'user': rusage.ru_utime, 'system': rusage.ru_stime, 'wall': wall, 'max_rss_bytes': max_rss}
+        CHILD_CPU_SECONDS.observe(rusage.ru_utime, command=name, mode='user')
+        CHILD_CPU_SECONDS.observe(rusage.ru_stime, command=name, mode='system')
+        CHILD_MAX_RSS_BYTES.observe(max_rss, command=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(f'{name}_cpu', rusage.ru_utime + rusage.ru_stime)
+        if interrupted is not None:
+            raise interrupted
+
+        outputs = []
+        for stream in (stdout, stderr):
+            stream.seek(0)
+            data = stream.read()
+            outputs.append(data.decode(errors='replace') if text else data)
+    return subprocess.CompletedProcess(cmd, process.returncode, *outputs), usage
+
+
+# ---------------------------------------------------------------------------
+# Sampling profiler
+
+class SamplingProfiler:
+    """Samples every thread's stack with ``sys._current_frames()`` on a timer.
+
+    Stacks are aggregated in the folded format understood by flamegraph.pl
+    and speedscope (``outer;inner;leaf count``).
+    """
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = collections.Counter()
+        self.sample_count = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        if self.running:
+            return False
+        if interval:
+            self.interval = interval
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return True
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+            self.sample_count = 0
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < self.max_depth:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                        frame = frame.f_back
+                    self.samples[';'.join(reversed(stack))] += 1
+                self.sample_count += 1
+
+    def folded(self, limit=None):
+        with self._lock:
+            items = self.samples.most_common(limit)
+        return ''.join(f'{stack} {count}\n' for stack, count in items)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'interval': self.interval,
+                'samples': self.sample_count,
+                'stacks': len(self.samples),
+            }
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,414 @@
+import bisect
+import io
+import os
+import struct
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+TICKS_PER_QUARTER = 480
+DEFAULT_TEMPO = 120.0
+DEFAULT_VELOCITY = 90
+PERCUSSION_CHANNEL = 9
+
+STEP_SEMITONES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+
+# onset and duration are in ticks; part is an index into Score.parts
+Note = namedtuple('Note', 'onset duration pitch velocity part measure')
+Part = namedtuple('Part', 'id name program channel')
+
+
+class UnsupportedScore(Exception):
+    """The score uses MusicXML features the fast converter does not handle."""
+
+
+class Score:
+    def __init__(self, ticks_per_quarter=TICKS_PER_QUARTER):
+        self.ticks_per_quarter = ticks_per_quarter
+        self.parts = []
+        self.notes = []
+        self.tempos = []  # (tick, bpm)
+        self.time_signatures = []  # (tick, beats, beat_type)
+        self.key_signatures = []  # (tick, fifths, minor)
+        self.measures = []  # (tick, number) where each measure of the first part starts
+        self.end_tick = 0
+
+
+def open_musicxml(source):
+    """Open a .musicxml/.mxl path, bytes or binary file object as an uncompressed XML stream."""
+    if isinstance(source, (str, os.PathLike)):
+        stream = open(source, 'rb')
+    elif isinstance(source, (bytes, bytearray)):
+        stream = io.BytesIO(source)
+    else:
+        stream = source
+
+    if not hasattr(stream, 'peek') and not stream.seekable():
+        stream = io.BytesIO(stream.read())
+    if hasattr(stream, 'peek'):
+        magic = stream.peek(2)[:2]
+    else:
+        position = stream.tell()
+        magic = stream.read(2)
+        stream.seek(position)
+    if magic != b'PK':
+        return stream
+
+    # Compressed .mxl: the container manifest names the score document
+    try:
+        with zipfile.ZipFile(stream) as archive:
+            names = archive.namelist()
+            rootfile = None
+            if 'META-INF/container.xml' in names:
+                container = ET.fromstring(archive.read('META-INF/container.xml'))
+                element = container.find('.//rootfile')
+                if element is not None:
+                    rootfile = element.get('full-path')
+            if rootfile is None:
+                rootfile = next(n for n in names
+                                if not n.startswith('META-INF/') and n.endswith(('.xml', '.musicxml')))
+            return io.BytesIO(archive.read(rootfile))
+    finally:
+        stream.close()
+
+
+def read_musicxml(source):
+    """Return uncompressed MusicXML bytes from a path, bytes or file-like object (.musicxml or .mxl)."""
+    with open_musicxml(source) as stream:
+        return stream.read()
+
+
+def _text(element, path, default=None):
+    child = element.find(path)
+    if child is None or child.text is None:
+        return default
+    return child.text.strip()
+
+
+def _integer(text, what):
+    try:
+        return int(text)
+    except ValueError:
+        raise UnsupportedScore(f'Unsupported {what}: {text!r}')
+
+
+def time_signature(element):
+    """(beats, beat_type) of a <time> element, or None when it has none (senza misura).
+
+    Composite meters such as 3+2/8 raise UnsupportedScore.
+    """
+    beats, beat_type = _text(element, 'beats'), _text(element, 'beat-type')
+    if not beats or not beat_type:
+        return None
+    return _integer(beats, 'time signature'), _integer(beat_type, 'time signature')
+
+
+def _pitch(note):
+    pitch = note.find('pitch')
+    if pitch is not None:
+        step, octave = _text(pitch, 'step'), _text(pitch, 'octave')
+        alter = float(_text(pitch, 'alter', 0))
+    else:
+        # Unpitched (percussion) notes are placed by their display position
+        unpitched = note.find('unpitched')
+        if unpitched is None:
+            return None
+        step, octave = _text(unpitched, 'display-step'), _text(unpitched, 'display-octave')
+        alter = 0
+    if step not in STEP_SEMITONES or octave is None:
+        return None
+    return (int(octave) + 1) * 12 + STEP_SEMITONES[step] + int(round(alter))
+
+
+def _add_once(events, item):
+    # Every part repeats the score-wide attributes; keep one copy per tick
+    if not events or events[-1][0] != item[0]:
+        events.append(item)
+    elif events[-1] != item:
+        events[-1] = item
+
+
+def parse_musicxml(source, ticks_per_quarter=TICKS_PER_QUARTER):
+    """Read a partwise MusicXML score incrementally into a flat list of notes."""
+    score = Score(ticks_per_quarter)
+    part_index = {}
+
+    stream = open_musicxml(source)
+    try:
+        context = ET.iterparse(stream, events=('start', 'end'))
+        for event, element in context:
+            tag = element.tag
+            if event == 'start':
+                if tag in ('score-timewise', 'opus'):
+                    raise UnsupportedScore(f'<{tag}> documents are not supported')
+                if tag == 'part' and element.get('id') is not None:
+                    part = part_index.get(element.get('id'))
+                    if part is None:
+                        part = _declare_part(score, part_index, element.get('id'), None, None, None)
+                    position = 0.0
+                    measure_end = 0.0
+                    divisions = 1.0
+                    last_onset = 0.0
+                    tied = {}
+                    velocity = DEFAULT_VELOCITY
+                    first_part = part == 0
+                elif tag == 'measure':
+                    measure_end = position
+                    measure_number = element.get('number')
+                    if first_part:
+                        score.measures.append((round(position), measure_number))
+                continue
+
+            if tag == 'score-part':
+                program = _text(element, 'midi-instrument/midi-program')
+                channel = _text(element, 'midi-instrument/midi-channel')
+                _declare_part(score, part_index, element.get('id'), _text(element, 'part-name', ''),
+                              int(program) - 1 if program else None,
+                              int(channel) - 1 if channel else None)
+                element.clear()
+
+            elif tag == 'divisions':
+                divisions = float(element.text)
+
+            elif tag == 'time' and first_part:
+                meter = time_signature(element)
+                if meter is not None:
+                    _add_once(score.time_signatures, (round(position),) + meter)
+
+            elif tag == 'key' and first_part:
+                fifths = _text(element, 'fifths')
+                if fifths is not None:
+                    _add_once(score.key_signatures,
+                              (round(position), _integer(fifths, 'key signature'),
+                               _text(element, 'mode') == 'minor'))
+
+            elif tag == 'sound':
+                if element.get('tempo') and first_part:
+                    _add_once(score.tempos, (round(position), float(element.get('tempo'))))
+                if element.get('dynamics'):
+                    # MusicXML dynamics are a percentage of forte (velocity 90)
+                    velocity = max(1, min(127, round(float(element.get('dynamics')) * 0.9)))
+
+            elif tag in ('backup', 'forward'):
+                ticks = float(_text(element, 'duration', 0)) * ticks_per_quarter / divisions
+                position += -ticks if tag == 'backup' else ticks
+                measure_end = max(measure_end, position)
+
+            elif tag == 'note':
+                if element.find('grace') is not None or element.find('cue') is not None:
+                    element.clear()
+                    continue
+                ticks = float(_text(element, 'duration', 0)) * ticks_per_quarter / divisions
+                if element.find('chord') is not None:
+                    onset = last_onset
+                else:
+                    onset = position
+                    position += ticks
+                    measure_end = max(measure_end, position)
+                last_onset = onset
+
+                pitch = None if element.find('rest') is not None else _pitch(element)
+                if pitch is not None:
+                    ties = {tie.get('type') for tie in element.findall('tie')}
+                    note_velocity = velocity
+                    if element.get('dynamics'):
+                        note_velocity = max(1, min(127, round(float(element.get('dynamics')) * 0.9)))
+                    previous = tied.pop(pitch, None) if 'stop' in ties else None
+                    if previous is not None:
+                        # Continuation of a tied note: lengthen the note already emitted
+                        held = score.notes[previous]
+                        score.notes[previous] = held._replace(
+                            duration=round(onset + ticks) - held.onset)
+                        index = previous
+                    else:
+                        score.notes.append(Note(round(onset), round(ticks), pitch, note_velocity,
+                                                part, measure_number))
+                        index = len(score.notes) - 1
+                    if 'start' in ties:
+                        tied[pitch] = index
+                element.clear()
+
+            elif tag == 'measure':
+                position = max(position, measure_end)
+                score.end_tick = max(score.end_tick, round(position))
+                element.clear()
+    except ET.ParseError as e:
+        raise UnsupportedScore(f'Malformed MusicXML: {e}')
+    except ValueError as e:
+        # A number the parser does not understand; music21 may still read the score
+        raise UnsupportedScore(f'Unsupported value in MusicXML: {e}')
+    finally:
+        stream.close()
+
+    if not score.parts:
+        raise UnsupportedScore('Score has no parts')
+    return score
+
+
+def _declare_part(score, part_index, part_id, name, program, channel):
+    if part_id in part_index:
+        return part_index[part_id]
+    index = len(score.parts)
+    if channel is None:
+        # Assign channels in order, leaving the General MIDI percussion channel alone
+        channel = index % 15
+        if channel >= PERCUSSION_CHANNEL:
+            channel += 1
+    score.parts.append(Part(part_id, name or part_id, program or 0, channel))
+    part_index[part_id] = index
+    return index
+
+
+def _var_len(value):
+    buffer = value & 0x7F
+    value >>= 7
+    out = bytearray()
+    while value:
+        out.insert(0, (value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(buffer)
+    return bytes(out)
+
+
+def _track(events):
+    """Encode (tick, order, payload) events as an MTrk chunk."""
+    data = bytearray()
+    last = 0
+    for tick, _, payload in sorted(events, key=lambda e: (e[0], e[1])):
+        data += _var_len(tick - last)
+        data += payload
+        last = tick
+    data += b'\x00\xff\x2f\x00'  # End of track
+    return b'MTrk' + struct.pack('>I', len(data)) + bytes(data)
+
+
+def _meta(kind, payload):
+    return bytes([0xFF, kind]) + _var_len(len(payload)) + payload
+
+
+def conductor_track(score):
+    """MTrk chunk with the time signatures, key signatures and tempos of a score."""
+    conductor = []
+    for tick, beats, beat_type in score.time_signatures:
+        power = max(0, beat_type.bit_length() - 1)
+        conductor.append((tick, 0, _meta(0x58, bytes([beats & 0xFF, power, 24, 8]))))
+    for tick, fifths, minor in score.key_signatures:
+        conductor.append((tick, 1, _meta(0x59, struct.pack('>bB', max(-7, min(7, fifths)), int(minor)))))
+    for tick, bpm in score.tempos or [(0, DEFAULT_TEMPO)]:
+        conductor.append((tick, 2, _meta(0x51, struct.pack('>I', round(60000000 / bpm))[1:])))
+    return _track(conductor)
+
+
+def part_header(part):
+    """Track name and program change that open a part's track, as raw event bytes."""
+    return _meta(0x03, part.name.encode('utf-8')), bytes([0xC0 | (part.channel & 0x0F), part.program & 0x7F])
+
+
+def smf_header(track_count, ticks_per_quarter):
+    return b'MThd' + struct.pack('>IHHH', 6, 1, track_count, ticks_per_quarter)
+
+
+def write_midi(score):
+    """Serialize a parsed score as a format 1 Standard MIDI File."""
+    tracks = [conductor_track(score)]
+    by_part = [[] for _ in score.parts]
+    for note in score.notes:
+        by_part[note.part].append(note)
+
+    for part, notes in zip(score.parts, by_part):
+        channel = part.channel & 0x0F
+        name, program = part_header(part)
+        events = [(0, 0, name), (0, 1, program)]
+        for note in notes:
+            # Note-offs sort before note-ons on the same tick so repeated pitches retrigger
+            events.append((note.onset, 3, bytes([0x90 | channel, note.pitch & 0x7F, note.velocity])))
+            events.append((note.onset + max(1, note.duration), 2,
+                           bytes([0x80 | channel, note.pitch & 0x7F, 0])))
+        tracks.append(_track(events))
+
+    return smf_header(len(tracks), score.ticks_per_quarter) + b''.join(tracks)
+
+
+def transpose_key_signatures(key_signatures, semitones):
+    """Key signatures moved by ``semitones`` around the circle of fifths."""
+    if semitones % 12 == 0:
+        return list(key_signatures)
+    # 7 fifths per semitone modulo 12
+    shift = (semitones * 7) % 12
+    return [(tick, (fifths + shift + 6) % 12 - 6, minor) for tick, fifths, minor in key_signatures]
+
+
+def transform_score(score, transpose=0, tempo_scale=1.0, parts=None):
+    """Return a copy of score transposed by ``transpose`` semitones, with tempos
+    multiplied by ``tempo_scale`` and only the given ``parts`` (indices or ids).
+
+    Percussion parts are never transposed. Notes pushed outside 0-127 are dropped.
+    """
+    if parts is not None:
+        wanted = {str(p) for p in parts}
+        keep = [i for i, part in enumerate(score.parts) if str(i) in wanted or part.id in wanted]
+        if not keep:
+            raise ValueError(f'None of the parts {", ".join(sorted(wanted))} are in the score')
+    else:
+        keep = list(range(len(score.parts)))
+    new_index = {old: new for new, old in enumerate(keep)}
+
+    result = Score(score.ticks_per_quarter)
+    result.parts = [score.parts[i] for i in keep]
+    result.time_signatures = list(score.time_signatures)
+    result.end_tick = score.end_tick
+    result.measures = list(score.measures)
+    tempos = score.tempos or [(0, DEFAULT_TEMPO)]
+    result.tempos = [(tick, bpm * tempo_scale) for tick, bpm in tempos]
+    result.key_signatures = transpose_key_signatures(score.key_signatures, transpose)
+
+    for note in score.notes:
+        if note.part not in new_index:
+            continue
+        pitch = note.pitch
+        if result.parts[new_index[note.part]].channel != PERCUSSION_CHANNEL:
+            pitch += transpose
+        if 0 <= pitch <= 127:
+            result.notes.append(note._replace(pitch=pitch, part=new_index[note.part]))
+    return result
+
+
+def tick_to_seconds(score):
+    """Return a function mapping a tick of score to seconds under its tempo map."""
+    tempos = sorted(score.tempos or [(0, DEFAULT_TEMPO)])
+    if tempos[0][0] != 0:
+        tempos.insert(0, (0, DEFAULT_TEMPO))
+    segments = []  # (start tick, start seconds, seconds per tick)
+    seconds = 0.0
+    for tick, bpm in tempos:
+        if segments:
+            start_tick, start_seconds, per_tick = segments[-1]
+            seconds = start_seconds + (tick - start_tick) * per_tick
+        segments.append((tick, seconds, 60.0 / (bpm * score.ticks_per_quarter)))
+    starts = [segment[0] for segment in segments]
+
+    def convert(tick):
+        start_tick, start_seconds, per_tick = segments[bisect.bisect_right(starts, tick) - 1]
+        return start_seconds + (tick - start_tick) * per_tick
+
+    return convert
+
+
+def note_events(score):
+    """Notes as compact [start, duration, pitch, velocity, channel] lists, in seconds.
+
+    Meant for clients that play scores without a MIDI parser (e.g. WebAudio).
+    """
+    seconds = tick_to_seconds(score)
+    events = []
+    for note in sorted(score.notes, key=lambda n: (n.onset, n.pitch)):
+        start = seconds(note.onset)
+        end = seconds(note.onset + max(1, note.duration))
+        events.append([round(start, 3), round(end - start, 3), note.pitch, note.velocity,
+                       score.parts[note.part].channel])
+    return events
+
+
+def musicxml_to_midi(source):
+    """Convert MusicXML (path, bytes or file object; .musicxml or .mxl) to MIDI bytes."""
+    return write_midi(parse_musicxml(source))
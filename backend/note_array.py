@@ -0,0 +1,241 @@
+import io
+import json
+import math
+import os
+
+import numpy as np
+
+from musicxml_midi import (DEFAULT_TEMPO, PERCUSSION_CHANNEL, Part, conductor_track, parse_musicxml, part_header,
+                           smf_header, transpose_key_signatures)
+
+# One row per note; onset and duration in ticks, measure as numbered in the score (-1 if not numeric)
+NOTE_DTYPE = np.dtype([
+    ('onset', '<i8'),
+    ('duration', '<i4'),
+    ('pitch', '<i2'),
+    ('velocity', 'u1'),
+    ('part', '<u2'),
+    ('measure', '<i4'),
+])
+
+NOTE_ARRAY_VERSION = 1
+
+
+def _measure_number(number):
+    try:
+        return int(number)
+    except (TypeError, ValueError):
+        return -1
+
+
+def _varlen_columns(values):
+    """Variable-length quantities as (N, 4) bytes plus a mask of the bytes in use."""
+    if values.size and values.max() >= 1 << 28:
+        raise ValueError('Delta time too large for a MIDI file')
+    groups = np.stack([(values >> shift) & 0x7F for shift in (21, 14, 7, 0)], axis=1).astype(np.uint8)
+    groups[:, :3] |= 0x80  # continuation bits, on every byte but the last
+    length = 1 + (values >= 1 << 7) + (values >= 1 << 14) + (values >= 1 << 21)
+    used = np.arange(4)[None, :] >= 4 - length[:, None]
+    return groups, used
+
+
+class NoteArray:
+    """A score as a structured array of notes plus its tempo, meter and key maps.
+
+    Built once per recognized score; transposing, tempo scaling, part selection
+    and measure ranges are array operations that return new NoteArrays, and
+    the result serializes straight to a MIDI file or to JSON for playback.
+    """
+
+    def __init__(self, notes, parts, tempos, time_signatures, key_signatures, measures, end_tick,
+                 ticks_per_quarter):
+        self.notes = notes
+        self.parts = list(parts)
+        self.tempos = list(tempos) or [(0, DEFAULT_TEMPO)]
+        self.time_signatures = list(time_signatures)
+        self.key_signatures = list(key_signatures)
+        self.measures = list(measures)  # (tick, number)
+        self.end_tick = end_tick
+        self.ticks_per_quarter = ticks_per_quarter
+
+    @classmethod
+    def from_score(cls, score):
+        notes = np.array([(n.onset, n.duration, n.pitch, n.velocity, n.part, _measure_number(n.measure))
+                          for n in score.notes], dtype=NOTE_DTYPE)
+        notes = notes[np.lexsort((notes['pitch'], notes['onset']))]
+        measures = [(tick, _measure_number(number)) for tick, number in score.measures]
+        return cls(notes, score.parts, score.tempos, score.time_signatures, score.key_signatures, measures,
+                   score.end_tick, score.ticks_per_quarter)
+
+    def _replace(self, **changes):
+        fields = dict(notes=self.notes, parts=self.parts, tempos=self.tempos,
+                      time_signatures=self.time_signatures, key_signatures=self.key_signatures,
+                      measures=self.measures, end_tick=self.end_tick, ticks_per_quarter=self.ticks_per_quarter)
+        fields.update(changes)
+        return NoteArray(**fields)
+
+    def _channels(self):
+        return np.array([part.channel for part in self.parts], dtype=np.int16)
+
+    def transpose(self, semitones):
+        """Shift every pitched part by ``semitones``; notes leaving 0-127 are dropped."""
+        if not semitones:
+            return self
+        pitched = self._channels()[self.notes['part']] != PERCUSSION_CHANNEL
+        # In int64, so a shift of any size lands outside 0-127 instead of wrapping around
+        pitch = self.notes['pitch'].astype(np.int64) + np.where(pitched, int(semitones), 0)
+        keep = (pitch >= 0) & (pitch <= 127)
+        notes = self.notes[keep].copy()
+        notes['pitch'] = pitch[keep]
+        return self._replace(notes=notes, key_signatures=transpose_key_signatures(self.key_signatures, semitones))
+
+    def scale_tempo(self, factor):
+        # NaN and infinity would end up in the tempo events of the MIDI and the JSON timings
+        if not (math.isfinite(factor) and factor > 0):
+            raise ValueError('Tempo scale must be a positive number')
+        return self._replace(tempos=[(tick, bpm * factor) for tick, bpm in self.tempos])
+
+    def select_parts(self, parts):
+        """Only the given parts (indices or ids), renumbered in score order."""
+        wanted = {str(p) for p in parts}
+        keep = [i for i, part in enumerate(self.parts) if str(i) in wanted or part.id in wanted]
+        if not keep:
+            raise ValueError(f'None of the parts {", ".join(sorted(wanted))} are in the score')
+        new_index = np.full(len(self.parts), -1, dtype=np.int32)
+        new_index[keep] = np.arange(len(keep))
+        notes = self.notes[new_index[self.notes['part']] >= 0].copy()
+        notes['part'] = new_index[notes['part']]
+        return self._replace(notes=notes, parts=[self.parts[i] for i in keep])
+
+    def slice_measures(self, first, last=None):
+        """Measures ``first`` to ``last`` (inclusive, as numbered in the score), starting at tick 0.
+
+        Notes held past the range are cut at its end; the tempo, meter and key
+        in effect at the start carry over.
+        """
+        starts = [tick for tick, number in self.measures if number >= first and (last is None or number <= last)]
+        if not starts:
+            raise ValueError(f'No measures numbered {first}-{"" if last is None else last} in the score')
+        start = min(starts)
+        following = [tick for tick, number in self.measures if last is not None and number > last]
+        end = min(following) if following else self.end_tick
+        onsets = self.notes['onset']
+        notes = self.notes[(onsets >= start) & (onsets < end)].copy()
+        notes['onset'] -= start
+        notes['duration'] = np.minimum(notes['duration'], end - start - notes['onset'])
+
+        def window(events):
+            # The event in effect at the start moves to tick 0, later ones shift with the notes
+            before = [event for event in events if event[0] <= start]
+            inside = [(event[0] - start,) + tuple(event[1:]) for event in events if start < event[0] < end]
+            return ([(0,) + tuple(before[-1][1:])] if before else []) + inside
+
+        measures = [(tick - start, number) for tick, number in self.measures if start <= tick < end]
+        return self._replace(notes=notes, tempos=window(self.tempos), time_signatures=window(self.time_signatures),
+                             key_signatures=window(self.key_signatures), measures=measures, end_tick=end - start)
+
+    def seconds(self, ticks):
+        """Vectorized tick to seconds under the tempo map."""
+        tempo_ticks = np.array([tick for tick, _ in self.tempos], dtype=np.int64)
+        per_tick = np.array([60.0 / (bpm * self.ticks_per_quarter) for _, bpm in self.tempos])
+        if tempo_ticks[0] != 0:
+            tempo_ticks = np.concatenate([[0], tempo_ticks])
+            per_tick = np.concatenate([[60.0 / (DEFAULT_TEMPO * self.ticks_per_quarter)], per_tick])
+        starts = np.concatenate([[0.0], np.cumsum(np.diff(tempo_ticks) * per_tick[:-1])])
+        segment = np.searchsorted(tempo_ticks, ticks, side='right') - 1
+        return starts[segment] + (ticks - tempo_ticks[segment]) * per_tick[segment]
+
+    def to_midi(self):
+        """Format 1 Standard MIDI File bytes; note events are encoded without a per-note loop."""
+        tracks = [conductor_track(self)]
+        for index, part in enumerate(self.parts):
+            notes = self.notes[self.notes['part'] == index]
+            channel = part.channel & 0x0F
+            count = len(notes)
+            ticks = np.concatenate([notes['onset'], notes['onset'] + np.maximum(1, notes['duration'])])
+            # Note-offs sort before note-ons on the same tick so repeated pitches retrigger
+            order = np.concatenate([np.ones(count, np.int8), np.zeros(count, np.int8)])
+            messages = np.empty((2 * count, 3), dtype=np.uint8)
+            messages[:count, 0] = 0x90 | channel
+            messages[count:, 0] = 0x80 | channel
+            messages[:, 1] = np.concatenate([notes['pitch'], notes['pitch']]) & 0x7F
+            messages[:count, 2] = notes['velocity']
+            messages[count:, 2] = 0
+            sort = np.lexsort((order, ticks))
+            ticks, messages = ticks[sort], messages[sort]
+            deltas = np.diff(ticks, prepend=0)
+            groups, used = _varlen_columns(deltas)
+            rows = np.concatenate([groups, messages], axis=1)
+            mask = np.concatenate([used, np.ones((len(rows), 3), dtype=bool)], axis=1)
+            name, program = part_header(part)
+            data = b'\x00' + name + b'\x00' + program + rows[mask].tobytes() + b'\x00\xff\x2f\x00'
+            tracks.append(b'MTrk' + len(data).to_bytes(4, 'big') + data)
+        return smf_header(len(tracks), self.ticks_per_quarter) + b''.join(tracks)
+
+    def events(self):
+        """[start, duration, pitch, velocity, channel] per note in seconds, as in note_events()."""
+        notes = self.notes
+        start = self.seconds(notes['onset'])
+        end = self.seconds(notes['onset'] + np.maximum(1, notes['duration']))
+        columns = [np.round(start, 3), np.round(end - start, 3), notes['pitch'], notes['velocity'],
+                   self._channels()[notes['part']]]
+        return np.stack(columns, axis=1).tolist() if len(notes) else []
+
+    def to_json(self):
+        """Compact payload for the web player."""
+        events = self.events()
+        for event in events:
+            event[2:] = [int(value) for value in event[2:]]
+        return {
+            'parts': [{'id': part.id, 'name': part.name, 'program': part.program, 'channel': part.channel}
+                      for part in self.parts],
+            'notes': events,
+            'duration': round(float(self.seconds(np.array([self.end_tick]))[0]), 3),
+        }
+
+    def to_bytes(self):
+        """Serialized form for caching next to the score."""
+        meta = {
+            'version': NOTE_ARRAY_VERSION,
+            'parts': [list(part) for part in self.parts],
+            'tempos': self.tempos,
+            'time_signatures': self.time_signatures,
+            'key_signatures': self.key_signatures,
+            'measures': self.measures,
+            'end_tick': self.end_tick,
+            'ticks_per_quarter': self.ticks_per_quarter,
+        }
+        buffer = io.BytesIO()
+        np.savez(buffer, notes=self.notes, meta=np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+            meta = json.loads(archive['meta'].tobytes().decode('utf-8'))
+            notes = archive['notes']
+        if meta.get('version') != NOTE_ARRAY_VERSION:
+            raise ValueError('Stale note array')
+        return cls(notes, [Part(*part) for part in meta['parts']],
+                   [tuple(event) for event in meta['tempos']],
+                   [tuple(event) for event in meta['time_signatures']],
+                   [tuple(event) for event in meta['key_signatures']],
+                   [tuple(event) for event in meta['measures']], meta['end_tick'], meta['ticks_per_quarter'])
+
+
+def load_note_array(musicxml_path, cache_path):
+    """NoteArray of a score, built from the MusicXML once and then read from ``cache_path``."""
+    try:
+        with open(cache_path, 'rb') as f:
+            return NoteArray.from_bytes(f.read())
+    except (OSError, ValueError, KeyError):
+        pass
+    array = NoteArray.from_score(parse_musicxml(musicxml_path))
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(array.to_bytes())
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # still usable, just built again next time
+    return array
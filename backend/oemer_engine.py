@@ -0,0 +1,115 @@
+import os
+import threading
+import traceback
+from argparse import Namespace
+
+import onnxruntime as ort
+
+from metrics import run_measured
+
+OEMER_MODE = os.environ.get('MOBILSHEETS_OEMER_MODE', 'auto')  # auto, inprocess or cli
+MODEL_NAMES = ('unet_big', 'seg_net')
+
+
+class OemerEngine:
+    """Runs oemer in-process against ONNX sessions that are loaded once.
+
+    oemer's ``inference()`` builds a fresh ``onnxruntime.InferenceSession`` on
+    every call. After ``load()`` the module-level ``InferenceSession`` factory
+    hands back the preloaded session for the oemer checkpoints instead, so a
+    request only pays for the actual inference.
+    """
+
+    def __init__(self, session_options, providers):
+        self.session_options = session_options
+        self.providers = list(providers)
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._ete = None
+
+    @property
+    def loaded(self):
+        return self._ete is not None
+
+    def load(self):
+        import oemer
+        from oemer import ete
+
+        for name in MODEL_NAMES:
+            model_path = os.path.join(oemer.MODULE_PATH, 'checkpoints', name, 'model.onnx')
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(
+                    f'oemer checkpoint missing: {model_path} (run the oemer CLI once to download it)')
+            self._sessions[os.path.abspath(model_path)] = ort.InferenceSession(
+                model_path, sess_options=self.session_options, providers=self.providers)
+        _install_session_factory(self._sessions)
+        self._ete = ete
+
+    def run(self, image_path, musicxml_path):
+        if not self.loaded:
+            raise RuntimeError('OemerEngine.load() has not been called')
+        args = Namespace(
+            img_path=os.path.abspath(image_path),
+            output_path=os.path.abspath(musicxml_path),
+            use_tf=False,
+            save_cache=False,
+            without_deskew=False,
+        )
+        # oemer keeps intermediate layers in module globals, so one page at a time
+        with self._lock:
+            self._ete.clear_data()
+            try:
+                return self._ete.extract(args)
+            finally:
+                self._ete.clear_data()
+
+
+_original_session = ort.InferenceSession
+
+
+def _install_session_factory(sessions):
+    def session_factory(path_or_bytes, *args, **kwargs):
+        if isinstance(path_or_bytes, (str, os.PathLike)):
+            session = sessions.get(os.path.abspath(path_or_bytes))
+            if session is not None:
+                return session
+        return _original_session(path_or_bytes, *args, **kwargs)
+
+    ort.InferenceSession = session_factory
+
+
+def create_engine(session_options, providers, mode=OEMER_MODE):
+    """Return a loaded engine, or None when oemer should run through its CLI."""
+    if mode == 'cli':
+        return None
+    engine = OemerEngine(session_options, providers)
+    try:
+        engine.load()
+    except Exception:
+        if mode == 'inprocess':
+            raise
+        traceback.print_exc()
+        print('In-process oemer unavailable, falling back to the oemer CLI')
+        return None
+    return engine
+
+
+def run_oemer(engine, image_path, musicxml_path, providers, timeout=None, cancel=None,
+              affinity=None, threads=None):
+    """Recognize one image with the warm engine, or the oemer CLI when engine is None.
+
+    ``cancel`` is an optional ``threading.Event`` that kills the CLI when set.
+    ``affinity`` (CPU ids) and ``threads`` bound the CLI's cores and BLAS threads.
+    """
+    if engine is not None:
+        # In-process inference cannot be interrupted, so timeout only bounds the CLI
+        engine.run(image_path, musicxml_path)
+    else:
+        # Run Oemer CLI with CPU provider
+        cmd = ['oemer', '--providers', *providers, image_path, '-o', musicxml_path]
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads)) if threads else None
+        result, _ = run_measured(cmd, 'oemer', timeout=timeout, cancel=cancel, affinity=affinity, env=env)
+        if result.returncode != 0:
+            raise Exception(f'Oemer failed: {result.stderr}')
+    if not os.path.exists(musicxml_path):
+        raise Exception('Oemer failed to generate MusicXML')
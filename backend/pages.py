@@ -0,0 +1,297 @@
+import copy
+import multiprocessing
+import os
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+from metrics import CHILD_CPU_SECONDS, record
+from musicxml_midi import UnsupportedScore, open_musicxml, time_signature
+
+PDF_DPI = int(os.environ.get('MOBILSHEETS_PDF_DPI', 300))
+PAGE_WORKERS = int(os.environ.get('MOBILSHEETS_PAGE_WORKERS', 0))  # 0: as many as the scheduler's workers
+MAX_PDF_PAGES = int(os.environ.get('MOBILSHEETS_MAX_PDF_PAGES', 100))
+
+PARTWISE_DOCTYPE = (b'<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" '
+                    b'"http://www.musicxml.org/dtds/partwise.dtd">\n')
+
+
+def is_pdf(data):
+    return data[:5] == b'%PDF-'
+
+
+def count_pdf_pages(pdf):
+    """Page count of a PDF given as a path or as bytes."""
+    document = fitz.open(stream=pdf, filetype='pdf') if isinstance(pdf, bytes) else fitz.open(pdf)
+    with document:
+        return document.page_count
+
+
+def split_pdf(pdf_path, output_dir, dpi=PDF_DPI, max_pages=MAX_PDF_PAGES):
+    """Rasterize every page of a PDF to a grayscale PNG; returns the paths in page order."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    with fitz.open(pdf_path) as document:
+        if document.page_count > max_pages:
+            raise ValueError(f'PDF has {document.page_count} pages, the limit is {max_pages}')
+        for number, page in enumerate(document, start=1):
+            pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+            path = os.path.join(output_dir, f'page-{number:03d}.png')
+            pixmap.save(path)
+            paths.append(path)
+    return paths
+
+
+# ---------------------------------------------------------------------------
+# Parallel recognition. Each pool process loads its own oemer engine once.
+
+_worker_engine = None
+_worker_providers = None
+
+
+def _init_page_worker(mode, providers, intra_op_threads, cpu_sets=None, counter=None):
+    global _worker_engine, _worker_providers
+    if cpu_sets and counter is not None and hasattr(os, 'sched_setaffinity'):
+        # Each pool process takes the next CPU set, before onnxruntime starts its threads
+        with counter.get_lock():
+            index = counter.value
+            counter.value += 1
+        os.sched_setaffinity(0, cpu_sets[index % len(cpu_sets)])
+    # Also bounds the BLAS threads of oemer CLI runs started from this process
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+
+    import onnxruntime as ort
+    from oemer_engine import create_engine
+
+    ort.set_default_logger_severity(3)
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    _worker_providers = providers
+    _worker_engine = create_engine(options, providers, mode=mode)
+
+
+def _recognize_page(image_path, musicxml_path, preprocess_config, timeout):
+    from oemer_engine import run_oemer
+
+    started, cpu_started = time.perf_counter(), time.process_time()
+    if preprocess_config is not None and preprocess_config.steps:
+        from preprocess import preprocess_image
+        prepared_path = os.path.splitext(image_path)[0] + '-prepared' + preprocess_config.output_format
+        preprocess_image(image_path, prepared_path, preprocess_config)
+        image_path = prepared_path
+    run_oemer(_worker_engine, image_path, musicxml_path, _worker_providers, timeout=timeout)
+    return time.perf_counter() - started, time.process_time() - cpu_started
+
+
+class PageRecognizer:
+    """Process pool that recognizes the pages of a score concurrently."""
+
+    def __init__(self, providers, mode=None, workers=PAGE_WORKERS, intra_op_threads=1, cpu_sets=None):
+        from oemer_engine import OEMER_MODE
+        self.providers = list(providers)
+        self.mode = mode or OEMER_MODE
+        self.workers = max(1, workers)
+        self.intra_op_threads = intra_op_threads
+        self.cpu_sets = cpu_sets
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn: forked copies of onnxruntime's thread pools are not safe to use
+            context = multiprocessing.get_context('spawn')
+            counter = context.Value('i', 0) if self.cpu_sets else None
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_page_worker,
+                initargs=(self.mode, self.providers, self.intra_op_threads, self.cpu_sets, counter),
+            )
+        return self._executor
+
+    def recognize(self, image_paths, output_dir, preprocess_config=None, timeout=None):
+        """Recognize pages in parallel; returns the MusicXML paths in page order."""
+        return [path for _, path in self.recognize_iter(image_paths, output_dir, preprocess_config, timeout)]
+
+    def recognize_iter(self, image_paths, output_dir, preprocess_config=None, timeout=None, label='page'):
+        """Recognize pages in parallel, yielding (page number, MusicXML path) in page order
+        as soon as each page and all the pages before it are done.
+
+        ``label`` names the pieces (pages, or the systems of one page) in file names and errors.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        outputs = [os.path.join(output_dir, f'{label}-{i:03d}.musicxml')
+                   for i in range(1, len(image_paths) + 1)]
+        futures = [
+            self._pool().submit(_recognize_page, image_path, output, preprocess_config, timeout)
+            for image_path, output in zip(image_paths, outputs)
+        ]
+        try:
+            for page, future in enumerate(futures, start=1):
+                remaining = max(0, deadline - time.monotonic()) if deadline else None
+                try:
+                    seconds, cpu_seconds = future.result(timeout=remaining)
+                except Exception as e:
+                    raise Exception(f'{label.capitalize()} {page}: {e}')
+                # Spans inside pool processes are not visible here, so record per page
+                record(label, seconds)
+                CHILD_CPU_SECONDS.observe(cpu_seconds, command='page_worker', mode='total')
+                yield page, outputs[page - 1]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+# ---------------------------------------------------------------------------
+# Stitching per-page MusicXML into one score
+
+class _PartState:
+    def __init__(self, meter):
+        self.divisions = '1'
+        self.attributes = {}
+        self.meter = meter  # [beats, beat_type], shared by all parts of the score
+
+
+def _signature(element):
+    return tuple((e.tag, (e.text or '').strip(), tuple(sorted(e.attrib.items())))
+                 for e in element.iter())
+
+
+def _attribute_signature(element):
+    # Keys and meters compare by what they mean, so a restatement that only differs
+    # in layout (print-object, a spelled-out major mode) still counts as a repeat
+    if element.tag == 'key' and element.findtext('fifths'):
+        return ('key', element.findtext('fifths').strip(), (element.findtext('mode') or 'major').strip())
+    if element.tag == 'time' and element.findtext('beats'):
+        return ('time', element.findtext('beats').strip(), (element.findtext('beat-type') or '').strip())
+    return _signature(element)
+
+
+def _carry_attributes(measure, state, drop_repeats):
+    """Track divisions/key/time/clef through a measure, optionally dropping restatements."""
+    for attributes in measure.findall('attributes'):
+        for child in list(attributes):
+            if child.tag == 'divisions':
+                repeated = child.text.strip() == state.divisions
+                state.divisions = child.text.strip()
+            elif child.tag in ('key', 'time', 'clef'):
+                slot = (child.tag, child.get('number'))
+                signature = _attribute_signature(child)
+                repeated = state.attributes.get(slot) == signature
+                state.attributes[slot] = signature
+                if child.tag == 'time':
+                    meter = time_signature(child)
+                    if meter is not None:
+                        state.meter[:] = meter
+            else:
+                continue
+            if drop_repeats and repeated:
+                attributes.remove(child)
+        if drop_repeats and len(attributes) == 0:
+            measure.remove(attributes)
+
+
+def _rest_measure(state, number):
+    # Placeholder for a part that is missing from a page
+    measure = ET.Element('measure', number=str(number))
+    note = ET.SubElement(measure, 'note')
+    ET.SubElement(note, 'rest', measure='yes')
+    beats, beat_type = state.meter
+    duration = int(float(state.divisions) * beats * 4 / beat_type)
+    ET.SubElement(note, 'duration').text = str(max(1, duration))
+    return measure
+
+
+def _mark_break(measure, kind):
+    prints = measure.find('print')
+    if prints is None:
+        prints = ET.Element('print')
+        measure.insert(0, prints)
+    prints.set(kind, 'yes')
+
+
+def stitch_musicxml(sources, new_page=True, systems=False):
+    """Join partwise MusicXML documents (one per page, in order) into one score.
+
+    Parts are matched by position, measures are renumbered to run on across
+    pages, restated divisions/key/time/clef are dropped, and a part missing
+    from a page is padded with whole-measure rests to keep the parts aligned.
+
+    With ``systems`` the documents are the staff systems of one page: breaks
+    between them are marked as new systems instead of new pages. Keys and
+    meters compare by value, so the key every system restates is dropped while
+    a real change at a system break is kept.
+    """
+    roots = []
+    for source in sources:
+        with open_musicxml(source) as stream:
+            root = ET.parse(stream).getroot()
+        if root.tag != 'score-partwise':
+            raise UnsupportedScore(f'Cannot stitch <{root.tag}> documents')
+        roots.append(root)
+    if not roots:
+        raise ValueError('Nothing to stitch')
+
+    base = roots[0]
+    part_list = base.find('part-list')
+    if part_list is None:
+        part_list = ET.Element('part-list')
+        base.insert(0, part_list)
+    parts = base.findall('part')
+    meter = [4, 4]
+    states = [_PartState(meter) for _ in parts]
+    first_number = 1
+    if parts and parts[0].find('measure') is not None:
+        number = parts[0].find('measure').get('number', '1')
+        first_number = int(number) if number.isdigit() else 1
+
+    total = 0
+    for part, state in zip(parts, states):
+        for index, measure in enumerate(part.findall('measure')):
+            measure.set('number', str(first_number + index))
+            _carry_attributes(measure, state, drop_repeats=index > 0)
+        total = max(total, len(part.findall('measure')))
+    for part, state in zip(parts, states):
+        while len(part.findall('measure')) < total:
+            part.append(_rest_measure(state, first_number + len(part.findall('measure'))))
+
+    for root in roots[1:]:
+        page_parts = root.findall('part')
+        page_length = max((len(p.findall('measure')) for p in page_parts), default=0)
+        page_list = root.find('part-list')
+        page_score_parts = page_list.findall('score-part') if page_list is not None else []
+
+        for index in range(max(len(parts), len(page_parts))):
+            if index >= len(parts):
+                # A part that first appears on a later page
+                part_id = f'P{index + 1}'
+                score_part = copy.deepcopy(page_score_parts[index]) if index < len(page_score_parts) \
+                    else ET.Element('score-part')
+                score_part.set('id', part_id)
+                part_list.append(score_part)
+                part = ET.SubElement(base, 'part', id=part_id)
+                parts.append(part)
+                states.append(_PartState(meter))
+                for number in range(total):
+                    part.append(_rest_measure(states[index], first_number + number))
+
+            part, state = parts[index], states[index]
+            measures = page_parts[index].findall('measure') if index < len(page_parts) else []
+            for offset, measure in enumerate(measures):
+                measure.set('number', str(first_number + total + offset))
+                _carry_attributes(measure, state, drop_repeats=True)
+                part.append(measure)
+            for offset in range(len(measures), page_length):
+                part.append(_rest_measure(state, first_number + total + offset))
+            if (new_page or systems) and page_length:
+                _mark_break(part.findall('measure')[total], 'new-system' if systems else 'new-page')
+        total += page_length
+
+    body = ET.tostring(base, encoding='utf-8', xml_declaration=False)
+    return b'<?xml version="1.0" encoding="UTF-8"?>\n' + PARTWISE_DOCTYPE + body
@@ -0,0 +1,205 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+PREPROCESS_STEPS = ('downscale', 'deskew', 'crop', 'binarize')
+TARGET_STAFF_SPACING = 20  # pixels between staff lines after downscaling
+MAX_DIMENSION = 3500
+MAX_SKEW_DEGREES = 10.0
+
+
+class PreprocessConfig:
+    """Which preprocessing steps run and how. Steps run in PREPROCESS_STEPS order."""
+
+    def __init__(self, steps=PREPROCESS_STEPS, target_staff_spacing=TARGET_STAFF_SPACING,
+                 max_dimension=MAX_DIMENSION, max_skew_degrees=MAX_SKEW_DEGREES,
+                 crop_margin=2.0, output_format='.png'):
+        unknown = set(steps) - set(PREPROCESS_STEPS)
+        if unknown:
+            raise ValueError(f'Unknown preprocessing steps: {", ".join(sorted(unknown))}')
+        self.steps = tuple(step for step in PREPROCESS_STEPS if step in steps)
+        self.target_staff_spacing = target_staff_spacing
+        self.max_dimension = max_dimension
+        self.max_skew_degrees = max_skew_degrees
+        self.crop_margin = crop_margin  # in staff spacings
+        self.output_format = output_format
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """Read MOBILSHEETS_PREPROCESS ("downscale,deskew,crop,binarize", "none", ...); default none."""
+        value = environ.get('MOBILSHEETS_PREPROCESS', 'none')
+        steps = [] if value.strip().lower() in ('', 'none', '0') else \
+            [step.strip() for step in value.split(',') if step.strip()]
+        return cls(
+            steps=steps,
+            target_staff_spacing=float(environ.get('MOBILSHEETS_STAFF_SPACING', TARGET_STAFF_SPACING)),
+        )
+
+    def to_dict(self):
+        return {
+            'steps': list(self.steps),
+            'target_staff_spacing': self.target_staff_spacing,
+            'max_dimension': self.max_dimension,
+            'max_skew_degrees': self.max_skew_degrees,
+            'crop_margin': self.crop_margin,
+            'output_format': self.output_format,
+        }
+
+
+def load_grayscale(source):
+    """Load an image path or encoded image bytes as 8-bit grayscale."""
+    if isinstance(source, (bytes, bytearray)):
+        image = cv2.imdecode(np.frombuffer(source, np.uint8), cv2.IMREAD_GRAYSCALE)
+    else:
+        image = cv2.imread(str(source), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError('Unsupported or corrupt image')
+    return image
+
+
+def ink_mask(gray):
+    """Binary mask (1 = ink) using Otsu's global threshold."""
+    _, mask = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return mask
+
+
+def estimate_staff_spacing(mask, columns=64):
+    """Most common distance between the tops of consecutive ink runs in sampled columns.
+
+    On sheet music this is dominated by staff lines, so it measures the
+    staff line spacing (line thickness included). Returns None without staves.
+    """
+    height, width = mask.shape
+    if height < 16 or width < 16:
+        return None
+    sample = mask[:, np.linspace(0, width - 1, min(columns, width)).astype(int)].T
+    starts = np.diff(sample.astype(np.int8), axis=1, prepend=0) == 1
+    cols, rows = np.nonzero(starts)
+    gaps = np.diff(rows)
+    gaps = gaps[(np.diff(cols) == 0) & (gaps >= 4) & (gaps <= height // 8)]
+    if gaps.size < 20:
+        return None
+    counts = np.bincount(gaps)
+    return float(np.argmax(counts))
+
+
+def estimate_skew(mask, max_degrees=MAX_SKEW_DEGREES):
+    """Median angle (degrees) of long near-horizontal lines, i.e. staff lines."""
+    height, width = mask.shape
+    lines = cv2.HoughLinesP(mask * 255, 1, np.pi / 720, threshold=width // 8,
+                            minLineLength=width // 4, maxLineGap=max(4, width // 200))
+    if lines is None:
+        return 0.0
+    # (N, 1, 4) before OpenCV 5, (N, 4) since
+    x1, y1, x2, y2 = lines.reshape(-1, 4).T.astype(np.float64)
+    angles = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+    angles = angles[np.abs(angles) <= max_degrees]
+    if angles.size == 0:
+        return 0.0
+    return float(np.median(angles))
+
+
+def page_region(gray):
+    """Bounding box of the sheet of paper in a photo, or None if it fills the frame."""
+    height, width = gray.shape
+    small = cv2.resize(gray, (max(1, width // 4), max(1, height // 4)), interpolation=cv2.INTER_AREA)
+    _, paper = cv2.threshold(cv2.GaussianBlur(small, (5, 5), 0), 0, 255,
+                             cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(paper, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    coverage = (w * h) / float(small.shape[0] * small.shape[1])
+    if coverage < 0.3 or coverage > 0.95:
+        return None
+    return x * 4, y * 4, w * 4, h * 4
+
+
+def content_region(mask, margin):
+    """Bounding box of rows/columns that carry a meaningful amount of ink."""
+    height, width = mask.shape
+    rows = np.nonzero(mask.sum(axis=1) > width * 0.01)[0]
+    cols = np.nonzero(mask.sum(axis=0) > height * 0.005)[0]
+    if rows.size == 0 or cols.size == 0:
+        return None
+    top = max(0, int(rows[0] - margin))
+    bottom = min(height, int(rows[-1] + margin + 1))
+    left = max(0, int(cols[0] - margin))
+    right = min(width, int(cols[-1] + margin + 1))
+    return left, top, right - left, bottom - top
+
+
+def preprocess_image(source, output_path, config=None):
+    """Normalize a score image for OMR and write it to ``output_path``.
+
+    Returns a dict with the per-step timings (seconds) and what each step did.
+    """
+    config = config or PreprocessConfig()
+    timings = {}
+    info = {'output_path': output_path, 'steps': list(config.steps), 'timings': timings}
+
+    started = time.perf_counter()
+    gray = load_grayscale(source)
+    info['original_shape'] = gray.shape
+    mask = ink_mask(gray)
+    spacing = estimate_staff_spacing(mask)
+    info['staff_spacing'] = spacing
+    timings['load'] = time.perf_counter() - started
+
+    if 'downscale' in config.steps:
+        started = time.perf_counter()
+        scale = 1.0
+        if spacing:
+            scale = config.target_staff_spacing / spacing
+        scale = min(scale, config.max_dimension / max(gray.shape))
+        if scale < 1.0:
+            # Never upscale; INTER_AREA keeps thin staff lines from aliasing away
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            mask = ink_mask(gray)
+            spacing = spacing * scale if spacing else None
+        info['scale'] = min(scale, 1.0)
+        timings['downscale'] = time.perf_counter() - started
+
+    if 'deskew' in config.steps:
+        started = time.perf_counter()
+        angle = estimate_skew(mask, config.max_skew_degrees)
+        if abs(angle) >= 0.1:
+            height, width = gray.shape
+            matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+            gray = cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                                  borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+            mask = ink_mask(gray)
+        info['skew_degrees'] = angle
+        timings['deskew'] = time.perf_counter() - started
+
+    if 'crop' in config.steps:
+        started = time.perf_counter()
+        region = page_region(gray)
+        if region:
+            x, y, w, h = region
+            gray, mask = gray[y:y + h, x:x + w], mask[y:y + h, x:x + w]
+        box = content_region(mask, config.crop_margin * (spacing or config.target_staff_spacing))
+        if box:
+            x, y, w, h = box
+            gray = gray[y:y + h, x:x + w]
+            if region:
+                x, y = x + region[0], y + region[1]
+        info['crop'] = (x, y, w, h) if box else region
+        timings['crop'] = time.perf_counter() - started
+
+    if 'binarize' in config.steps:
+        started = time.perf_counter()
+        # Adaptive thresholding copes with the uneven lighting of phone photos
+        block = int(2 * (spacing or config.target_staff_spacing)) | 1
+        gray = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                     cv2.THRESH_BINARY, max(block, 11), 10)
+        timings['binarize'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if not cv2.imwrite(output_path, np.ascontiguousarray(gray)):
+        raise ValueError(f'Could not write preprocessed image to {output_path}')
+    timings['write'] = time.perf_counter() - started
+    info['shape'] = gray.shape
+    return info
@@ -0,0 +1,278 @@
+import json
+import math
+import os
+import platform
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from cache import CACHE_FOLDER
+
+# 0 means "derive from the detected cores"
+SCHEDULE_WORKERS = int(os.environ.get('MOBILSHEETS_WORKERS', 0))
+SCHEDULE_THREADS = int(os.environ.get('MOBILSHEETS_THREADS_PER_JOB', 0))
+PIN_WORKERS = os.environ.get('MOBILSHEETS_PIN_WORKERS', '0') == '1'
+AUTOTUNE = os.environ.get('MOBILSHEETS_AUTOTUNE', '0') == '1'
+AUTOTUNE_FILE = os.environ.get('MOBILSHEETS_AUTOTUNE_FILE', os.path.join(CACHE_FOLDER, 'scheduler.json'))
+AUTOTUNE_SECONDS = float(os.environ.get('MOBILSHEETS_AUTOTUNE_SECONDS', 5))  # per candidate
+MAX_THREADS_PER_JOB = 4  # ONNX and Audiveris both scale poorly past a few threads per page
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_paths():
+    """Map of cgroup v1 controller (or '' for v2) to this process's cgroup path."""
+    paths = {}
+    for line in (_read('/proc/self/cgroup') or '').splitlines():
+        parts = line.split(':', 2)
+        if len(parts) == 3:
+            for controller in parts[1].split(','):
+                paths[controller] = parts[2]
+    return paths
+
+
+def cgroup_cpu_limit():
+    """CPU quota of this process's cgroup in cores (v2 cpu.max or v1 CFS), or None."""
+    paths = _cgroup_paths()
+    if '' in paths:
+        # cgroup v2: "<quota> <period>" or "max <period>", checked up the hierarchy
+        relative = paths['']
+        while True:
+            value = _read(os.path.join(CGROUP_ROOT, relative.lstrip('/'), 'cpu.max'))
+            if value:
+                quota, _, period = value.partition(' ')
+                if quota != 'max':
+                    return int(quota) / int(period)
+            if relative in ('', '/'):
+                break
+            relative = os.path.dirname(relative)
+    for controller_dir in ('cpu', 'cpu,cpuacct', 'cpuacct,cpu'):
+        # cgroup v1: the controller is mounted at the cgroup itself inside most containers
+        for relative in (paths.get('cpu', ''), '/'):
+            base = os.path.join(CGROUP_ROOT, controller_dir, relative.lstrip('/'))
+            quota = _read(os.path.join(base, 'cpu.cfs_quota_us'))
+            period = _read(os.path.join(base, 'cpu.cfs_period_us'))
+            if quota and period and int(quota) > 0:
+                return int(quota) / int(period)
+    return None
+
+
+def cgroup_memory_limit():
+    """Memory limit of this process's cgroup in bytes (v2 memory.max or v1), or None."""
+    paths = _cgroup_paths()
+    candidates = []
+    if '' in paths:
+        candidates.append(os.path.join(CGROUP_ROOT, paths[''].lstrip('/'), 'memory.max'))
+    if 'memory' in paths:
+        for relative in (paths['memory'], '/'):
+            candidates.append(os.path.join(CGROUP_ROOT, 'memory', relative.lstrip('/'), 'memory.limit_in_bytes'))
+    for path in candidates:
+        value = _read(path)
+        # v1 reports "no limit" as a huge page-aligned number
+        if value and value != 'max' and int(value) < 2 ** 60:
+            return int(value)
+    return None
+
+
+def detect_memory():
+    """Bytes of memory this process may use: physical memory capped by the cgroup limit."""
+    try:
+        physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        physical = None
+    limit = cgroup_memory_limit()
+    if physical and limit:
+        return min(physical, limit)
+    return limit or physical
+
+
+def available_cpus():
+    """CPU ids this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def detect_cores():
+    """Usable cores: the affinity mask, capped by any cgroup CPU quota."""
+    cpus = available_cpus()
+    limit = cgroup_cpu_limit()
+    usable = len(cpus)
+    if limit is not None:
+        usable = max(1, min(usable, math.floor(limit)))
+    return {'cpus': cpus, 'cgroup_limit': limit, 'usable': usable}
+
+
+def default_threads(cores):
+    """Threads per job: a quarter of the cores, between 1 and MAX_THREADS_PER_JOB."""
+    return max(1, min(MAX_THREADS_PER_JOB, cores // 4))
+
+
+class Schedule:
+    """``workers`` concurrent jobs with ``threads`` threads each.
+
+    With pinning, job slots map to disjoint CPU sets and ``slot()`` hands out
+    the least busy one; without pinning it yields None.
+    """
+
+    def __init__(self, workers, threads, cpus, pin=False, source='heuristic'):
+        self.workers = workers
+        self.threads = threads
+        self.pin = pin
+        self.source = source
+        self.cpu_sets = None
+        if pin:
+            # Consecutive CPUs per slot, wrapping around when workers x threads exceeds the mask
+            self.cpu_sets = [sorted({cpus[(i * threads + k) % len(cpus)] for k in range(threads)})
+                             for i in range(workers)]
+        self._busy = [0] * workers
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        """CPU set for one job (None without pinning); never blocks."""
+        if not self.cpu_sets:
+            yield None
+            return
+        with self._lock:
+            index = self._busy.index(min(self._busy))
+            self._busy[index] += 1
+        try:
+            yield self.cpu_sets[index]
+        finally:
+            with self._lock:
+                self._busy[index] -= 1
+
+    def to_dict(self):
+        return {
+            'workers': self.workers,
+            'threads': self.threads,
+            'pin': self.pin,
+            'cpu_sets': self.cpu_sets,
+            'source': self.source,
+        }
+
+
+def plan(cores, workers=0, threads=0):
+    """Split ``cores`` into workers x threads; explicit values win over the heuristic."""
+    if workers and not threads:
+        threads = max(1, cores // workers)
+    threads = threads or default_threads(cores)
+    workers = workers or max(1, cores // threads)
+    return workers, threads
+
+
+def host_key(cores):
+    """Identifies a host configuration in the autotune file."""
+    model = ''
+    for line in (_read('/proc/cpuinfo') or '').splitlines():
+        if line.startswith('model name'):
+            model = line.split(':', 1)[1].strip()
+            break
+    return f'{socket.gethostname()}|{platform.machine()}|{model or platform.processor()}|{cores}'
+
+
+def candidates(cores):
+    """Thread counts worth measuring: powers of two up to MAX_THREADS_PER_JOB."""
+    options = []
+    threads = 1
+    while threads <= min(cores, MAX_THREADS_PER_JOB):
+        options.append(threads)
+        threads *= 2
+    return options
+
+
+def measure(benchmark, workers, threads, seconds=AUTOTUNE_SECONDS):
+    """Run ``benchmark(threads)`` on ``workers`` threads for about ``seconds``; returns jobs/s.
+
+    ``benchmark`` is called once per worker to build a job function, so each
+    worker gets its own session; only the job runs are timed.
+    """
+    jobs = [benchmark(threads) for _ in range(workers)]
+    for job in jobs:
+        job()  # warm-up
+    completed = [0] * workers
+
+    def loop(index):
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            jobs[index]()
+            completed[index] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(loop, range(workers)))
+    return sum(completed) / (time.perf_counter() - started)
+
+
+def autotune(cores, benchmark, path=AUTOTUNE_FILE, seconds=AUTOTUNE_SECONDS):
+    """Best (workers, threads) for this host, measured once and stored in ``path``."""
+    key = host_key(cores)
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = {}
+    if key in stored:
+        return stored[key]['workers'], stored[key]['threads'], True
+
+    results = []
+    for threads in candidates(cores):
+        workers = max(1, cores // threads)
+        throughput = measure(benchmark, workers, threads, seconds)
+        results.append({'workers': workers, 'threads': threads, 'jobs_per_second': throughput})
+        print(f'Autotune: {workers} worker(s) x {threads} thread(s): {throughput:.2f} jobs/s')
+    best = max(results, key=lambda result: result['jobs_per_second'])
+    stored[key] = dict(best, measured=time.time(), candidates=results)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(stored, f, indent=2)
+    os.replace(tmp_path, path)
+    return best['workers'], best['threads'], False
+
+
+def onnx_benchmark(model_path, providers):
+    """Benchmark factory that runs one inference of an ONNX model on a zero input."""
+    import numpy as np
+    import onnxruntime as ort
+
+    def build(threads):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+        feeds = {}
+        for model_input in session.get_inputs():
+            # Symbolic dimensions: batch of one, 256 pixels otherwise
+            shape = [dim if isinstance(dim, int) else (1 if i == 0 else 256)
+                     for i, dim in enumerate(model_input.shape)]
+            feeds[model_input.name] = np.zeros(shape, dtype=np.float32)
+        return lambda: session.run(None, feeds)
+
+    return build
+
+
+def load_schedule(benchmark=None, workers=SCHEDULE_WORKERS, threads=SCHEDULE_THREADS,
+                  pin=PIN_WORKERS, tune=AUTOTUNE):
+    """Schedule for this process: explicit settings, else autotuned, else the heuristic."""
+    cores = detect_cores()
+    source = 'configured' if workers or threads else 'heuristic'
+    if tune and benchmark is not None and not (workers or threads):
+        try:
+            workers, threads, cached = autotune(cores['usable'], benchmark)
+            source = 'autotune (stored)' if cached else 'autotune'
+        except Exception as e:
+            print(f'Autotune failed, using the heuristic schedule: {e}')
+    workers, threads = plan(cores['usable'], workers, threads)
+    return Schedule(workers, threads, cores['cpus'], pin=pin, source=source)
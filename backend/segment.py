@@ -0,0 +1,106 @@
+import os
+
+import cv2
+import numpy as np
+
+from preprocess import estimate_staff_spacing, ink_mask, load_grayscale
+
+# Dense pages are cut into staff systems that are recognized in parallel
+SYSTEM_SEGMENTATION = os.environ.get('MOBILSHEETS_SYSTEM_SEGMENTATION', '1') == '1'
+MIN_SYSTEMS = 2  # fewer systems are not worth the extra engine runs
+STAFF_LINE_FRACTION = 0.5  # of the longest row of ink
+SYSTEM_MARGIN = 4.0  # in staff spacings, above the first and below the last system
+BRACKET_FRACTION = 0.95  # of the gap between two staves a connecting line must cover
+
+
+def staff_lines(mask):
+    """Center rows of horizontal lines that run across most of the page."""
+    projection = mask.sum(axis=1)
+    if projection.max() == 0:
+        return []
+    rows = np.nonzero(projection >= projection.max() * STAFF_LINE_FRACTION)[0]
+    # Lines thicker than a pixel show up as runs of consecutive rows
+    runs = np.split(rows, np.nonzero(np.diff(rows) > 1)[0] + 1)
+    return [int(run.mean()) for run in runs if run.size]
+
+
+def group_staves(lines, spacing):
+    """(top, bottom) of each staff: runs of four or five lines about ``spacing`` apart."""
+    staves = []
+    group = []
+    for line in lines:
+        if group and line - group[-1] > 1.5 * spacing:
+            staves.extend(_staves_in(group))
+            group = []
+        group.append(line)
+    staves.extend(_staves_in(group))
+    return staves
+
+
+def _staves_in(group):
+    # Two staves drawn closer than usual merge into one run of ten lines
+    if len(group) < 4:
+        return []
+    return [(chunk[0], chunk[-1]) for chunk in (group[i:i + 5] for i in range(0, len(group), 5))
+            if len(chunk) >= 4]
+
+
+def connected(mask, upper, lower):
+    """Whether a vertical line (system bracket or barline) joins two staves."""
+    gap = mask[upper[1] + 1:lower[0]]
+    if gap.shape[0] == 0:
+        return True
+    return bool((gap.mean(axis=0) >= BRACKET_FRACTION).any())
+
+
+def find_systems(mask, spacing=None):
+    """(top, bottom) rows of each staff system, from the horizontal ink projection.
+
+    Staves joined by a vertical line belong to the same system (a grand staff
+    or a score's bracket); unconnected staves are systems of their own.
+    """
+    lines = staff_lines(mask)
+    if spacing is None:
+        spacing = estimate_staff_spacing(mask) or (float(np.median(np.diff(lines))) if len(lines) > 1 else None)
+    if not spacing:
+        return []
+    systems = []
+    for staff in group_staves(lines, spacing):
+        if systems and connected(mask, (systems[-1][0], systems[-1][1]), staff):
+            systems[-1] = (systems[-1][0], staff[1])
+        else:
+            systems.append(staff)
+    return systems
+
+
+def system_crops(systems, height, spacing):
+    """Row ranges to cut: between systems at the middle of the gap, margins at the page edges."""
+    margin = int(SYSTEM_MARGIN * spacing)
+    crops = []
+    for index, (top, bottom) in enumerate(systems):
+        start = (systems[index - 1][1] + top) // 2 if index else max(0, top - margin)
+        end = (bottom + systems[index + 1][0]) // 2 if index + 1 < len(systems) else min(height, bottom + margin)
+        crops.append((start, end))
+    return crops
+
+
+def split_systems(image_path, output_dir, min_systems=MIN_SYSTEMS):
+    """Cut a page image into one image per staff system; returns the paths top to bottom.
+
+    Returns an empty list when the page has fewer than ``min_systems`` systems.
+    """
+    gray = load_grayscale(image_path)
+    mask = ink_mask(gray)
+    spacing = estimate_staff_spacing(mask)
+    systems = find_systems(mask, spacing)
+    if len(systems) < min_systems:
+        return []
+    spacing = spacing or (systems[0][1] - systems[0][0]) / 4
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for number, (start, end) in enumerate(system_crops(systems, gray.shape[0], spacing), start=1):
+        path = os.path.join(output_dir, f'system-{number:03d}.png')
+        if not cv2.imwrite(path, gray[start:end]):
+            raise ValueError(f'Could not write system image to {path}')
+        paths.append(path)
+    return paths
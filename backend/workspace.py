@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+WORKSPACE_ROOT = os.environ.get('MOBILSHEETS_WORK_DIR') or tempfile.gettempdir()
+WORKSPACE_PREFIX = 'mobilsheets-'
+ALLOWED_INPUT_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp', '.pdf'}
+
+
+class Workspace:
+    """Private scratch directory for a single conversion."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def input_path(self, filename):
+        # Never trust the client-supplied name; only keep a known extension
+        # so downstream tools can still sniff the format from it.
+        ext = os.path.splitext(filename or '')[1].lower()
+        if ext not in ALLOWED_INPUT_EXTENSIONS:
+            ext = '.png'
+        return self.path('input' + ext)
+
+
+@contextmanager
+def job_workspace(root=None):
+    """Create an isolated workspace and remove it once the block exits."""
+    root = root or WORKSPACE_ROOT
+    os.makedirs(root, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=WORKSPACE_PREFIX, dir=root)
+    try:
+        yield Workspace(path)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def cleanup_stale_workspaces(max_age=3600, root=None):
+    """Remove workspaces left behind by a crashed process."""
+    root = root or WORKSPACE_ROOT
+    if not os.path.isdir(root):
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age
+    for entry in os.scandir(root):
+        if entry.name.startswith(WORKSPACE_PREFIX) and entry.is_dir() \
+                and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Deterministic stand-ins for the oemer CLI and the Audiveris JVM.
+
+Both fakes derive a plausible MusicXML score from a hash of the input image,
+so the same corpus always produces the same MusicXML and MIDI work. That lets
+the rest of the pipeline (uploads, preprocessing, parsing, MIDI writing,
+batching, worker management) be benchmarked without Java or OMR models.
+
+Usage (normally through the shims written by install_fakes()):
+    python benchmarks/fake_engines.py oemer [--providers P ...] <image> -o <output.musicxml>
+    python benchmarks/fake_engines.py java -version
+    python benchmarks/fake_engines.py java -cp <classpath> org.audiveris.omr.Main -batch -export -output <dir> <images...>
+    python benchmarks/fake_engines.py java -cp <classpath> AudiverisWorker.java
+
+Environment:
+    MOBILSHEETS_FAKE_OMR_SECONDS   simulated recognition time per image (default: 0)
+    MOBILSHEETS_FAKE_JVM_SECONDS   simulated JVM startup time (default: 0)
+    MOBILSHEETS_FAKE_MEASURES      measures per recognized score (default: 32)
+"""
+
+import hashlib
+import os
+import random
+import stat
+import sys
+import time
+import zipfile
+
+STEPS = ("C", "D", "E", "F", "G", "A", "B")
+DIVISIONS = 4  # per quarter note
+MEASURE_LENGTH = 4 * DIVISIONS
+DURATION_TYPES = {1: "16th", 2: "eighth", 4: "quarter", 8: "half", 16: "whole"}
+JAVA_VERSION = 'openjdk version "17.0.9" 2023-10-17'
+
+
+def _setting(name, default):
+    """Read a numeric fake engine setting from the environment."""
+    return type(default)(os.environ.get(name, default))
+
+
+def score_seed(image_path):
+    """Seed derived from the image contents, so identical images give identical scores."""
+    with open(image_path, "rb") as f:
+        return int.from_bytes(hashlib.sha256(f.read()).digest()[:8], "big")
+
+
+def _note_xml(step, octave, duration, chord=False, tie=None, rest=False):
+    """Render one <note> element."""
+    parts = ["<note>"]
+    if chord:
+        parts.append("<chord/>")
+    if rest:
+        parts.append("<rest/>")
+    else:
+        parts.append(f"<pitch><step>{step}</step><octave>{octave}</octave></pitch>")
+    parts.append(f"<duration>{duration}</duration>")
+    if tie:
+        parts.append(f'<tie type="{tie}"/>')
+    parts.append(f"<type>{DURATION_TYPES.get(duration, 'quarter')}</type>")
+    if tie:
+        parts.append(f'<notations><tied type="{tie}"/></notations>')
+    parts.append("</note>")
+    return "".join(parts)
+
+
+def _measure_xml(rng, number, low_octave, attributes):
+    """Render one measure of random notes, chords, rests and ties."""
+    parts = [f'<measure number="{number}">']
+    if attributes:
+        parts.append(attributes)
+    position = 0
+    tied = None
+    while position < MEASURE_LENGTH:
+        duration = rng.choice([d for d in (2, 4, 4, 8) if position + d <= MEASURE_LENGTH] or [1])
+        if tied is not None:
+            step, octave = tied
+            parts.append(_note_xml(step, octave, duration, tie="stop"))
+            tied = None
+        elif rng.random() < 0.1:
+            parts.append(_note_xml(None, None, duration, rest=True))
+        else:
+            degree = rng.randrange(14)
+            step, octave = STEPS[degree % 7], low_octave + degree // 7
+            tie = None
+            if position + duration < MEASURE_LENGTH and rng.random() < 0.08:
+                tie, tied = "start", (step, octave)
+            parts.append(_note_xml(step, octave, duration, tie=tie))
+            if tie is None and rng.random() < 0.2:
+                third = degree + 2
+                parts.append(_note_xml(STEPS[third % 7], low_octave + third // 7, duration, chord=True))
+        position += duration
+    parts.append("</measure>")
+    return "".join(parts)
+
+
+def fake_musicxml(seed, measures=None):
+    """Build a two-part partwise MusicXML score (bytes) from a seed."""
+    measures = measures or _setting("MOBILSHEETS_FAKE_MEASURES", 32)
+    rng = random.Random(seed)
+    fifths = rng.randrange(-3, 4)
+    tempo = rng.choice((72, 96, 120, 144))
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<score-partwise version="4.0">',
+        "<part-list>",
+        '<score-part id="P1"><part-name>Right Hand</part-name></score-part>',
+        '<score-part id="P2"><part-name>Left Hand</part-name></score-part>',
+        "</part-list>",
+    ]
+    for part_id, clef, low_octave in (("P1", ("G", 2), 4), ("P2", ("F", 4), 2)):
+        parts.append(f'<part id="{part_id}">')
+        for number in range(1, measures + 1):
+            attributes = ""
+            if number == 1:
+                attributes = (
+                    f"<attributes><divisions>{DIVISIONS}</divisions>"
+                    f"<key><fifths>{fifths}</fifths></key>"
+                    "<time><beats>4</beats><beat-type>4</beat-type></time>"
+                    f"<clef><sign>{clef[0]}</sign><line>{clef[1]}</line></clef></attributes>"
+                )
+                if part_id == "P1":
+                    attributes += f'<sound tempo="{tempo}"/>'
+            parts.append(_measure_xml(rng, number, low_octave, attributes))
+        parts.append("</part>")
+    parts.append("</score-partwise>")
+    return "\n".join(parts).encode("utf-8")
+
+
+def write_mxl(path, musicxml, member_name):
+    """Write a compressed MusicXML (.mxl) container like Audiveris exports."""
+    container = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        "<container><rootfiles>"
+        f'<rootfile full-path="{member_name}" media-type="application/vnd.recordare.musicxml+xml"/>'
+        "</rootfiles></container>"
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("mimetype", "application/vnd.recordare.musicxml")
+        archive.writestr("META-INF/container.xml", container)
+        archive.writestr(member_name, musicxml)
+
+
+def fake_oemer(argv):
+    """Mimic `oemer [--providers ...] <image> -o <output>`."""
+    output = None
+    positional = []
+    args = iter(argv)
+    for arg in args:
+        if arg in ("-o", "--output-path"):
+            output = next(args)
+        elif arg == "--providers":
+            continue
+        elif arg.endswith("ExecutionProvider"):
+            continue
+        else:
+            positional.append(arg)
+    if not positional:
+        print("usage: oemer [--providers P ...] img_path [-o output_path]", file=sys.stderr)
+        return 2
+    image_path = positional[0]
+    if not os.path.isfile(image_path):
+        print(f"Image not found: {image_path}", file=sys.stderr)
+        return 1
+    time.sleep(_setting("MOBILSHEETS_FAKE_OMR_SECONDS", 0.0))
+    if output is None or os.path.isdir(output):
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        output = os.path.join(output or ".", stem + ".musicxml")
+    with open(output, "wb") as f:
+        f.write(fake_musicxml(score_seed(image_path)))
+    return 0
+
+
+def _export_book(image_path, output_dir):
+    """Write the <stem>.mxl and <stem>.omr files Audiveris produces for one image."""
+    time.sleep(_setting("MOBILSHEETS_FAKE_OMR_SECONDS", 0.0))
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    os.makedirs(output_dir, exist_ok=True)
+    mxl_path = os.path.join(output_dir, stem + ".mxl")
+    write_mxl(mxl_path, fake_musicxml(score_seed(image_path)), stem + ".xml")
+    with zipfile.ZipFile(os.path.join(output_dir, stem + ".omr"), "w") as book:
+        book.writestr("book.xml", f'<book software="fake-audiveris" path="{image_path}"/>')
+    return mxl_path
+
+
+def _worker_loop():
+    """Speak the AudiverisWorker.java line protocol on stdin/stdout."""
+    jobs = 0
+    print("READY", flush=True)
+    for line in sys.stdin:
+        fields = line.rstrip("\n").split("\t")
+        if fields[0] == "PING":
+            print(f"PONG\t{64 << 20}\t{1 << 30}\t{jobs}", flush=True)
+        elif fields[0] == "QUIT":
+            return 0
+        elif fields[0] == "JOB" and len(fields) >= 3:
+            jobs += 1
+            job_id, output_dir, inputs = fields[1], fields[2], fields[3:]
+            try:
+                outputs = [_export_book(path, output_dir) for path in inputs]
+            except Exception as e:
+                print(f"FAIL\t{job_id}\t{e}", flush=True)
+                continue
+            print("\t".join(["DONE", job_id, *outputs]), flush=True)
+    return 0
+
+
+def fake_java(argv):
+    """Mimic `java -version`, one-shot Audiveris runs and the resident worker."""
+    if argv[:1] == ["-version"]:
+        print(JAVA_VERSION, file=sys.stderr)
+        return 0
+    time.sleep(_setting("MOBILSHEETS_FAKE_JVM_SECONDS", 0.0))
+    if any(arg.endswith(".java") for arg in argv):
+        return _worker_loop()
+    if "-output" not in argv:
+        print("fake java: expected an Audiveris -batch -export -output invocation", file=sys.stderr)
+        return 1
+    index = argv.index("-output")
+    output_dir, inputs = argv[index + 1], argv[index + 2:]
+    for path in inputs:
+        if not os.path.isfile(path):
+            print(f"Could not find file {path}", file=sys.stderr)
+            continue
+        _export_book(path, output_dir)
+    return 0
+
+
+def install_fakes(bin_dir):
+    """Write `oemer` and `java` shims into bin_dir; put it first on PATH to use them."""
+    os.makedirs(bin_dir, exist_ok=True)
+    script = os.path.abspath(__file__)
+    for name in ("oemer", "java"):
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" {name} "$@"\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return bin_dir
+
+
+def main(argv=None):
+    """Dispatch to the fake named by the first argument."""
+    argv = sys.argv[1:] if argv is None else argv
+    fakes = {"oemer": fake_oemer, "java": fake_java}
+    if not argv or argv[0] not in fakes:
+        print(f"usage: {os.path.basename(__file__)} {{oemer,java}} [args...]", file=sys.stderr)
+        return 2
+    return fakes[argv[0]](argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmarks for the MobilSheets pipeline.
+
+Drives the backend's /convert endpoint (through Flask's test client) and
+audiveris_converter.py over backend/uploads/testimage.png plus a corpus of
+synthetic score images. Unless --real-engines is given, oemer and Java are
+replaced by the deterministic stand-ins in fake_engines.py, so the numbers
+measure everything except the recognition itself.
+
+Reports per-stage latency percentiles (upload save, preprocessing, OMR,
+MusicXML parse, MIDI write), /convert throughput at increasing concurrency
+and peak RSS, and writes them to a JSON file that later runs can be compared
+against.
+
+Usage:
+    python benchmarks/run.py [-o results.json] [--iterations N] [--concurrency 1,2,4,8]
+    python benchmarks/run.py --compare baseline.json [--threshold 0.10]
+    python benchmarks/run.py --skip-audiveris --omr-seconds 0.5
+"""
+
+import argparse
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BACKEND_DIR = os.path.join(REPO_DIR, "backend")
+TEST_IMAGE = os.path.join(BACKEND_DIR, "uploads", "testimage.png")
+CONVERTER_SCRIPT = os.path.join(REPO_DIR, "audiveris_converter.py")
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "results", "latest.json")
+
+sys.path.insert(0, BENCH_DIR)
+from fake_engines import install_fakes  # noqa: E402
+from synthetic import generate_corpus  # noqa: E402
+
+
+def percentiles(samples):
+    """Summarize latency samples (seconds) in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        # Nearest-rank percentile
+        index = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[index] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "min_ms": ordered[0] * 1000,
+        "p50_ms": rank(50),
+        "p95_ms": rank(95),
+        "p99_ms": rank(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+class StageTimer:
+    """Collects wall-clock samples per named stage."""
+
+    def __init__(self):
+        self.samples = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as one sample of `name`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        """Record one sample."""
+        self.samples.setdefault(name, []).append(seconds)
+
+    def summary(self):
+        """Percentiles for every stage."""
+        return {name: percentiles(samples) for name, samples in self.samples.items()}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its reaped children, in MB."""
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit,
+    }
+
+
+def git_revision():
+    """Short commit hash of the benchmarked tree, if available."""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def build_corpus(corpus_dir, synthetic_count, seed):
+    """Write testimage.png plus synthetic images to corpus_dir; returns [(name, path)]."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = []
+    if os.path.exists(TEST_IMAGE):
+        path = os.path.join(corpus_dir, "testimage.png")
+        shutil.copyfile(TEST_IMAGE, path)
+        corpus.append(("testimage.png", path))
+    for name, data in generate_corpus(synthetic_count, seed):
+        path = os.path.join(corpus_dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        corpus.append((name, path))
+    return corpus
+
+
+def read_corpus(corpus):
+    """Load the corpus images into memory as [(name, bytes)]."""
+    uploads = []
+    for name, path in corpus:
+        with open(path, "rb") as f:
+            uploads.append((name, f.read()))
+    return uploads
+
+
+def configure_environment(work_dir, args):
+    """Point the backend at scratch directories and, by default, at the fake engines."""
+    os.environ["MOBILSHEETS_CACHE_DIR"] = os.path.join(work_dir, "cache")
+    os.environ["MOBILSHEETS_WORK_DIR"] = os.path.join(work_dir, "workspaces")
+    os.environ["MOBILSHEETS_HISTORY_DIR"] = os.path.join(work_dir, "history")
+    os.makedirs(os.environ["MOBILSHEETS_WORK_DIR"], exist_ok=True)
+    # Books, toolchain probe, CDS archive and worker logs stay out of the real audiveris/ directory
+    os.environ["MOBILSHEETS_AUDIVERIS_STATE_DIR"] = os.path.join(work_dir, "audiveris-state")
+    if not args.cache:
+        # A zero-byte cache never hits and without the history nothing else answers a repeat,
+        # so repeated images are converted every time
+        os.environ["MOBILSHEETS_CACHE_MAX_BYTES"] = "0"
+        os.environ["MOBILSHEETS_HISTORY"] = "0"
+    if args.preprocess is not None:
+        os.environ["MOBILSHEETS_PREPROCESS"] = args.preprocess
+    if not args.real_engines:
+        bin_dir = install_fakes(os.path.join(work_dir, "bin"))
+        os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+        os.environ["MOBILSHEETS_OEMER_MODE"] = "cli"
+        os.environ["MOBILSHEETS_FAKE_OMR_SECONDS"] = str(args.omr_seconds)
+        os.environ["MOBILSHEETS_FAKE_JVM_SECONDS"] = str(args.jvm_seconds)
+
+
+# ---------------------------------------------------------------------------
+# Backend
+
+def load_backend():
+    """Import the Flask app after the environment is configured."""
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import app as backend
+    return backend
+
+
+def post_convert(client, name, data):
+    """POST one image to /convert and return the MIDI bytes."""
+    response = client.post("/convert", data={"file": (io.BytesIO(data), name)},
+                           content_type="multipart/form-data")
+    if response.status_code != 200:
+        raise RuntimeError(f"/convert failed for {name}: {response.status_code} {response.get_data(as_text=True)}")
+    return response.data
+
+
+def bench_stages(backend, corpus, iterations):
+    """Time each pipeline stage separately, plus the whole /convert request."""
+    from musicxml_midi import parse_musicxml, write_midi
+    from preprocess import preprocess_image
+    from workspace import job_workspace
+
+    timer = StageTimer()
+    config = backend.preprocess_config
+    client = backend.app.test_client()
+    uploads = read_corpus(corpus)
+
+    for _ in range(iterations):
+        for name, data in uploads:
+            with job_workspace() as workspace:
+                with timer.stage("upload_save"):
+                    image_path = workspace.input_path(name)
+                    with open(image_path, "wb") as f:
+                        f.write(data)
+                if config.steps:
+                    prepared_path = workspace.path("prepared" + config.output_format)
+                    with timer.stage("preprocess"):
+                        preprocess_image(image_path, prepared_path, config)
+                    image_path = prepared_path
+                with timer.stage("omr"):
+                    musicxml_path, _ = backend.omr_dispatcher.recognize(image_path, workspace)
+                with timer.stage("musicxml_parse"):
+                    score = parse_musicxml(musicxml_path)
+                with timer.stage("midi_write"):
+                    write_midi(score)
+            with timer.stage("convert_request"):
+                post_convert(client, name, data)
+    return timer.summary()
+
+
+def bench_throughput(backend, corpus, levels, requests_per_level):
+    """Fire /convert requests at each concurrency level; report rate, goodput and latency.
+
+    Requests shed by admission control (503) count against goodput, not latency.
+    """
+    uploads = read_corpus(corpus)
+    results = []
+    for level in levels:
+        latencies = []
+        shed = []
+
+        def one(index):
+            name, data = uploads[index % len(uploads)]
+            started = time.perf_counter()
+            response = backend.app.test_client().post(
+                "/convert", data={"file": (io.BytesIO(data), name)}, content_type="multipart/form-data")
+            if response.status_code == 503:
+                shed.append(index)
+                return
+            if response.status_code != 200:
+                raise RuntimeError(f"/convert failed for {name}: {response.status_code} "
+                                   f"{response.get_data(as_text=True)}")
+            latencies.append(time.perf_counter() - started)
+
+        count = max(requests_per_level, level)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as executor:
+            list(executor.map(one, range(count)))
+        elapsed = time.perf_counter() - started
+        summary = percentiles(latencies)
+        results.append({
+            "concurrency": level,
+            "requests": count,
+            "seconds": elapsed,
+            "requests_per_second": count / elapsed,
+            "goodput_per_second": len(latencies) / elapsed,
+            "shed": len(shed),
+            "p50_ms": summary.get("p50_ms"),
+            "p95_ms": summary.get("p95_ms"),
+            "p99_ms": summary.get("p99_ms"),
+        })
+        print(f"  concurrency {level:>3}: {count / elapsed:8.2f} req/s, {len(latencies) / elapsed:8.2f} ok/s, "
+              f"{len(shed)} shed, p95 {summary.get('p95_ms', 0):.1f} ms")
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Audiveris converter CLI
+
+def prepare_audiveris_home(work_dir, real_engines):
+    """Directory the converter runs in; with fakes it holds a stand-in install."""
+    if real_engines:
+        return REPO_DIR
+    home = os.path.join(work_dir, "audiveris-home")
+    lib_dir = os.path.join(home, "audiveris", "lib")
+    os.makedirs(lib_dir, exist_ok=True)
+    # Larger than the converter's placeholder check, never actually loaded
+    with open(os.path.join(home, "audiveris", "audiveris.jar"), "wb") as f:
+        f.write(b"fake audiveris jar for benchmarks\n" * 64)
+    return home
+
+
+def run_converter(home, arguments):
+    """Run audiveris_converter.py once; returns wall-clock seconds."""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, CONVERTER_SCRIPT, *arguments], cwd=home,
+                            capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"audiveris_converter.py {' '.join(arguments)} failed:\n{result.stdout}{result.stderr}")
+    return elapsed
+
+
+def bench_audiveris(home, corpus, work_dir, iterations, jobs, workers):
+    """Time single-image runs, batch runs and batch runs on resident workers.
+
+    Every run passes --no-reuse, so each iteration recognizes the images instead of reusing books.
+    """
+    timer = StageTimer()
+    single_name, single_path = corpus[0]
+    corpus_dir = os.path.dirname(single_path)
+
+    for index in range(iterations):
+        output_dir = os.path.join(work_dir, "audiveris-out", f"single-{index}")
+        timer.add("single_image", run_converter(home, [single_path, output_dir, "--no-reuse"]))
+
+    modes = [("batch", ["--jobs", str(jobs), "--no-reuse"])]
+    if workers:
+        modes.append(("batch_workers", ["--jobs", str(jobs), "--workers", str(workers), "--no-reuse"]))
+    for mode, extra in modes:
+        for index in range(iterations):
+            output_dir = os.path.join(work_dir, "audiveris-out", f"{mode}-{index}")
+            seconds = run_converter(home, [corpus_dir, "-o", output_dir, *extra])
+            timer.add(mode, seconds)
+            timer.add(f"{mode}_per_image", seconds / len(corpus))
+            with open(os.path.join(output_dir, "manifest.json")) as f:
+                for entry in json.load(f)["entries"].values():
+                    if entry.get("seconds") is not None:
+                        timer.add(f"{mode}_image", entry["seconds"])
+    return timer.summary()
+
+
+# ---------------------------------------------------------------------------
+# Comparison
+
+def flatten_metrics(results):
+    """Yield (metric, value, higher_is_better) for the numbers worth comparing."""
+    for section in ("stages", "audiveris"):
+        for stage, summary in (results.get(section) or {}).items():
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                if key in summary:
+                    yield f"{section}.{stage}.{key}", summary[key], False
+    for row in results.get("throughput") or []:
+        yield f"throughput.c{row['concurrency']}.requests_per_second", row["requests_per_second"], True
+        if "goodput_per_second" in row:
+            yield f"throughput.c{row['concurrency']}.goodput_per_second", row["goodput_per_second"], True
+    for key, value in (results.get("peak_rss_mb") or {}).items():
+        yield f"peak_rss_mb.{key}", value, False
+
+
+def compare_results(current, baseline, threshold):
+    """Print metric deltas against a baseline; returns the regressed metric names."""
+    previous = {name: value for name, value, _ in flatten_metrics(baseline)}
+    regressions = []
+    print(f"\n{'metric':<52} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, value, higher_is_better in flatten_metrics(current):
+        if name not in previous or not previous[name]:
+            continue
+        change = (value - previous[name]) / previous[name]
+        worse = -change if higher_is_better else change
+        marker = ""
+        if worse > threshold:
+            marker = "  ✗ regression"
+            regressions.append(name)
+        elif worse < -threshold:
+            marker = "  ✓ improved"
+        print(f"{name:<52} {previous[name]:>12.2f} {value:>12.2f} {change:>+8.1%}{marker}")
+    return regressions
+
+
+def print_stages(title, summary):
+    """Print a percentile table."""
+    print(f"\n{title}")
+    print(f"  {'stage':<24} {'n':>5} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for stage, stats in summary.items():
+        if stats.get("count"):
+            print(f"  {stage:<24} {stats['count']:>5} {stats['p50_ms']:>10.2f} "
+                  f"{stats['p95_ms']:>10.2f} {stats['p99_ms']:>10.2f}")
+
+
+def main():
+    """Run the benchmarks and write the JSON report."""
+    parser = argparse.ArgumentParser(description="Benchmark the MobilSheets conversion pipeline")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT,
+                        help=f"Where to write the JSON results (default: {os.path.relpath(DEFAULT_OUTPUT)})")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="Compare against an earlier results file and exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative change counted as a regression (default: 0.10)")
+    parser.add_argument("--iterations", type=int, default=5,
+                        help="Passes over the corpus for the per-stage timings (default: 5)")
+    parser.add_argument("--synthetic", type=int, default=8,
+                        help="Synthetic images added to testimage.png (default: 8)")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic corpus seed (default: 0)")
+    parser.add_argument("--concurrency", default="1,2,4,8",
+                        help="Comma-separated /convert concurrency levels (default: 1,2,4,8)")
+    parser.add_argument("--requests", type=int, default=32,
+                        help="Requests per concurrency level (default: 32)")
+    parser.add_argument("--preprocess", default=None, metavar="STEPS",
+                        help="Override MOBILSHEETS_PREPROCESS for the backend ('none' to skip)")
+    parser.add_argument("--cache", action="store_true",
+                        help="Leave the result cache and history on (repeated images then hit them)")
+    parser.add_argument("--omr-seconds", type=float, default=0.0,
+                        help="Simulated recognition time per image for the fake engines (default: 0)")
+    parser.add_argument("--jvm-seconds", type=float, default=0.0,
+                        help="Simulated JVM startup time for the fake Java (default: 0)")
+    parser.add_argument("--audiveris-jobs", type=int, default=2,
+                        help="--jobs for the Audiveris batch runs (default: 2)")
+    parser.add_argument("--audiveris-workers", type=int, default=2,
+                        help="--workers for the resident-worker batch run, 0 to skip (default: 2)")
+    parser.add_argument("--real-engines", action="store_true",
+                        help="Use the installed oemer and Audiveris instead of the fakes")
+    parser.add_argument("--skip-backend", action="store_true", help="Skip the /convert benchmarks")
+    parser.add_argument("--skip-audiveris", action="store_true",
+                        help="Skip the audiveris_converter.py benchmarks")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    work_dir = tempfile.mkdtemp(prefix="mobilsheets-bench-")
+    configure_environment(work_dir, args)
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "engines": "real" if args.real_engines else "fake",
+            "omr_seconds": args.omr_seconds,
+            "jvm_seconds": args.jvm_seconds,
+            "iterations": args.iterations,
+            "cache": args.cache,
+        },
+    }
+
+    try:
+        corpus = build_corpus(os.path.join(work_dir, "corpus"), args.synthetic, args.seed)
+        results["meta"]["corpus"] = [name for name, _ in corpus]
+        print(f"Corpus: {len(corpus)} image(s) in {work_dir}")
+
+        if not args.skip_backend:
+            backend = load_backend()
+            results["meta"]["preprocess"] = list(backend.preprocess_config.steps)
+            print(f"Timing pipeline stages ({args.iterations} pass(es))...")
+            results["stages"] = bench_stages(backend, corpus, args.iterations)
+            print_stages("Backend stages", results["stages"])
+            print("\nThroughput (/convert):")
+            results["throughput"] = bench_throughput(backend, corpus, levels, args.requests)
+
+        if not args.skip_audiveris:
+            print("\nTiming audiveris_converter.py...")
+            home = prepare_audiveris_home(work_dir, args.real_engines)
+            results["audiveris"] = bench_audiveris(home, corpus, work_dir, args.iterations,
+                                                   args.audiveris_jobs, args.audiveris_workers)
+            print_stages("Audiveris converter", results["audiveris"])
+
+        results["peak_rss_mb"] = peak_rss_mb()
+        print(f"\nPeak RSS: {results['peak_rss_mb']['self']:.1f} MB (self), "
+              f"{results['peak_rss_mb']['children']:.1f} MB (largest child)")
+    finally:
+        if args.keep:
+            print(f"Scratch directory kept: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✓ Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n✗ {len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+            return 1
+        print("\n✓ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
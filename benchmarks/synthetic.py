@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Synthetic score images for benchmarking.
+
+Renders grayscale PNGs that look enough like sheet music (staves, noteheads,
+stems, barlines) for the preprocessing stage to find staff lines, with
+optional skew and speckle noise to mimic phone photos. Only the standard
+library is used so the corpus can be generated anywhere.
+
+Usage:
+    python benchmarks/synthetic.py <output_dir> [--count N] [--seed S]
+"""
+
+import argparse
+import math
+import os
+import random
+import struct
+import sys
+import zlib
+
+# (name, width, height, systems, skew degrees, noise fraction)
+VARIANTS = (
+    ("phone", 1240, 1754, 6, 0.0, 0.0),
+    ("scan", 2480, 3508, 8, 0.0, 0.0),
+    ("skewed", 1240, 1754, 6, 1.5, 0.0),
+    ("noisy", 1240, 1754, 6, 0.0, 0.01),
+)
+
+
+def encode_png(pixels, width, height):
+    """Encode 8-bit grayscale pixels (row-major bytes) as a PNG."""
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    stride = width
+    raw = b"".join(b"\x00" + bytes(pixels[y * stride:(y + 1) * stride]) for y in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b""))
+
+
+class Canvas:
+    """White 8-bit canvas with skew-aware filled rectangles."""
+
+    def __init__(self, width, height, skew_degrees=0.0):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(b"\xff" * (width * height))
+        self.slope = math.tan(math.radians(skew_degrees))
+        # Columns are drawn in bands that share one vertical offset
+        self.band = max(1, int(1 / abs(self.slope))) if self.slope else width
+
+    def fill(self, x0, y0, x1, y1, value=0):
+        """Fill [x0, x1) x [y0, y1), sheared by the canvas skew."""
+        x0, x1 = max(0, int(x0)), min(self.width, int(x1))
+        for band_start in range(x0, x1, self.band):
+            band_end = min(x1, band_start + self.band)
+            offset = int(round((band_start - self.width / 2) * self.slope))
+            top, bottom = max(0, int(y0) + offset), min(self.height, int(y1) + offset)
+            run = bytes([value]) * (band_end - band_start)
+            for y in range(top, bottom):
+                start = y * self.width + band_start
+                self.pixels[start:start + len(run)] = run
+
+    def ellipse(self, cx, cy, rx, ry):
+        """Fill an axis-aligned ellipse (a notehead)."""
+        for dy in range(-int(ry), int(ry) + 1):
+            half = rx * math.sqrt(max(0.0, 1 - (dy / ry) ** 2))
+            self.fill(cx - half, cy + dy, cx + half + 1, cy + dy + 1)
+
+    def speckle(self, rng, fraction):
+        """Flip a fraction of pixels to simulate sensor noise and dust."""
+        size = len(self.pixels)
+        for _ in range(int(size * fraction)):
+            index = rng.randrange(size)
+            self.pixels[index] = 255 - self.pixels[index]
+
+
+def render_score(seed, width=1240, height=1754, systems=6, skew_degrees=0.0, noise=0.0):
+    """Render one synthetic score page and return it as PNG bytes."""
+    rng = random.Random(seed)
+    canvas = Canvas(width, height, skew_degrees)
+    margin_x, margin_y = int(width * 0.07), int(height * 0.06)
+    system_height = (height - 2 * margin_y) / systems
+    spacing = max(6, int(system_height / 9))
+    thickness = max(1, spacing // 8)
+
+    for system in range(systems):
+        top = margin_y + system * system_height + spacing * 2
+        for line in range(5):
+            y = top + line * spacing
+            canvas.fill(margin_x, y, width - margin_x, y + thickness)
+        bottom = top + 4 * spacing + thickness
+        canvas.fill(margin_x, top, margin_x + thickness, bottom)
+
+        x = margin_x + spacing * 4
+        beats = 0
+        while x < width - margin_x - spacing * 2:
+            step = rng.randrange(-4, 13)  # half-spaces below the top line
+            cy = top + step * spacing / 2
+            canvas.ellipse(x, cy, spacing * 0.65, spacing * 0.48)
+            stem_x = x + spacing * 0.6
+            if step > 4:
+                canvas.fill(stem_x - thickness, cy - spacing * 3.5, stem_x, cy)
+            else:
+                canvas.fill(x - spacing * 0.6, cy, x - spacing * 0.6 + thickness, cy + spacing * 3.5)
+            beats += 1
+            x += spacing * rng.choice((2.5, 3, 3.5))
+            if beats % 4 == 0 and x < width - margin_x - spacing * 3:
+                canvas.fill(x - spacing, top, x - spacing + thickness, bottom)
+        canvas.fill(width - margin_x - thickness, top, width - margin_x, bottom)
+
+    if noise:
+        canvas.speckle(rng, noise)
+    return encode_png(canvas.pixels, width, height)
+
+
+def generate_corpus(count, seed=0):
+    """Yield (filename, png_bytes) for `count` images cycling through VARIANTS."""
+    for index in range(count):
+        name, width, height, systems, skew, noise = VARIANTS[index % len(VARIANTS)]
+        data = render_score(seed * 1000003 + index, width, height, systems, skew, noise)
+        yield f"synthetic-{index:03d}-{name}.png", data
+
+
+def main():
+    """Write a synthetic corpus to a directory."""
+    parser = argparse.ArgumentParser(description="Generate synthetic sheet music images")
+    parser.add_argument("output_dir", help="Directory for the generated PNGs")
+    parser.add_argument("--count", type=int, default=8, help="Number of images (default: 8)")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus seed (default: 0)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for filename, data in generate_corpus(args.count, args.seed):
+        path = os.path.join(args.output_dir, filename)
+        with open(path, "wb") as f:
+            f.write(data)
+        print(f"✓ {path} ({len(data) // 1024} KB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
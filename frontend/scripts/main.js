@@ -1,5 +1,14 @@
+// backend/app.py serves on 8080 (forwarded by the dev container); a page can point
+// elsewhere by setting window.MOBILSHEETS_BACKEND_URL before this script loads
+const BACKEND_URL = window.MOBILSHEETS_BACKEND_URL || 'http://localhost:8080';
+// Captures are scaled down to this many pixels on the long side and sent as JPEG;
+// staff lines stay well resolved while the upload shrinks several times over
+const CAPTURE_MAX_DIMENSION = 2400;
+const CAPTURE_JPEG_QUALITY = 0.85;
+
 let currentStream = null;
 let useFrontCamera = true;
+let audioContext = null;
 
 function isMobile() {
   return /Android|iPhone|iPad|iPod/i.test(navigator.userAgent);
@@ -70,6 +79,127 @@ function animateFoldFromButton(buttonEl) {
   });
 }
 
+// Random id kept on the device, so the backend's history lists this device's conversions
+function clientId() {
+  let id = localStorage.getItem('mobilsheets-client-id');
+  if (!id) {
+    id = crypto.randomUUID();
+    localStorage.setItem('mobilsheets-client-id', id);
+  }
+  return id;
+}
+
+function setStatus(text) {
+  document.getElementById('mail-slot').textContent = text;
+}
+
+function offerDownload(midiBase64) {
+  const bytes = Uint8Array.from(atob(midiBase64), c => c.charCodeAt(0));
+  const url = URL.createObjectURL(new Blob([bytes], { type: 'audio/midi' }));
+  const link = document.createElement('a');
+  link.href = url;
+  link.download = 'converted.mid';
+  link.textContent = '⬇ Download MIDI';
+  link.className = 'download-link';
+  const mailSlot = document.getElementById('mail-slot');
+  mailSlot.textContent = '';
+  mailSlot.appendChild(link);
+}
+
+// Plays pages back to back with a plain WebAudio synth as they arrive,
+// so the first page sounds while later ones are still being recognized
+class ScorePlayer {
+  constructor(context) {
+    this.context = context;
+    this.nextStart = null;
+  }
+
+  schedulePage(notes, duration) {
+    if (!notes || notes.length === 0) return;
+    if (this.nextStart === null || this.nextStart < this.context.currentTime) {
+      this.nextStart = this.context.currentTime + 0.1;
+    }
+    const offset = this.nextStart;
+    notes.forEach(([start, length, pitch, velocity, channel]) => {
+      if (channel === 9) return; // percussion has no pitch to synthesize
+      this.playNote(offset + start, length, pitch, velocity);
+    });
+    const lastEnd = Math.max(...notes.map(([start, length]) => start + length));
+    this.nextStart = offset + Math.max(duration || 0, lastEnd);
+  }
+
+  playNote(when, length, pitch, velocity) {
+    const oscillator = this.context.createOscillator();
+    const gain = this.context.createGain();
+    oscillator.type = 'triangle';
+    oscillator.frequency.value = 440 * Math.pow(2, (pitch - 69) / 12);
+    const peak = 0.15 * (velocity / 127);
+    gain.gain.setValueAtTime(0, when);
+    gain.gain.linearRampToValueAtTime(peak, when + 0.01);
+    gain.gain.setTargetAtTime(0, when + Math.max(0.02, length - 0.05), 0.03);
+    oscillator.connect(gain).connect(this.context.destination);
+    oscillator.start(when);
+    oscillator.stop(when + length + 0.2);
+  }
+}
+
+function parseEvent(block) {
+  let event = 'message';
+  const data = [];
+  block.split('\n').forEach(line => {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+  });
+  return { event, data: data.length ? JSON.parse(data.join('\n')) : null };
+}
+
+// POST the file as the raw request body to /upload?stream=1 and handle server-sent events as they arrive
+async function streamConversion(file, filename) {
+  if (!audioContext) audioContext = new (window.AudioContext || window.webkitAudioContext)();
+  audioContext.resume();
+  const player = new ScorePlayer(audioContext);
+
+  setStatus('Uploading…');
+  const url = `${BACKEND_URL}/upload?stream=1&filename=${encodeURIComponent(filename)}`;
+  const response = await fetch(url, {
+    method: 'POST',
+    headers: { 'Content-Type': file.type || 'application/octet-stream', 'X-Client-Id': clientId() },
+    body: file
+  });
+  if (!response.ok) {
+    const retryAfter = response.headers.get('Retry-After');
+    const error = await response.json().catch(() => ({}));
+    setStatus(retryAfter ? `Busy, try again in ${retryAfter}s` : (error.error || 'Conversion failed'));
+    return;
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const { event, data } = parseEvent(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      if (event === 'accepted') {
+        setStatus(data.pages > 1 ? `Recognizing ${data.pages} pages…` : 'Recognizing…');
+      } else if (event === 'page' || event === 'system') {
+        setStatus(`▶ ${event === 'page' ? 'Page' : 'System'} ${data[event]} ready`);
+        player.schedulePage(data.notes, data.duration);
+      } else if (event === 'done') {
+        // Cached results arrive as a single event
+        if (data.cached) player.schedulePage(data.notes, data.duration);
+        offerDownload(data.midi);
+      } else if (event === 'error') {
+        setStatus(data.error || 'Conversion failed');
+      }
+    }
+  }
+}
+
 function handleFileUpload(file) {
   if (!file) return;
   const validTypes = ['image/jpeg', 'image/png', 'application/pdf'];
@@ -83,11 +213,7 @@ function handleFileUpload(file) {
   const uploadBtn = document.querySelector('.upload-button');
   animateFoldFromButton(uploadBtn);
 
-  if (file.type === 'application/pdf') {
-    // no extra animation needed, fold is already done above
-  } else {
-    // For images, the mail slot glow is handled in animation end callback
-  }
+  streamConversion(file, file.name).catch(err => setStatus('Upload failed: ' + err.message));
 }
 
 function capturePhoto() {
@@ -97,10 +223,13 @@ function capturePhoto() {
   }
 
   const video = document.getElementById('camera-preview');
+  const scale = Math.min(1, CAPTURE_MAX_DIMENSION / Math.max(video.videoWidth, video.videoHeight));
   const canvas = document.createElement('canvas');
-  canvas.width = video.videoWidth;
-  canvas.height = video.videoHeight;
-  canvas.getContext('2d').drawImage(video, 0, 0);
+  canvas.width = Math.round(video.videoWidth * scale);
+  canvas.height = Math.round(video.videoHeight * scale);
+  const context = canvas.getContext('2d');
+  context.imageSmoothingQuality = 'high';
+  context.drawImage(video, 0, 0, canvas.width, canvas.height);
 
   stopCamera();
 
@@ -110,7 +239,9 @@ function capturePhoto() {
   const cameraBtn = document.getElementById('camera-btn');
   animateFoldFromButton(cameraBtn);
 
-  // Here you can handle canvas.toDataURL() for upload if needed
+  canvas.toBlob(blob => {
+    streamConversion(blob, 'capture.jpg').catch(err => setStatus('Upload failed: ' + err.message));
+  }, 'image/jpeg', CAPTURE_JPEG_QUALITY);
 }
 
 document.addEventListener('DOMContentLoaded', () => {
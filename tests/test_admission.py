@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+from admission import BULK, DOCUMENT, INTERACTIVE, MEMORY_BASE_BYTES, AdmissionController, Cost, Overloaded, \
+    estimate_cost
+from synthetic import encode_png
+
+GB = 1024 ** 3
+
+
+def cost(cpus=1, memory=GB, pages=1, pixels=10 ** 6):
+    return Cost(pages, pixels, memory, cpus)
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_image_cost_comes_from_the_header():
+    png = encode_png(bytes(40 * 30), 40, 30)
+    estimate = estimate_cost(png, threads=2, page_workers=4)
+    assert (estimate.pages, estimate.pixels, estimate.cpus) == (1, 1200, 2)
+    assert estimate.priority == INTERACTIVE
+    assert estimate.memory_bytes > MEMORY_BASE_BYTES
+    # The single-flight in-process engine takes every core for one image
+    assert estimate_cost(png, threads=2, image_threads=8).cpus == 8
+
+
+def test_pdf_cost_uses_the_page_count():
+    estimate = estimate_cost(b'%PDF-1.7', threads=2, page_workers=4, pdf_dpi=100, page_count=lambda _: 3)
+    assert estimate.pages == 3
+    assert estimate.cpus == 6  # three pages in parallel
+    assert estimate.priority == DOCUMENT
+    assert estimate_cost(b'%PDF-1.7', threads=2, page_workers=4, page_count=lambda _: 3, image_threads=8).cpus == 6
+    assert estimate_cost(b'%PDF-1.7', page_count=lambda _: 20).priority == BULK
+
+
+def test_admits_while_the_budget_lasts_then_queues():
+    admission = AdmissionController(4 * GB, cpu_budget=2, max_wait=5)
+    first, second, third = cost(), cost(), cost()
+    assert admission.acquire(first) == 0.0
+    assert admission.acquire(second) == 0.0
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(admission.acquire(third)))
+    waiter.start()
+    wait_until(lambda: admission.queue_depth == 1)
+    assert not admitted
+    admission.release(first, seconds=1.0)
+    waiter.join(5)
+    assert admitted and admitted[0] > 0
+    assert admission.cpus_in_use == 2
+    admission.release(second)
+    admission.release(third)
+    assert (admission.running, admission.cpus_in_use, admission.memory_in_use) == (0, 0, 0)
+
+
+def test_a_request_larger_than_the_budget_runs_alone():
+    admission = AdmissionController(GB, cpu_budget=2)
+    huge = cost(cpus=8, memory=10 * GB)
+    assert admission.acquire(huge) == 0.0
+    admission.release(huge)
+
+
+def test_full_queue_and_long_waits_are_rejected():
+    admission = AdmissionController(GB, cpu_budget=1, max_queue=0)
+    running = cost()
+    admission.acquire(running)
+    with pytest.raises(Overloaded) as error:
+        admission.acquire(cost())
+    assert error.value.retry_after >= 1
+
+    admission = AdmissionController(GB, cpu_budget=1, max_wait=0.2)
+    admission.acquire(running)
+    with pytest.raises(Overloaded):
+        admission.acquire(cost(pixels=10 ** 8))  # 100 MP at the default rate waits far too long
+    with pytest.raises(Overloaded):
+        admission.acquire(cost(pixels=1), max_wait=0.05)  # queued, then times out
+    assert admission.queue_depth == 0
+
+
+def test_interactive_requests_overtake_bulk_ones():
+    admission = AdmissionController(GB, cpu_budget=1, max_wait=10)
+    running = cost()
+    admission.acquire(running)
+    order = []
+
+    def request(name, pages):
+        admission.acquire(cost(pages=pages, pixels=1000))
+        order.append(name)
+
+    bulk = threading.Thread(target=request, args=('bulk', 20))
+    bulk.start()
+    wait_until(lambda: admission.queue_depth == 1)
+    interactive = threading.Thread(target=request, args=('interactive', 1))
+    interactive.start()
+    wait_until(lambda: admission.queue_depth == 2)
+    admission.release(running)
+    wait_until(lambda: order)
+    assert order == ['interactive']
+    admission.release(cost(pages=1, pixels=1000))
+    bulk.join(5)
+    interactive.join(5)
+    assert order == ['interactive', 'bulk']
+
+
+def test_try_grow_only_takes_free_cores():
+    admission = AdmissionController(4 * GB, cpu_budget=4)
+    image = cost(cpus=1)
+    admission.acquire(image)
+    assert not admission.try_grow(image, 4)
+    assert admission.try_grow(image, 3)
+    assert image.cpus == 4 and admission.cpus_in_use == 4
+    admission.release(image)
+    assert admission.cpus_in_use == 0
+
+
+def test_disabled_controller_admits_everything():
+    admission = AdmissionController(1, cpu_budget=1, enabled=False)
+    with admission.admit(cost(cpus=100, memory=100 * GB)) as waited:
+        assert waited == 0.0
+    assert admission.running == 0
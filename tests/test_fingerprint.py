@@ -0,0 +1,97 @@
+import itertools
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+from fingerprint import (CHECK_DISTANCE, NEAR_DUPLICATE_DISTANCE, Fingerprint, FingerprintIndex, hamming,
+                         page_fingerprint)
+from synthetic import render_score
+
+SCOPE = 'oemer'
+
+
+def retake(png, gain=1.0, offset=0, noise=6.0, quality=80, seed=0):
+    """The same page again: other exposure, sensor noise and JPEG compression."""
+    image = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_GRAYSCALE).astype(np.float32)
+    image = image * gain + offset + np.random.default_rng(seed).normal(0, noise, image.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+RETAKES = [dict(gain=0.85, offset=20, seed=1), dict(gain=1.1, offset=-25, seed=2), dict(noise=10, quality=60, seed=3)]
+
+
+@pytest.fixture(scope='module')
+def book():
+    # Pages of one book: same size, margins and number of systems, different notes
+    return [render_score(seed) for seed in range(8)]
+
+
+@pytest.fixture(scope='module')
+def fingerprints(book):
+    return [page_fingerprint(page) for page in book]
+
+
+def test_distinct_pages_of_one_layout_stay_apart(fingerprints):
+    for a, b in itertools.combinations(fingerprints, 2):
+        assert hamming(a.phash, b.phash) > 2 * NEAR_DUPLICATE_DISTANCE
+        assert hamming(a.dhash, b.dhash) > 2 * CHECK_DISTANCE
+
+
+def test_retakes_match_their_page(book, fingerprints):
+    for page, original in zip(book, fingerprints):
+        for options in RETAKES:
+            again = page_fingerprint(retake(page, **options))
+            assert hamming(again.phash, original.phash) <= NEAR_DUPLICATE_DISTANCE
+            assert hamming(again.dhash, original.dhash) <= CHECK_DISTANCE
+
+
+def test_index_returns_the_retaken_page_and_nothing_for_new_pages(tmp_path, book, fingerprints):
+    index = FingerprintIndex(str(tmp_path / 'fingerprints.jsonl'), enabled=True)
+    for number, fingerprint in enumerate(fingerprints[:4]):
+        index.add(f'page-{number}', fingerprint, SCOPE)
+    for number, page in enumerate(book[:4]):
+        key, _ = index.nearest(page_fingerprint(retake(page, **RETAKES[0])), SCOPE)
+        assert key == f'page-{number}'
+    for fingerprint in fingerprints[4:]:
+        assert index.nearest(fingerprint, SCOPE) is None
+
+
+def test_second_check_rejects_a_phash_match(tmp_path):
+    index = FingerprintIndex(str(tmp_path / 'fingerprints.jsonl'), enabled=True)
+    stored = Fingerprint(phash=0, dhash=0, aspect=1.4)
+    index.add('stored', stored, SCOPE)
+    assert index.nearest(Fingerprint(phash=1, dhash=1, aspect=1.41), SCOPE) == ('stored', 1)
+    # Same pHash, but the dHash or the proportions disagree
+    assert index.nearest(Fingerprint(phash=1, dhash=(1 << 64) - 1, aspect=1.4), SCOPE) is None
+    assert index.nearest(Fingerprint(phash=1, dhash=0, aspect=1.0), SCOPE) is None
+    assert index.stats()['rejected'] == 2
+
+
+def test_index_finds_every_entry_within_the_distance(tmp_path):
+    rng = np.random.default_rng(0)
+    index = FingerprintIndex(str(tmp_path / 'fingerprints.jsonl'), max_distance=8, enabled=True)
+    base = int(rng.integers(0, 1 << 62)) << 194
+    index.add('base', Fingerprint(base, 0, 1.0), SCOPE)
+    for distance in range(12):
+        flipped = base
+        for bit in rng.choice(256, size=distance, replace=False):
+            flipped ^= 1 << int(bit)
+        match = index.nearest(Fingerprint(flipped, 0, 1.0), SCOPE)
+        assert match == (('base', distance) if distance <= 8 else None)
+
+
+def test_index_scopes_discard_and_reload(tmp_path):
+    path = str(tmp_path / 'fingerprints.jsonl')
+    index = FingerprintIndex(path, enabled=True)
+    fingerprint = Fingerprint(12345, 678, 1.4)
+    index.add('a', fingerprint, SCOPE)
+    index.add('b', Fingerprint(1 << 200, 678, 1.4), SCOPE)
+    assert index.nearest(fingerprint, 'audiveris') is None
+    index.discard('b')
+
+    reloaded = FingerprintIndex(path, enabled=True)
+    assert reloaded.nearest(fingerprint, SCOPE) == ('a', 0)
+    assert reloaded.stats()['entries'] == 1
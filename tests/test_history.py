@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from history import HistoryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / 'history'))
+
+
+def record(store, client=None, midi=b'MThd midi', musicxml=b'<score-partwise/>', sha='a' * 64, scope='oemer'):
+    return store.record(sha, scope, {'midi': midi, 'musicxml': musicxml}, 'omr', client=client,
+                        filename='page.png', input_size=123)
+
+
+def test_rows_are_scoped_to_their_client(store):
+    anonymous = record(store)
+    alice = record(store, client='alice')
+    bob = record(store, client='bob')
+    assert [item['id'] for item in store.list(None)[0]] == [anonymous]
+    assert [item['id'] for item in store.list('alice')[0]] == [alice]
+    # Neither another client nor an anonymous caller can reach alice's row
+    assert store.info(alice, 'bob') is None
+    assert store.info(alice, None) is None
+    assert store.info(anonymous, 'alice') is None
+    assert store.artifact_path(alice, 'midi', 'bob') is None
+    assert not store.delete(alice, 'bob')
+    assert not store.delete(alice, None)
+    item = store.info(bob, 'bob')
+    assert item['artifacts'] == ['midi', 'musicxml']
+    assert item['filename'] == 'page.png' and 'midi_blob' not in item
+
+
+def test_cursor_pagination(store):
+    ids = [record(store, client='alice', midi=bytes([i])) for i in range(5)]
+    items, cursor = store.list('alice', limit=2)
+    seen = [item['id'] for item in items]
+    while cursor is not None:
+        items, cursor = store.list('alice', limit=2, cursor=cursor)
+        seen += [item['id'] for item in items]
+    assert seen == ids[::-1]
+
+
+def test_delete_keeps_blobs_other_rows_still_use(store):
+    first = record(store, client='alice')
+    second = record(store, client='alice', midi=b'other midi')
+    shared = store.artifact_path(first, 'musicxml', 'alice')
+    midi, derived = store.derived_path(first, 'midi', 'notes.npz', 'alice')
+    with open(derived, 'wb') as f:
+        f.write(b'derived')
+    assert store.delete(first, 'alice')
+    assert store.info(first, 'alice') is None
+    assert not os.path.exists(midi) and not os.path.exists(derived)
+    assert os.path.exists(shared)
+    assert store.artifact_path(second, 'musicxml', 'alice') == shared
+    assert store.delete(second, 'alice')
+    assert not os.path.exists(shared)
+    assert store.stats()['conversions'] == 0 and store.stats()['blobs'] == 0
+
+
+def test_find_returns_the_latest_conversion(store):
+    assert store.find('a' * 64, 'oemer') is None
+    record(store, midi=b'old')
+    latest = record(store, client='alice', midi=b'new')
+    paths = store.find('a' * 64, 'oemer')
+    assert paths == {'midi': store.artifact_path(latest, 'midi', 'alice'),
+                     'musicxml': store.artifact_path(latest, 'musicxml', 'alice')}
+    assert store.find('a' * 64, 'audiveris') is None
+    os.remove(paths['midi'])
+    assert store.find('a' * 64, 'oemer') is None  # a missing blob is not a hit
+
+
+def test_disabled_store_records_nothing(tmp_path):
+    store = HistoryStore(str(tmp_path / 'history'), enabled=False)
+    assert record(store) is None
+    assert store.find('a' * 64, 'oemer') is None
+    assert store.stats() == {'enabled': False}
+    assert not os.path.exists(tmp_path / 'history')
@@ -0,0 +1,126 @@
+import os
+import struct
+
+import pytest
+
+from musicxml_midi import (UnsupportedScore, note_events, parse_musicxml, transform_score, transpose_key_signatures,
+                           write_midi)
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(DATA)), 'audiveris_output', 'testimage.mxl')
+
+
+def score_xml(measures, parts=('P1',), attributes=None):
+    """Partwise MusicXML with the same measures (inner XML) in every part."""
+    if attributes is None:
+        attributes = ('<attributes><divisions>2</divisions><key><fifths>0</fifths></key>'
+                      '<time><beats>4</beats><beat-type>4</beat-type></time></attributes>')
+    part_list = ''.join(f'<score-part id="{part}"><part-name>{part}</part-name></score-part>' for part in parts)
+    body = ''
+    for part in parts:
+        body += f'<part id="{part}">'
+        for number, measure in enumerate(measures, start=1):
+            body += f'<measure number="{number}">{attributes if number == 1 else ""}{measure}</measure>'
+        body += '</part>'
+    return f'<score-partwise><part-list>{part_list}</part-list>{body}</score-partwise>'.encode()
+
+
+def note(step, octave, duration, extra=''):
+    # divisions is 2, so a duration of 2 is a quarter note
+    pitch = f'<pitch><step>{step}</step><octave>{octave}</octave></pitch>'
+    return f'<note>{extra}{pitch}<duration>{duration}</duration></note>'
+
+
+def tracks(midi):
+    """(header fields, [track bytes]) of a Standard MIDI File."""
+    assert midi[:4] == b'MThd'
+    length, fmt, count, division = struct.unpack('>IHHH', midi[4:14])
+    position, chunks = 8 + length, []
+    while position < len(midi):
+        assert midi[position:position + 4] == b'MTrk'
+        size = struct.unpack('>I', midi[position + 4:position + 8])[0]
+        chunks.append(midi[position + 8:position + 8 + size])
+        position += 8 + size
+    return (fmt, count, division), chunks
+
+
+def test_sample_score_matches_known_good_midi():
+    # The notes of testimage.mxl were checked against music21's reading of the same file
+    with open(os.path.join(DATA, 'testimage.mid'), 'rb') as f:
+        expected = f.read()
+    assert write_midi(parse_musicxml(SAMPLE)) == expected
+
+
+def test_smf_layout():
+    midi = write_midi(parse_musicxml(score_xml([note('C', 4, 8)], parts=('P1', 'P2'))))
+    (fmt, count, division), chunks = tracks(midi)
+    assert (fmt, count, division) == (1, 3, 480)
+    assert len(chunks) == 3
+    for chunk in chunks:
+        assert chunk.endswith(b'\x00\xff\x2f\x00')
+    # Conductor track: time signature, key signature and the default tempo of 120 bpm
+    assert b'\xff\x58\x04\x04\x02' in chunks[0]
+    assert b'\xff\x59\x02\x00\x00' in chunks[0]
+    assert b'\xff\x51\x03\x07\xa1\x20' in chunks[0]
+    # One note on and off per part, on channels 0 and 1
+    assert b'\x90\x3c' in chunks[1] and b'\x80\x3c' in chunks[1]
+    assert b'\x91\x3c' in chunks[2] and b'\x81\x3c' in chunks[2]
+
+
+def test_ties_are_merged():
+    measures = [note('C', 4, 4) + note('C', 4, 4, '<tie type="start"/>'),
+                note('C', 4, 2, '<tie type="stop"/>') + note('D', 4, 6)]
+    score = parse_musicxml(score_xml(measures))
+    assert [(n.onset, n.duration, n.pitch) for n in score.notes] == [
+        (0, 960, 60), (960, 1440, 60), (2400, 1440, 62)]
+
+
+def test_chords_share_an_onset():
+    measure = note('C', 4, 4) + note('E', 4, 4, '<chord/>') + note('G', 4, 4, '<chord/>') + note('C', 5, 4)
+    score = parse_musicxml(score_xml([measure]))
+    assert [(n.onset, n.pitch) for n in score.notes] == [(0, 60), (0, 64), (0, 67), (960, 72)]
+
+
+def test_backup_starts_a_second_voice_at_the_measure_start():
+    measure = (note('E', 5, 8) + '<backup><duration>8</duration></backup>'
+               + note('C', 4, 4) + note('G', 3, 4))
+    score = parse_musicxml(score_xml([measure, note('D', 5, 8)]))
+    assert sorted((n.onset, n.pitch) for n in score.notes) == [(0, 60), (0, 76), (960, 55), (1920, 74)]
+    assert score.measures == [(0, '1'), (1920, '2')]
+    assert score.end_tick == 3840
+
+
+def test_tempo_and_note_events():
+    measure = '<direction><sound tempo="60"/></direction>' + note('A', 4, 2) + note('B', 4, 2)
+    score = parse_musicxml(score_xml([measure]))
+    assert note_events(score) == [[0.0, 1.0, 69, 90, 0], [1.0, 1.0, 71, 90, 0]]
+
+
+@pytest.mark.parametrize('time, key', [
+    ('<beats>4</beats><beat-type>2+2</beat-type>', '0'),
+    ('<beats>3+2</beats><beat-type>8</beat-type>', '0'),
+    ('<beats>4</beats><beat-type>4</beat-type>', 'two'),
+])
+def test_values_the_parser_cannot_read_are_unsupported(time, key):
+    # UnsupportedScore sends the score to the music21 fallback instead of failing the conversion
+    attributes = (f'<attributes><divisions>1</divisions><key><fifths>{key}</fifths></key>'
+                  f'<time>{time}</time></attributes>')
+    with pytest.raises(UnsupportedScore):
+        parse_musicxml(score_xml([note('C', 4, 4)], attributes=attributes))
+
+
+def test_timewise_and_malformed_scores_are_unsupported():
+    with pytest.raises(UnsupportedScore):
+        parse_musicxml(b'<score-timewise/>')
+    with pytest.raises(UnsupportedScore):
+        parse_musicxml(b'<score-partwise><part')
+
+
+def test_transposition_moves_notes_and_keys():
+    assert transpose_key_signatures([(0, 2, False)], 3) == [(0, -1, False)]  # D major -> F major
+    assert transpose_key_signatures([(0, -3, True)], 12) == [(0, -3, True)]
+    score = parse_musicxml(score_xml([note('C', 4, 8)], parts=('P1', 'P2')))
+    result = transform_score(score, transpose=-2, tempo_scale=2.0, parts=['P2'])
+    assert [(n.pitch, n.part) for n in result.notes] == [(58, 0)]
+    assert [part.id for part in result.parts] == ['P2']
+    assert result.tempos == [(0, 240.0)]
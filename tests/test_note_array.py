@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from musicxml_midi import note_events, parse_musicxml, transform_score, write_midi  # noqa: E402
+from note_array import NoteArray, load_note_array  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(ROOT, 'audiveris_output', 'testimage.mxl')
+
+
+@pytest.fixture(scope='module')
+def score():
+    return parse_musicxml(SAMPLE)
+
+
+def test_matches_the_known_good_midi(score):
+    with open(os.path.join(ROOT, 'tests', 'data', 'testimage.mid'), 'rb') as f:
+        assert NoteArray.from_score(score).to_midi() == f.read()
+
+
+def test_operations_match_the_score_transforms(score):
+    array = NoteArray.from_score(score).transpose(5).scale_tempo(1.5)
+    expected = transform_score(score, transpose=5, tempo_scale=1.5)
+    assert array.to_midi() == write_midi(expected)
+    assert array.events() == note_events(expected)
+
+
+def test_transpose_drops_notes_out_of_range(score):
+    array = NoteArray.from_score(score)
+    highest = int(array.notes['pitch'].max())
+    assert len(array.transpose(127 - highest).notes) == len(array.notes)
+    assert len(array.transpose(128 - highest).notes) < len(array.notes)
+    assert len(array.transpose(40000).notes) == 0  # would wrap around in int16
+    assert len(array.transpose(-40000).notes) == 0
+
+
+def test_cached_array_is_reused(score, tmp_path):
+    cache_path = str(tmp_path / 'testimage.notes')
+    built = load_note_array(SAMPLE, cache_path)
+    assert os.path.exists(cache_path)
+    cached = load_note_array(os.path.join(str(tmp_path), 'missing.mxl'), cache_path)
+    assert cached.to_midi() == built.to_midi()
+
+
+@pytest.mark.parametrize('factor', [0, -1.0, float('nan'), float('inf')])
+def test_tempo_scale_must_be_a_positive_number(score, factor):
+    with pytest.raises(ValueError):
+        NoteArray.from_score(score).scale_tempo(factor)
@@ -0,0 +1,85 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+pytest.importorskip('fitz')
+
+from musicxml_midi import UnsupportedScore, parse_musicxml  # noqa: E402
+from pages import stitch_musicxml  # noqa: E402
+
+ATTRIBUTES = ('<attributes><divisions>1</divisions><key><fifths>{fifths}</fifths>{mode}</key>'
+              '<time><beats>{beats}</beats><beat-type>4</beat-type></time><clef><sign>G</sign></clef></attributes>')
+
+
+def page(parts, fifths=0, mode='', beats=4):
+    """A partwise page; ``parts`` lists each part's measures as pitch steps (one whole note each)."""
+    attributes = ATTRIBUTES.format(fifths=fifths, mode=mode and f'<mode>{mode}</mode>', beats=beats)
+    part_list = ''.join(f'<score-part id="P{i}"><part-name>Part {i}</part-name></score-part>'
+                        for i in range(1, len(parts) + 1))
+    body = ''
+    for i, steps in enumerate(parts, start=1):
+        body += f'<part id="P{i}">'
+        for number, step in enumerate(steps, start=1):
+            body += (f'<measure number="{number}">{attributes if number == 1 else ""}'
+                     f'<note><pitch><step>{step}</step><octave>4</octave></pitch><duration>{beats}</duration>'
+                     f'</note></measure>')
+        body += '</part>'
+    return f'<score-partwise><part-list>{part_list}</part-list>{body}</score-partwise>'.encode()
+
+
+def stitched(*pages, **options):
+    return ET.fromstring(stitch_musicxml(list(pages), **options).split(b'\n', 2)[2])
+
+
+def test_measures_are_renumbered_across_pages():
+    root = stitched(page([['C', 'D']]), page([['E', 'F', 'G']]))
+    measures = root.find('part').findall('measure')
+    assert [m.get('number') for m in measures] == ['1', '2', '3', '4', '5']
+    assert [m.findtext('note/pitch/step') for m in measures] == ['C', 'D', 'E', 'F', 'G']
+    # Each page after the first starts on a new page; its restated attributes are dropped
+    assert measures[2].find('print').get('new-page') == 'yes'
+    assert measures[2].find('attributes') is None
+    assert measures[0].find('attributes/key') is not None
+
+
+def test_a_missing_part_is_padded_with_rests():
+    root = stitched(page([['C'], ['E']]), page([['D', 'F']]), page([['G'], ['A'], ['B']]))
+    parts = root.findall('part')
+    assert [p.get('id') for p in parts] == ['P1', 'P2', 'P3']
+    assert [p.get('id') for p in root.find('part-list')] == ['P1', 'P2', 'P3']
+    for part in parts:
+        assert len(part.findall('measure')) == 4
+    second = parts[1].findall('measure')
+    assert [m.find('note/rest') is not None for m in second] == [False, True, True, False]
+    assert second[1].findtext('note/duration') == '4'  # a whole 4/4 measure at one division
+    assert [m.find('note/rest') is not None for m in parts[2].findall('measure')] == [True, True, True, False]
+
+
+def test_the_stitched_score_plays_in_order():
+    score = parse_musicxml(stitch_musicxml([page([['C', 'D']], beats=3), page([['E']], beats=3)]))
+    assert [(n.onset, n.pitch) for n in score.notes] == [(0, 60), (1440, 62), (2880, 64)]
+
+
+def test_systems_keep_real_changes_and_drop_restatements():
+    root = stitched(page([['C']], fifths=0), page([['D']], fifths=0, mode='major'),
+                    page([['E']], fifths=2), page([['F']], fifths=2, beats=3), systems=True)
+    measures = root.find('part').findall('measure')
+    # The second system only spells out the same C major
+    assert measures[1].find('attributes') is None
+    assert measures[1].find('print').get('new-system') == 'yes'
+    assert measures[2].findtext('attributes/key/fifths') == '2'
+    assert measures[3].find('attributes/key') is None
+    assert measures[3].findtext('attributes/time/beats') == '3'
+    assert all(m.find('print') is None or m.find('print').get('new-page') is None for m in measures)
+
+
+def test_pages_can_run_on_without_breaks():
+    root = stitched(page([['C']]), page([['D']]), new_page=False)
+    assert root.find('part/measure[2]/print') is None
+
+
+def test_only_partwise_scores_are_stitched():
+    with pytest.raises(UnsupportedScore):
+        stitch_musicxml([page([['C']]), b'<score-timewise/>'])
+    with pytest.raises(ValueError):
+        stitch_musicxml([])